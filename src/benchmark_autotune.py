@@ -0,0 +1,66 @@
+import argparse
+import os
+import tempfile
+import time
+import cv2
+import numpy as np
+from inference import Autotuner
+from recording import Recording
+from vision import HEIGHT, WIDTH, TargetDetectorMobileNet
+
+# python benchmark_autotune.py [--real --recording PATH] - startup autotuning of the MobileNet input size / threads:
+# what each candidate measures, what gets picked for a target FPS, and a second startup served from the settings cache.
+# Without --real the network is a stand-in whose latency grows with the input area and shrinks with threads (70% of it
+# parallel) and whose confidence drops below 224 px inputs; with --real the clip comes from a recording showing a person
+
+class SyntheticNetwork:
+    def __init__(self, inference_time: float = 0.095):
+        self.inference_time = inference_time # at 300 px, one thread
+        self.size = 300
+
+    def setInput(self, blob):
+        self.size = blob.shape[2]
+
+    def forward(self):
+        threads = max(cv2.getNumThreads(), 1)
+        time.sleep(self.inference_time * (self.size / 300) ** 2 * (0.3 + 0.7 / threads))
+        results = np.zeros((1, 1, 1, 7), dtype=np.float32)
+        results[0, 0, 0] = [0, 15, min(0.9, 0.9 - 0.006 * (224 - self.size)), 0.4, 0.3, 0.6, 0.9]
+        return results
+
+class BenchmarkDetector(TargetDetectorMobileNet):
+    def __init__(self, real: bool):
+        self.real = real
+        super().__init__(confidence=0.7)
+
+    def _load_model(self):
+        if self.real:
+            return super()._load_model()
+        # the thread setting still goes to cv2, the stand-in reads it back
+        cv2.setNumThreads(self.settings.threads if self.settings.threads > 0 else -1)
+        return SyntheticNetwork()
+
+def run(clip: np.ndarray, target_fps: float, cache_path: str, real: bool) -> dict:
+    start = time.perf_counter()
+    detector = BenchmarkDetector(real)
+    tuner = Autotuner(cache_path, target_fps, detector.confidence)
+    settings = detector.autotune(clip, tuner)
+    return { 'settings': settings, 'startup_s': time.perf_counter() - start, 'cached': tuner.cached, 'results': tuner.results }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--real', action='store_true')
+    parser.add_argument('--recording', help='recording with the target in view (for --real)')
+    parser.add_argument('--target-fps', type=float, default=15.0)
+    args = parser.parse_args()
+    clip = Recording(args.recording).clip() if args.recording else np.zeros((10, HEIGHT, WIDTH, 3), dtype=np.uint8)
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, 'inference_settings.json')
+        first = run(clip, args.target_fps, cache_path, args.real)
+        for result in first['results']:
+            print('%-9s %-6s %3d px  threads: %d  %5.1f FPS  confidence: %.2f' % (result.settings.backend, result.settings.target, result.settings.input_size,
+                  result.settings.threads, result.fps, result.confidence))
+        print('target %.0f FPS: picked %s' % (args.target_fps, first['settings']))
+        second = run(clip, args.target_fps, cache_path, args.real)
+        print('startup with tuning: %.2f s  from the cache: %.2f s (cached: %s, same settings: %s)' % (
+            first['startup_s'], second['startup_s'], second['cached'], second['settings'] == first['settings']))
@@ -0,0 +1,69 @@
+import time
+from board import Board
+from fake_smbus import FakeSMBus
+
+# python benchmark_board.py - compares the previous triple-write drive commands against Board.set_drive
+
+def _legacy_write_registers(board: Board, target: int, value: int):
+    with board.mutex:
+        data = [value>>8, value&0xff]
+        for _ in range(3):
+            board.bus.write_i2c_block_data(board.address, target, data)
+            time.sleep(0.001)
+
+def _legacy_drive(board: Board, dir1: int, dir2: int, pwm: int):
+    _legacy_write_registers(board, board.CMD_DIR1, dir1)
+    _legacy_write_registers(board, board.CMD_DIR2, dir2)
+    _legacy_write_registers(board, board.CMD_PWM1, 1000)
+    _legacy_write_registers(board, board.CMD_PWM2, 1000)
+    _legacy_write_registers(board, board.CMD_PWM1, pwm)
+    _legacy_write_registers(board, board.CMD_PWM2, pwm)
+
+def _legacy_stop(board: Board):
+    _legacy_write_registers(board, board.CMD_DIR1, 1)
+    _legacy_write_registers(board, board.CMD_DIR2, 1)
+    _legacy_write_registers(board, board.CMD_PWM1, 0)
+    _legacy_write_registers(board, board.CMD_PWM2, 0)
+
+# typical controller traffic: repeated forwards with occasional turns
+COMMANDS = [ (1, 1), (1, 1), (1, 1), (1, 0), (1, 1), (1, 1), (0, 1), (1, 1) ]
+
+def run(legacy: bool, iterations: int = 200, transaction_time: float = 0.0004, pwm: int = 500) -> dict:
+    bus = FakeSMBus(transaction_time=transaction_time)
+    board = Board(bus=bus)
+    board.stop()
+    bus.reset_counters()
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        dir1, dir2 = COMMANDS[i % len(COMMANDS)]
+        if legacy:
+            _legacy_drive(board, dir1, dir2, pwm)
+        else:
+            board.set_drive(dir1, dir2, pwm, pwm)
+    elapsed = time.perf_counter() - start
+    transactions = bus.transactions
+
+    stop_times = []
+    for _ in range(20):
+        if legacy:
+            _legacy_drive(board, 1, 1, pwm)
+        else:
+            board.forward(pwm)
+        start = time.perf_counter()
+        if legacy:
+            _legacy_stop(board)
+        else:
+            board.stop()
+        stop_times.append(time.perf_counter() - start)
+
+    return {
+        'commands_per_second': iterations / elapsed,
+        'transactions_per_command': transactions / iterations,
+        'time_to_stop_ms': 1000 * sum(stop_times) / len(stop_times),
+    }
+
+if __name__ == '__main__':
+    for name, legacy in (('before', True), ('after', False)):
+        result = run(legacy)
+        print('%-6s commands/s: %8.1f  transactions/command: %5.2f  time to stop: %6.3f ms' % (name, result['commands_per_second'], result['transactions_per_command'], result['time_to_stop_ms']))
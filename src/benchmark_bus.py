@@ -0,0 +1,113 @@
+import logging
+import time
+import numpy as np
+from threading import Thread
+from board import Board
+from compass import Compass
+from compass_sensor import CompassSensor
+from distance_sensor import DistanceSensor
+from simulation import Simulation
+
+# python benchmark_bus.py - sonar sweeps, compass sampling, motor command bursts and emergency stops on one simulated bus,
+# devices with their own bus access (as before the arbiter) vs one shared BusArbiter; then the compass drops off the
+# shared bus: its retries have to back off and stop crowding out the board
+
+def run(shared: bool, duration: float = 3.0) -> dict:
+    simulation = Simulation([ (0.0, 40.0, 10.0) ])
+    board = Board(bus=simulation.arbiter if shared else simulation.bus)
+    compass = Compass(bus=simulation.arbiter if shared else simulation.bus)
+    distance_sensor = DistanceSensor(board, 0, lambda: None)
+    compass_sensor = CompassSensor(compass, sample_buffer_size=int(duration * 400))
+    running = True
+
+    def motor_commands():
+        # alternating directions: every command is a burst of dir + pwm writes
+        commands = [ board.forward, board.turn_left, board.forward, board.turn_right ]
+        i = 0
+        while running:
+            commands[i % len(commands)]()
+            i += 1
+            time.sleep(0.02)
+
+    distance_sensor.start()
+    compass_sensor.start()
+    motor = Thread(target=motor_commands, daemon=True)
+    motor.start()
+    time.sleep(0.3)
+    for arbiter in { board.arbiter, compass.arbiter }:
+        arbiter.reset_stats()
+    since = time.monotonic()
+
+    stop_latencies = []
+    while time.monotonic() - since < duration:
+        time.sleep(0.05)
+        writes = len(simulation.shield.motor_writes)
+        start = time.monotonic()
+        board.emergency_stop()
+        # until both PWM registers were set to 0 on the shield
+        stopped = [ timestamp for timestamp, register, value in simulation.shield.motor_writes[writes:] if register in (board.CMD_PWM1, board.CMD_PWM2) and value == 0 ]
+        if len(stopped) >= 2:
+            stop_latencies.append(stopped[1] - start)
+    samples = len(compass_sensor.get_samples(since))
+
+    running = False
+    motor.join()
+    distance_sensor.stop()
+    compass_sensor.stop()
+    stats = {}
+    for arbiter in { board.arbiter, compass.arbiter }:
+        stats.update(arbiter.get_stats())
+    return {
+        'emergency_stop_ms': 1000 * float(np.mean(stop_latencies)),
+        'emergency_stop_max_ms': 1000 * float(np.max(stop_latencies)),
+        'compass_rate_hz': samples / duration,
+        'compass_queue_delay_p99_ms': 1000 * stats['compass']['queue_delay_p99'],
+        'compass_missed_deadlines': stats['compass']['missed_deadlines'],
+        'board_queue_delay_p99_ms': 1000 * stats['board']['queue_delay_p99'],
+        # separate: each device's busy time includes waiting for the other one inside the bus, so this overestimates
+        'bus_utilization': sum(device['utilization'] for device in stats.values()),
+    }
+
+class LogCounter(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord):
+        self.count += 1
+
+def compass_dropout(duration: float = 3.0) -> dict:
+    simulation = Simulation([ (0.0, 40.0, 10.0) ])
+    board = Board(bus=simulation.arbiter)
+    compass = Compass(bus=simulation.arbiter)
+    distance_sensor = DistanceSensor(board, 0, lambda: None)
+    compass_sensor = CompassSensor(compass)
+    log = LogCounter()
+    compass_sensor.logger.addHandler(log)
+    distance_sensor.start()
+    compass_sensor.start()
+    time.sleep(0.3)
+    del simulation.bus.devices[compass.address]
+    simulation.arbiter.reset_stats()
+    time.sleep(duration)
+    stats = simulation.arbiter.get_stats()
+    distance_sensor.stop()
+    compass_sensor.stop()
+    compass_sensor.logger.removeHandler(log)
+    return {
+        'compass_errors_per_second': stats['compass']['errors'] / duration,
+        'compass_missed_deadlines': stats['compass']['missed_deadlines'],
+        'compass_utilization': stats['compass']['utilization'],
+        'log_lines': log.count,
+        'board_queue_delay_p99_ms': 1000 * stats['board']['queue_delay_p99'],
+    }
+
+if __name__ == '__main__':
+    for name, shared in (('separate', False), ('shared', True)):
+        result = run(shared)
+        print('%-8s emergency stop: %6.3f ms (max %6.3f)  compass: %5.1f Hz, p99 queueing %6.3f ms, %3d late  board p99 queueing: %6.3f ms  bus utilization: %4.0f%%' % (
+            name, result['emergency_stop_ms'], result['emergency_stop_max_ms'], result['compass_rate_hz'], result['compass_queue_delay_p99_ms'],
+            result['compass_missed_deadlines'], result['board_queue_delay_p99_ms'], 100 * result['bus_utilization']))
+    result = compass_dropout()
+    print('compass gone: %5.1f errors/s, %d late, %4.1f%% of the bus, %d log lines  board p99 queueing: %6.3f ms' % (
+        result['compass_errors_per_second'], result['compass_missed_deadlines'], 100 * result['compass_utilization'], result['log_lines'], result['board_queue_delay_p99_ms']))
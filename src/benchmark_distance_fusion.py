@@ -0,0 +1,66 @@
+import time
+import numpy as np
+from collections import defaultdict
+from distance_sensor import SweepFusion
+
+# python benchmark_distance_fusion.py - previous defaultdict smoothing vs SweepFusion on synthetic sweeps
+
+def _legacy_smoothing(readings, lower_threshold: float = 5, upper_threshold: float = 70, variance_threshold: float = 0.3, measuring_range: int = 7) -> np.array:
+    distances = defaultdict(list)
+    for angle, distance in readings:
+        if (distance >= lower_threshold and distance <= upper_threshold):
+            for a in range(angle + (-1) * measuring_range, angle + measuring_range + 1):
+                distances[a].append(distance)
+    smoothed_distances = [ (k, np.array(v).mean()) for k, v in distances.items() if np.array(v).var() < variance_threshold ]
+    coordinates = np.array([ [ np.cos(np.radians(angle)) * distance, np.sin(np.radians(angle)) * distance ] for (angle, distance) in smoothed_distances ])
+    return coordinates
+
+def synthetic_sweeps(count: int, min_angle: int = 75, max_angle: int = 105, seed: int = 0):
+    # a wall at ~40cm with a closer box on one side, plus sensor noise and occasional dropouts
+    random = np.random.default_rng(seed)
+    angles = np.arange(min_angle, max_angle + 1)
+    sweeps = []
+    for i in range(count):
+        distances = np.where(angles < 85, 25.0, 40.0) + random.normal(0, 0.2, len(angles))
+        distances[random.random(len(angles)) < 0.05] = 0.0
+        order = angles if i % 2 == 0 else angles[::-1]
+        sweeps.append([ (int(angle), float(distances[angle - min_angle])) for angle in order ])
+    return sweeps
+
+def run(sweeps) -> dict:
+    start = time.perf_counter()
+    for sweep in sweeps:
+        legacy = _legacy_smoothing(sweep)
+    legacy_time = (time.perf_counter() - start) / len(sweeps)
+
+    fusion = SweepFusion()
+    start = time.perf_counter()
+    for sweep in sweeps:
+        fusion.reset()
+        for angle, distance in sweep:
+            fusion.update(angle, distance)
+        profile = fusion.get_profile()
+    rebuild_time = (time.perf_counter() - start) / len(sweeps)
+
+    # incremental: the profile is refreshed after every single reading
+    fusion = SweepFusion()
+    readings = [ reading for sweep in sweeps for reading in sweep ]
+    start = time.perf_counter()
+    for angle, distance in readings:
+        fusion.update(angle, distance)
+        fusion.get_profile()
+    incremental_time = (time.perf_counter() - start) / len(readings)
+
+    return {
+        'legacy_sweep_ms': 1000 * legacy_time,
+        'fusion_sweep_ms': 1000 * rebuild_time,
+        'incremental_update_ms': 1000 * incremental_time,
+        'max_difference': float(np.abs(np.sort(legacy, axis=0) - np.sort(profile, axis=0)).max()) if legacy.shape == profile.shape else float('nan'),
+    }
+
+if __name__ == '__main__':
+    result = run(synthetic_sweeps(200))
+    print('legacy smoothing per sweep:      %8.3f ms' % result['legacy_sweep_ms'])
+    print('SweepFusion per sweep:           %8.3f ms' % result['fusion_sweep_ms'])
+    print('SweepFusion per reading (fused): %8.3f ms' % result['incremental_update_ms'])
+    print('max coordinate difference:       %8.2e' % result['max_difference'])
@@ -0,0 +1,131 @@
+import math
+import time
+import numpy as np
+from threading import Thread
+from typing import Optional
+from board import Board
+from follow_controller import FollowController
+from motor_controller import Direction, MotorController
+from simulation import Simulation
+from snapshots import Snapshot, SnapshotStore
+from vision import FIELD_OF_VIEW, WIDTH, HEIGHT, Target
+
+# python benchmark_follow.py - following a target walking across the simulated world, pulse-based steering vs the PID follow controller
+
+class SimulatedTargetDetector:
+    # projects a moving world point into the camera at the detection rate, results arrive `latency` after their frame
+    def __init__(self, simulation: Simulation, start: tuple, velocity: tuple, rate: float = 10.0, latency: float = 0.1):
+        self.environment = simulation.environment
+        self.start_position = start
+        self.velocity = velocity
+        self.rate = rate
+        self.latency = latency
+        self.targets = SnapshotStore()
+        self.origin = time.monotonic()
+        self.running = False
+        self.sequence = 0
+
+    def position(self, now: float) -> tuple:
+        t = now - self.origin
+        return self.start_position[0] + self.velocity[0] * t, self.start_position[1] + self.velocity[1] * t
+
+    def bearing(self, now: float) -> float:
+        x, y, heading = self.environment.get_pose()
+        target_x, target_y = self.position(now)
+        return (math.degrees(math.atan2(target_x - x, target_y - y)) - heading + 180) % 360 - 180
+
+    def start(self):
+        self.running = True
+        Thread(target=self._detect, daemon=True).start()
+
+    def _detect(self):
+        while self.running:
+            timestamp = time.monotonic()
+            bearing = self.bearing(timestamp)
+            time.sleep(self.latency)
+            self.sequence += 1
+            if abs(bearing) < FIELD_OF_VIEW / 2:
+                x = int(WIDTH / 2 + bearing / (FIELD_OF_VIEW / 2) * WIDTH / 2)
+                self.targets.publish(Target(x, HEIGHT // 2, 50, 100, 'detection', 1.0, timestamp, self.sequence), timestamp)
+            time.sleep(max(1.0 / self.rate - self.latency, 0))
+
+    def predict_target(self, target: Target, timestamp: Optional[float] = None) -> Target:
+        return target
+
+    def wait_for_target(self, version: int = 0, timeout: Optional[float] = None) -> Optional[Snapshot]:
+        return self.targets.wait_for(version, timeout)
+
+def pulse_control(detector, motor_controller: MotorController, running: list):
+    # the notebook's bang-bang steering: side thirds turn for a duration scaled by the offset, the middle drives forward
+    direction = None
+    side_ratio = 0.33
+    version = 0
+    while running:
+        snapshot = detector.wait_for_target(version, 0.05)
+        if snapshot:
+            version = snapshot.version
+            x = snapshot.value.x
+            if x < side_ratio * WIDTH:
+                new_direction = Direction.LEFT
+                duration = (1 - x / (side_ratio * WIDTH)) * 0.25 + 0.25
+            elif x > (1 - side_ratio) * WIDTH:
+                new_direction = Direction.RIGHT
+                duration = (x - (1 - side_ratio) * WIDTH) / (side_ratio * WIDTH) * 0.25 + 0.25
+            else:
+                new_direction, duration = Direction.FORWARD, 1.0
+            if new_direction == direction and new_direction in (Direction.LEFT, Direction.RIGHT):
+                new_direction = Direction.NONE
+            direction = new_direction
+            motor_controller.send_direction(direction, duration)
+
+def run(mode: str, duration: float = 8.0, tolerance: float = 5.0) -> dict:
+    simulation = Simulation()
+    board = Board(bus=simulation.arbiter)
+    motor_controller = MotorController(board)
+    # target 2.5 m away, 25 degrees to the right, walking to the left
+    detector = SimulatedTargetDetector(simulation, (117.0, 227.0), (-15.0, 5.0))
+    motor_controller.start()
+    detector.start()
+    running = [ True ]
+    if mode == 'pid':
+        follower = FollowController(detector, motor_controller)
+        follower.start()
+    else:
+        follower = Thread(target=pulse_control, args=(detector, motor_controller, running), daemon=True)
+        follower.start()
+
+    start = time.monotonic()
+    bearings, headings = [], []
+    while time.monotonic() - start < duration:
+        bearings.append(detector.bearing(time.monotonic()))
+        headings.append(simulation.environment.get_pose()[2])
+        time.sleep(0.01)
+    running.clear()
+    if mode == 'pid':
+        follower.stop()
+    else:
+        follower.join()
+    motor_controller.stop()
+    detector.running = False
+
+    bearings = np.abs(np.array(bearings))
+    outside = np.nonzero(bearings > tolerance)[0]
+    settled = outside[-1] + 1 if len(outside) else 0
+    converged = settled < len(bearings)
+    turn_rate = np.diff(np.unwrap(np.radians(headings)))
+    reversals = int(np.count_nonzero(np.diff(np.sign(turn_rate[np.abs(turn_rate) > 1e-4])) != 0))
+    x, y, _ = simulation.environment.get_pose()
+    return {
+        'converged': bool(converged),
+        'time_to_converge_s': float(settled * 0.01) if converged else float('nan'),
+        'bearing_rms_deg': float(np.sqrt(np.mean(bearings ** 2))),
+        'turn_reversals': reversals,
+        'motor_writes': len(simulation.shield.motor_writes),
+        'distance_travelled_cm': math.hypot(x, y),
+    }
+
+if __name__ == '__main__':
+    for mode in ('pulse', 'pid'):
+        result = run(mode)
+        print('%-5s converged: %-5s in %5.2f s  bearing rms: %5.1f deg  turn reversals: %3d  motor writes: %4d  travelled: %5.0f cm' % (
+            mode, result['converged'], result['time_to_converge_s'], result['bearing_rms_deg'], result['turn_reversals'], result['motor_writes'], result['distance_travelled_cm']))
@@ -0,0 +1,65 @@
+import argparse
+import time
+import numpy as np
+from fake_camera import SyntheticCamera
+from vision import FPS, TargetDetectorMobileNet
+
+# python benchmark_inference_workers.py [--real] - throughput, capture-to-target latency and drops for 1-4 inference workers
+# without --real the network is a stand-in that blocks for the measured MobileNet latency (GIL released, like cv2.dnn)
+
+class SyntheticNetwork:
+    def __init__(self, inference_time: float):
+        self.inference_time = inference_time
+        self.results = np.zeros((1, 1, 1, 7), dtype=np.float32)
+        self.results[0, 0, 0] = [0, 15, 0.9, 0.4, 0.3, 0.6, 0.9]
+
+    def setInput(self, blob):
+        pass
+
+    def forward(self):
+        time.sleep(self.inference_time)
+        return self.results
+
+class BenchmarkDetector(TargetDetectorMobileNet):
+    def __init__(self, workers: int, queue_depth: int, real: bool, inference_time: float = 0.095):
+        self.real = real
+        self.network_time = inference_time # not inference_time: the detector measures that one
+        super().__init__(confidence=0.5, workers=workers, queue_depth=queue_depth)
+
+    def _load_model(self):
+        return super()._load_model() if self.real else SyntheticNetwork(self.network_time)
+
+    def _open_camera(self):
+        return SyntheticCamera(fps=FPS)
+
+def run(workers: int, queue_depth: int = 1, real: bool = False, duration: float = 5.0) -> dict:
+    detector = BenchmarkDetector(workers, queue_depth, real)
+    detector.start()
+    time.sleep(1.0)
+    detections, dropped, stale, frames = detector.detections, detector.dropped_frames + detector.frames.dropped, detector.stale_results, detector.frames.sequence
+    detector.latencies.clear()
+    start = time.perf_counter()
+    time.sleep(duration)
+    elapsed = time.perf_counter() - start
+    result = {
+        'workers': workers,
+        'throughput_fps': (detector.detections - detections) / elapsed,
+        'latency_ms': 1000 * float(np.mean(detector.latencies)) if detector.latencies else float('nan'),
+        'latency_p90_ms': 1000 * float(np.percentile(detector.latencies, 90)) if detector.latencies else float('nan'),
+        'captured_frames': detector.frames.sequence - frames,
+        'dropped_frames': detector.dropped_frames + detector.frames.dropped - dropped, # frames never inferred: queues full or overwritten in the ring
+        'stale_results': detector.stale_results - stale,
+    }
+    detector.running = False
+    time.sleep(0.3)
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--real', action='store_true', help='use the MobileNet-SSD model files from the working directory')
+    parser.add_argument('--queue-depth', type=int, default=1)
+    args = parser.parse_args()
+    for workers in range(1, 5):
+        result = run(workers, args.queue_depth, args.real)
+        print('workers: %d  throughput: %5.1f FPS  latency: %6.1f ms (p90 %6.1f)  captured: %4d  dropped: %4d  stale: %3d' % (
+            workers, result['throughput_fps'], result['latency_ms'], result['latency_p90_ms'], result['captured_frames'], result['dropped_frames'], result['stale_results']))
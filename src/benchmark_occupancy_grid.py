@@ -0,0 +1,77 @@
+import math
+import time
+import numpy as np
+from occupancy_grid import OccupancyGrid, servo_to_bearing
+from simulation import Environment
+
+# python benchmark_occupancy_grid.py - per-sweep update time of the log-odds grid at Pi-sized configurations,
+# plus a map quality check against a scripted scene while the robot drives through it (window scrolling); then an
+# obstacle that goes away: the sweeps without an echo have to clear it, sweeps of invalid readings must not change it
+
+OBSTACLES = [ (4.0, 60.0, 8.0), (-25.0, 80.0, 10.0), (30.0, 110.0, 6.0) ]
+
+def sweep(environment: Environment, angles: np.ndarray, noise: float, rng: np.random.Generator) -> np.ndarray:
+    distances = np.array([ environment.range(90.0 - angle) for angle in angles ])
+    distances = np.where(np.isinf(distances), 0.0, distances + rng.normal(0, noise, len(distances)))
+    return distances
+
+def run(size: int, resolution: float, min_angle: int = 75, max_angle: int = 105, sweeps: int = 60, noise: float = 0.3) -> dict:
+    rng = np.random.default_rng(0)
+    environment = Environment(OBSTACLES)
+    grid = OccupancyGrid(size, resolution)
+    angles = np.arange(min_angle, max_angle + 1, dtype=float)
+    times = []
+    for i in range(sweeps):
+        # drive north, 1 cm per sweep, heading wobbling a little
+        heading = 5.0 * math.sin(i / 5)
+        environment.set_pose(0.0, float(i), heading)
+        distances = sweep(environment, angles[::-1] if i % 2 else angles, noise, rng)
+        start = time.perf_counter()
+        grid.update(servo_to_bearing(angles[::-1] if i % 2 else angles, heading), distances, 0.0, float(i))
+        times.append(time.perf_counter() - start)
+
+    # map quality: obstacle surfaces facing the robot (within the swept field and range) should be occupied, the space in between free
+    y = float(sweeps - 1)
+    surface = []
+    for ox, oy, radius in OBSTACLES:
+        distance = math.hypot(ox, oy - y)
+        bearing = math.degrees(math.atan2(ox, oy - y))
+        if distance - radius < grid.max_range and abs(bearing) <= (max_angle - min_angle) / 2 + 7.5:
+            surface.append((ox - radius * ox / distance, oy - radius * (oy - y) / distance))
+    occupied = np.mean([ grid.probability_at(x, y) > 0.7 for x, y in surface ]) if surface else float('nan')
+    free = np.mean([ grid.probability_at(0.0, y) < 0.3 for y in np.arange(sweeps + 5, 50, 2.0) ]) if sweeps + 5 < 50 else float('nan')
+    return {
+        'update_ms': 1000 * float(np.median(times)),
+        'update_p99_ms': 1000 * float(np.percentile(times, 99)),
+        'grid_kib': grid.log_odds.nbytes / 1024,
+        'obstacles_occupied': float(occupied),
+        'free_space_free': float(free),
+    }
+
+def removed_obstacle(sweeps: int = 20, noise: float = 0.3) -> dict:
+    # parked in front of a post, then the post is taken away
+    rng = np.random.default_rng(0)
+    environment = Environment([ (0.0, 40.0, 5.0) ])
+    grid = OccupancyGrid()
+    angles = np.arange(75, 106, dtype=float)
+    bearings = servo_to_bearing(angles, 0.0)
+    for _ in range(sweeps):
+        grid.update(bearings, sweep(environment, angles, noise, rng), 0.0, 0.0)
+    seen = grid.probability_at(0.0, 35.0)
+    grid.update(bearings, np.full(len(angles), np.nan), 0.0, 0.0)
+    invalid = grid.probability_at(0.0, 35.0)
+    environment = Environment([])
+    for _ in range(sweeps):
+        grid.update(bearings, sweep(environment, angles, noise, rng), 0.0, 0.0)
+    return { 'seen': seen, 'after_invalid': invalid, 'after_removal': grid.probability_at(0.0, 35.0) }
+
+if __name__ == '__main__':
+    for size, resolution in ((64, 4.0), (128, 2.0), (200, 2.0), (256, 1.0)):
+        for min_angle, max_angle in ((75, 105), (45, 135)):
+            result = run(size, resolution, min_angle, max_angle, sweeps=40)
+            print('%3dx%-3d @ %3.1f cm  %3d beams  update: %6.2f ms (p99 %6.2f)  grid: %5.0f KiB  obstacles occupied: %4.0f%%  free space free: %4.0f%%' % (
+                size, size, resolution, max_angle - min_angle + 1, result['update_ms'], result['update_p99_ms'], result['grid_kib'],
+                100 * result['obstacles_occupied'], 100 * result['free_space_free']))
+    result = removed_obstacle()
+    print('post removed: occupancy %.3f while seen, %.3f after an invalid sweep, %.3f after 20 sweeps without an echo (%s)' % (
+        result['seen'], result['after_invalid'], result['after_removal'], 'ok' if result['after_removal'] < 0.5 and result['after_invalid'] == result['seen'] else 'FAIL'))
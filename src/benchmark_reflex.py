@@ -0,0 +1,95 @@
+import time
+import numpy as np
+from threading import Thread
+from board import Board
+from distance_sensor import DistanceSensor
+from fake_smbus import FakeSMBus
+from motor_controller import MotorController
+from simulation import Simulation
+
+# python benchmark_reflex.py - obstacle approaching a simulated board, reports reaction time of the reflex stop;
+# then a parked car sweeping past a depth edge (a post 44 cm ahead, a wall at 150 cm behind it), which must not stop;
+# last a car driven straight at a post (surface at 27 cm) by a continuous command stream, which must stay short of it
+
+def _set_sonic_distance(bus: FakeSMBus, board: Board, distance: float):
+    sonic_time = int(max(distance, 0) / (0.5 * 343.0 / 10000.0))
+    bus.registers[board.address][board.CMD_SONIC] = sonic_time >> 8
+    bus.registers[board.address][board.CMD_SONIC + 1] = sonic_time & 0xff
+
+def run(start_distance: float = 60.0, speed: float = 30.0, stop_distance: float = 10.0) -> dict:
+    bus = FakeSMBus()
+    board = Board(bus=bus)
+    stopped_at = []
+    sensor = DistanceSensor(board, stop_distance, lambda: stopped_at.append(time.monotonic()))
+    _set_sonic_distance(bus, board, start_distance)
+    board.forward()
+
+    start = time.monotonic()
+    crossing = start + (start_distance - stop_distance) / speed
+    moving = True
+
+    def obstacle():
+        # the obstacle keeps approaching while the wheels turn
+        while moving:
+            distance = start_distance - speed * (time.monotonic() - start)
+            _set_sonic_distance(bus, board, distance)
+            time.sleep(0.001)
+
+    mover = Thread(target=obstacle, daemon=True)
+    mover.start()
+    sensor.start()
+    while not stopped_at and time.monotonic() < crossing + 3.0:
+        time.sleep(0.001)
+    moving = False
+    sensor.stop()
+    mover.join()
+
+    reaction_times = sensor.reflex.get_reaction_times()
+    return {
+        'stopped': bool(stopped_at) and board.get_drive()[2:] == (0, 0),
+        'reaction_time_ms': 1000 * float(np.mean(reaction_times)) if reaction_times else float('nan'),
+        'stop_delay_after_threshold_ms': 1000 * (stopped_at[0] - crossing) if stopped_at else float('nan'),
+        'distance_at_stop': start_distance - speed * (stopped_at[0] - start) if stopped_at else float('nan'),
+    }
+
+def depth_edge(duration: float = 5.0, stop_distance: float = 10.0) -> dict:
+    # parked: the only range changes are the sweep crossing the edges of the post
+    simulation = Simulation([ (0.0, 47.0, 3.0), (0.0, 1150.0, 1000.0) ])
+    board = Board(bus=simulation.arbiter)
+    stops = []
+    sensor = DistanceSensor(board, stop_distance, lambda: stops.append(time.monotonic()))
+    sensor.start()
+    time.sleep(duration)
+    sensor.stop()
+    return { 'emergency_stops': len(stops), 'sweeps': sensor.profiles.version }
+
+def command_stream(duration: float = 6.0, stop_distance: float = 10.0, surface: float = 27.0) -> dict:
+    # drive(0.3) at 10 Hz keeps asking for forward motion after the reflex stopped the car
+    simulation = Simulation([ (0.0, surface + 3.0, 3.0) ])
+    board = Board(bus=simulation.arbiter)
+    stops = []
+    sensor = DistanceSensor(board, stop_distance, lambda: stops.append(time.monotonic()))
+    motor_controller = MotorController(board)
+    sensor.start()
+    motor_controller.start()
+    closest = 0.0
+    start = time.monotonic()
+    while time.monotonic() - start < duration:
+        motor_controller.drive(0.3, 0.0)
+        closest = max(closest, simulation.environment.get_pose()[1])
+        time.sleep(0.1)
+    motor_controller.stop()
+    sensor.stop()
+    return { 'emergency_stops': len(stops), 'max_y': closest, 'surface': surface, 'blocked_commands': board.blocked_commands.snapshot() }
+
+if __name__ == '__main__':
+    result = run()
+    print('stopped: %s' % result['stopped'])
+    print('reaction time (first ping -> motors stopped): %5.3f ms' % result['reaction_time_ms'])
+    print('stop relative to threshold crossing:       %7.1f ms (negative: closing speed stopped earlier)' % result['stop_delay_after_threshold_ms'])
+    print('obstacle distance at stop:                 %7.1f cm' % result['distance_at_stop'])
+    result = depth_edge()
+    print('parked at a depth edge:  %d emergency stops over %d sweeps (%s)' % (result['emergency_stops'], result['sweeps'], 'ok' if result['emergency_stops'] == 0 else 'FAIL'))
+    result = command_stream()
+    print('driven at a post:        %d emergency stops, %d forward commands blocked, closest approach y=%.1f cm, surface at %.1f cm (%s)' % (
+        result['emergency_stops'], result['blocked_commands'], result['max_y'], result['surface'], 'ok' if result['max_y'] < result['surface'] else 'FAIL'))
@@ -0,0 +1,100 @@
+import math
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from typing import Optional, Tuple
+from compass import CompassSample
+from compass_sensor import CompassSensor
+from distance_sensor import DistanceSensor
+from fake_camera import SyntheticCamera
+from recording import Recorder, Recording, ReplayBoard, ReplayCamera, ReplayClock, ReplayCompass
+from vision import TargetDetector
+
+# python benchmark_replay.py [recording] - replays a recording (default: a synthetic one) as fast as possible through
+# DistanceSensor, CompassSensor and a TargetDetector, twice, to check the results are deterministic
+
+class ReplayDetector(TargetDetector):
+    # blob preparation only, measures the pipeline rather than a network
+    def _call_model(self, image):
+        return cv2.dnn.blobFromImage(image, 0.007843, (300, 300), 127.5, swapRB=True)
+
+    def _find_object(self, results, image, object_class: int, confidence_threshold: float, timestamp: Optional[float] = None) -> Optional[Tuple[int, int, int, int, float]]:
+        return None
+
+def record_synthetic(path: str, duration: float = 5.0):
+    recorder = Recorder(path, max_frames=int(duration * 15))
+    camera = SyntheticCamera()
+    random = np.random.default_rng(0)
+    for i in range(int(duration * 15)):
+        _, image = camera.retrieve()
+        recorder.record_frame(i / 15, i, image)
+    angle, step = 75, 1
+    for i in range(int(duration / 0.0075)):
+        distance = (30.0 if 82 <= angle <= 88 else 60.0) + random.normal(0, 0.3)
+        recorder.record_sonic(i * 0.0075, angle, distance)
+        if i % 2 == 1:
+            angle += step
+            if angle in (75, 105):
+                step = -step
+    for i in range(int(duration * 200)):
+        heading = math.radians(30 * i / 200)
+        recorder.record_compass(CompassSample(i / 200, int(1000 * math.cos(heading)), int(1000 * math.sin(heading)), 0, 0, 1))
+    recorder.close()
+
+def replay(path: str) -> dict:
+    recording = Recording(path)
+    clock = ReplayClock(recording.start_time(), realtime=False)
+
+    board = ReplayBoard(recording, clock)
+    distance_sensor = DistanceSensor(board, 10, lambda: None)
+    start = time.perf_counter()
+    sweeps = []
+    reverse = False
+    while board.index < len(recording.sonic):
+        sweeps.append(distance_sensor._get_distance_ahead_smoothed(reverse))
+        reverse = not reverse
+    sonic_time = time.perf_counter() - start
+
+    compass_sensor = CompassSensor(ReplayCompass(recording, clock))
+    start = time.perf_counter()
+    compass_sensor.start()
+    while compass_sensor.compass.is_data_ready():
+        time.sleep(0.001)
+    compass_sensor.stop()
+    compass_time = time.perf_counter() - start
+
+    detector = ReplayDetector()
+    detector.load() # up front: no frame is skipped while the model loads
+    camera = ReplayCamera(recording, clock)
+    start = time.perf_counter()
+    detector.start(camera)
+    while camera.index + 1 < len(recording.frames) or detector.frames.last_read < detector.frames.sequence - 1:
+        time.sleep(0.001)
+    frame_time = time.perf_counter() - start
+    detector.running = False
+    detector.camera_thread.join()
+    detector.detect_thread.join()
+
+    return {
+        'sonic_samples_per_second': len(recording.sonic) / sonic_time,
+        'compass_samples_per_second': len(recording.compass) / compass_time,
+        'frames_per_second': len(recording.frames) / frame_time,
+        'frames_detected': detector.detections,
+        'last_sweep': sweeps[-1],
+        'last_heading': compass_sensor.get_heading(),
+    }
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        path = tempfile.mkdtemp(prefix='robotcar-recording-')
+        record_synthetic(path)
+    first, second = replay(path), replay(path)
+    print('sonic:   %9.0f samples/s' % first['sonic_samples_per_second'])
+    print('compass: %9.0f samples/s' % first['compass_samples_per_second'])
+    print('camera:  %9.0f frames/s (%d detected)' % (first['frames_per_second'], first['frames_detected']))
+    # profile coordinates only: their third column is the wall-clock read time
+    print('deterministic: %s' % (np.array_equal(first['last_sweep'][:, :2], second['last_sweep'][:, :2]) and first['last_heading'] == second['last_heading']))
@@ -0,0 +1,73 @@
+import time
+import numpy as np
+from board import Board
+from distance_sensor import DistanceSensor, FixedSweep, ServoModel
+from simulation import Simulation
+
+# python benchmark_servo_sweep.py - stepped vs continuous sweeps on a simulated servo with dead time, slower reverse
+# travel and gear play: sweeps per second, and how far each reading's angle is from where the sensor actually pointed
+# when it pinged (the simulated horn angle), with and without the calibrated lag model.
+# The baseline is the stepped sweep as it was (a degree per reading, no settling). Both kinds are bound by the ping
+# rate, continuous sweeps are no faster at the same spacing (0.95-1.06x over runs here, the ramp ends with the servo lag);
+# they only sweep faster with fewer readings, where they keep the angle accuracy a coarser stepped sweep loses
+
+OBSTACLES = [ (0.0, 45.0, 10.0), (-20.0, 35.0, 6.0), (25.0, 60.0, 8.0) ]
+# calibration needs edges inside the swept arc
+CALIBRATION_OBSTACLES = [ (-6.0, 30.0, 4.0), (10.0, 45.0, 4.0) ]
+SERVO = { 'servo_dead_time': 0.025, 'servo_reverse_speed': 350.0, 'servo_backlash': 1.5 }
+SWEEP_SPEED = 100.0 # deg/s, a degree per ping
+FAST_SWEEP_SPEED = 200.0 # about the spacing of a stepped sweep every 2 degrees
+
+def setup(continuous: bool, obstacles: list = OBSTACLES, sweep_speed: float = SWEEP_SPEED, step: int = 1) -> tuple:
+    simulation = Simulation(obstacles, **SERVO)
+    board = Board(bus=simulation.arbiter)
+    sensor = DistanceSensor(board, 0, lambda: None, scheduler=FixedSweep(step), continuous=continuous, sweep_speed=sweep_speed)
+    return simulation, sensor
+
+def calibrate(sweeps: int = 3, sweep_speed: float = SWEEP_SPEED) -> ServoModel:
+    simulation, sensor = setup(True, CALIBRATION_OBSTACLES, sweep_speed)
+    return sensor.calibrate_servo(sweeps)
+
+def run(continuous: bool, servo_model: ServoModel, duration: float = 5.0, sweep_speed: float = SWEEP_SPEED, step: int = 1) -> dict:
+    simulation, sensor = setup(continuous, sweep_speed=sweep_speed, step=step)
+    sensor.servo_model = servo_model
+    sensor._get_distance_ahead_smoothed(True) # ends at the start of the first timed sweep
+    errors = { False: [], True: [] }
+    sweeps = readings = 0
+    reverse = False
+    start = time.monotonic()
+    while time.monotonic() - start < duration:
+        sensor._get_distance_ahead_smoothed(reverse)
+        pings = np.array(simulation.shield.ping_angles)
+        sweep = np.array(sensor.sweep_readings)
+        # the echo a reading returns is the one pinged last before it
+        pinged = pings[np.searchsorted(pings[:, 0], sweep[:, 0], side='right') - 1, 1]
+        errors[reverse].extend(sweep[:, 1] - pinged)
+        sweeps += 1
+        readings += len(sweep)
+        reverse = not reverse
+    elapsed = time.monotonic() - start
+    result = { 'sweeps_per_second': sweeps / elapsed, 'readings_per_sweep': readings / sweeps }
+    for reverse, name in ((False, 'forward'), (True, 'reverse')):
+        error = np.array(errors[reverse])
+        result[name + '_bias'] = float(np.mean(error))
+        result[name + '_p95'] = float(np.percentile(np.abs(error), 95))
+    return result
+
+if __name__ == '__main__':
+    models = {}
+    for sweep_speed in (SWEEP_SPEED, FAST_SWEEP_SPEED):
+        models[sweep_speed] = model = calibrate(sweep_speed=sweep_speed)
+        print('calibrated lag at %.0f deg/s: forward %.1f ms, reverse %.1f ms (simulated dead time %.1f ms, %.1f deg play, reverse %.0f deg/s)' % (
+            sweep_speed, 1000 * model.lag, 1000 * model.reverse_lag, 1000 * SERVO['servo_dead_time'], SERVO['servo_backlash'], SERVO['servo_reverse_speed']))
+    uncalibrated = ServoModel()
+    baseline = None
+    for name, continuous, servo_model, sweep_speed, step in (
+            ('stepped (baseline)', False, uncalibrated, SWEEP_SPEED, 1), ('stepped, settled', False, models[SWEEP_SPEED], SWEEP_SPEED, 1),
+            ('continuous, no lag model', True, uncalibrated, SWEEP_SPEED, 1), ('continuous', True, models[SWEEP_SPEED], SWEEP_SPEED, 1),
+            ('stepped, every 2 deg', False, uncalibrated, SWEEP_SPEED, 2), ('continuous, %.0f deg/s' % FAST_SWEEP_SPEED, True, models[FAST_SWEEP_SPEED], FAST_SWEEP_SPEED, 1)):
+        result = run(continuous, servo_model, sweep_speed=sweep_speed, step=step)
+        baseline = baseline or result['sweeps_per_second']
+        print('%-25s sweeps/s: %5.2f (%4.2fx stepped)  readings/sweep: %5.1f  angle error forward: %+5.1f deg (p95 %4.1f)  reverse: %+5.1f deg (p95 %4.1f)' % (
+            name, result['sweeps_per_second'], result['sweeps_per_second'] / baseline, result['readings_per_sweep'], result['forward_bias'], result['forward_p95'],
+            result['reverse_bias'], result['reverse_p95']))
@@ -0,0 +1,78 @@
+import math
+import time
+from board import Board
+from distance_sensor import DistanceSensor
+from i2c_bus import Priority
+from simulation import Simulation
+
+# python benchmark_sonar.py - per-angle sonar estimates on a simulated shield with noise, dropouts and stray echoes:
+# the previous path (pointer write + read per byte, two pings 5 ms apart averaged) vs block reads paced by the ping
+# interval with agreeing-echo estimates
+
+OBSTACLES = [ (0.0, 45.0, 10.0), (-20.0, 35.0, 6.0), (25.0, 60.0, 8.0) ]
+UPPER_THRESHOLD = 70.0
+
+def legacy_distance(board: Board) -> float:
+    # as before: four transactions per reading, two readings 5 ms apart averaged
+    total = 0.0
+    for _ in range(2):
+        _, high_byte, _, low_byte = board._transfer(Priority.SONAR, [
+            ('write_byte', (board.address, board.CMD_SONIC)),
+            ('read_byte_data', (board.address, board.CMD_SONIC)),
+            ('write_byte', (board.address, board.CMD_SONIC + 1)),
+            ('read_byte_data', (board.address, board.CMD_SONIC + 1)),
+        ])
+        sonic_time = high_byte << 8 | low_byte if high_byte < board.SONIC_MAX_HIGH_BYTE else 0
+        total += sonic_time * 0.5 * 343.0 / 10000.0
+        time.sleep(0.005)
+    return total / 2
+
+def run(mode: str, duration: float = 3.0, noise: float = 0.5, dropout_rate: float = 0.05, outlier_rate: float = 0.05, tolerance: float = 3.0) -> dict:
+    simulation = Simulation(OBSTACLES, sonar_noise=noise, sonar_dropout_rate=dropout_rate, sonar_outlier_rate=outlier_rate)
+    board = Board(bus=simulation.arbiter)
+    sensor = DistanceSensor(board, 0, lambda: None)
+    angles = list(range(75, 106)) + list(range(105, 74, -1))
+    estimates = correct = wrong = missed = 0
+    simulation.bus.reset_counters()
+    sensor.pings.reset()
+    start = time.monotonic()
+    while time.monotonic() - start < duration:
+        for angle in angles:
+            board.set_servo_angle(board.CMD_SERVO1, angle)
+            time.sleep(0.002) # servo step
+            distance = legacy_distance(board) if mode == 'legacy' else sensor._get_distance(angle)
+            truth = simulation.environment.range(90.0 - angle)
+            estimates += 1
+            if math.isnan(distance):
+                # pings disagreed, no estimate either way
+                missed += 1
+            elif math.isinf(truth) or truth > UPPER_THRESHOLD:
+                # nothing in range: any reading inside the range would put a phantom obstacle into the profile
+                if 0 < distance <= UPPER_THRESHOLD:
+                    wrong += 1
+                else:
+                    correct += 1
+            elif distance <= 0:
+                missed += 1
+            elif abs(distance - truth) > tolerance:
+                wrong += 1
+            else:
+                correct += 1
+    elapsed = time.monotonic() - start
+    shield_reads = simulation.bus.transactions[board.address]
+    return {
+        'estimates_per_second': estimates / elapsed,
+        'trustworthy_per_second': correct / elapsed,
+        'outlier_rate': wrong / estimates,
+        'missed_rate': missed / estimates,
+        'transactions_per_estimate': shield_reads / estimates, # includes the servo write
+        'pings_per_estimate': sensor.pings.value / estimates if mode != 'legacy' else 2.0,
+    }
+
+if __name__ == '__main__':
+    for dropout_rate, outlier_rate in ((0.0, 0.0), (0.05, 0.05), (0.1, 0.1)):
+        for mode in ('legacy', 'robust'):
+            result = run(mode, dropout_rate=dropout_rate, outlier_rate=outlier_rate)
+            print('dropouts %3.0f%% stray echoes %3.0f%%  %-6s  estimates/s: %5.1f  trustworthy/s: %5.1f  outliers: %5.1f%%  missed: %5.1f%%  pings/estimate: %4.2f  transactions/estimate: %4.1f' % (
+                100 * dropout_rate, 100 * outlier_rate, mode, result['estimates_per_second'], result['trustworthy_per_second'], 100 * result['outlier_rate'],
+                100 * result['missed_rate'], result['pings_per_estimate'], result['transactions_per_estimate']))
@@ -0,0 +1,73 @@
+import json
+import resource
+import subprocess
+import sys
+import time
+
+# python benchmark_startup.py - cold start per detector class, each in a fresh interpreter: time to import vision,
+# which heavy backend modules that pulls in, construction time, model load + warm-up time and peak RSS after each step.
+# "eager" imports what vision used to at module level (ultralytics, matplotlib) for comparison.
+# The load step needs the model files in the working directory
+
+HEAVY_MODULES = ('torch', 'ultralytics', 'matplotlib', 'onnxruntime')
+
+def peak_rss_mib() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KiB on Linux
+
+def measure(detector_class: str) -> dict:
+    start = time.perf_counter()
+    missing = []
+    if detector_class == 'eager':
+        # not installed here: the comparison is made without it, reported as missing
+        try:
+            import ultralytics
+        except ImportError:
+            missing.append('ultralytics')
+        try:
+            from matplotlib import pyplot
+        except ImportError:
+            missing.append('matplotlib')
+    import vision
+    result = { 'import_s': time.perf_counter() - start, 'import_rss_mib': peak_rss_mib(),
+               'heavy_modules': [ name for name in HEAVY_MODULES if name in sys.modules ], 'missing_modules': missing }
+    if detector_class == 'eager':
+        return result
+    start = time.perf_counter()
+    detector = getattr(vision, detector_class)()
+    result['construct_s'] = time.perf_counter() - start
+    start = time.perf_counter()
+    try:
+        detector.load()
+        result['load_s'] = time.perf_counter() - start
+    except Exception as e:
+        result['load_error'] = str(e).splitlines()[0] if str(e) else type(e).__name__
+    result['load_rss_mib'] = peak_rss_mib()
+    result['loaded_modules'] = [ name for name in HEAVY_MODULES if name in sys.modules ]
+    return result
+
+def run(detector_class: str) -> dict:
+    process = subprocess.run([ sys.executable, __file__, '--child', detector_class ], capture_output=True, text=True)
+    if process.returncode != 0:
+        # e.g. vision itself cannot be imported here, the last line of the traceback says why
+        lines = process.stderr.strip().splitlines()
+        return { 'error': lines[-1] if lines else 'exit code %d' % process.returncode }
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--child':
+        print(json.dumps(measure(sys.argv[2])))
+        sys.exit(0)
+    for detector_class in ('eager', 'TargetDetectorMobileNet', 'TargetDetectorYolo'):
+        result = run(detector_class)
+        if 'error' in result:
+            print('%-24s failed: %s' % (detector_class, result['error']))
+            continue
+        line = '%-24s import: %6.0f ms  peak RSS: %5.0f MiB  imported: %-24s' % (
+            detector_class, 1000 * result['import_s'], result['import_rss_mib'], ','.join(result['heavy_modules']) or '-')
+        if result['missing_modules']:
+            line += '  not installed: %s' % ','.join(result['missing_modules'])
+        if 'construct_s' in result:
+            load = '%6.2f s' % result['load_s'] if 'load_s' in result else 'failed (%s)' % result['load_error']
+            line += '  construct: %5.1f ms  load + warm-up: %s  peak RSS: %5.0f MiB  loaded: %s' % (
+                1000 * result['construct_s'], load, result['load_rss_mib'], ','.join(result['loaded_modules']) or '-')
+        print(line)
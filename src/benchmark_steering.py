@@ -0,0 +1,115 @@
+import math
+import time
+import numpy as np
+from benchmark_follow import SimulatedTargetDetector
+from board import Board
+from compass import Compass
+from compass_sensor import CompassSensor
+from distance_sensor import AdaptiveSweep, DistanceSensor, SweepFusion
+from follow_controller import FollowController
+from motor_controller import MotorController
+from simulation import Environment, Simulation
+from steering import AvoidanceController, VectorFieldHistogram
+
+# python benchmark_steering.py - VFH update time on random synthetic obstacle scenes, direction flapping between two
+# similar gaps with and without hysteresis, and driving to a target behind an obstacle (follow controller vs avoidance)
+
+def profile(environment: Environment, fusion: SweepFusion, noise: float, rng: np.random.Generator) -> np.ndarray:
+    fusion.reset()
+    for angle in range(fusion.min_angle, fusion.max_angle + 1):
+        distance = environment.range(90.0 - angle)
+        fusion.update(angle, 0.0 if math.isinf(distance) else distance + rng.normal(0, noise))
+    return fusion.get_profile()
+
+def update_time(bin_width: float, scenes: int = 200, obstacles: int = 4) -> dict:
+    rng = np.random.default_rng(0)
+    fusion = SweepFusion()
+    histogram = VectorFieldHistogram(bin_width)
+    times, points = [], []
+    for i in range(scenes):
+        environment = Environment([ (rng.uniform(-40, 40), rng.uniform(10, 70), rng.uniform(3, 12)) for _ in range(obstacles) ])
+        coordinates = profile(environment, fusion, 0.3, rng)
+        points.append(len(coordinates))
+        start = time.perf_counter()
+        histogram.update(coordinates, rng.uniform(-30, 30), rng.uniform(0, 360), float(i))
+        times.append(time.perf_counter() - start)
+    return { 'update_us': 1e6 * float(np.median(times)), 'update_p99_us': 1e6 * float(np.percentile(times, 99)), 'points': float(np.mean(points)) }
+
+def flapping(hysteresis: bool, updates: int = 200) -> int:
+    # an obstacle straight ahead, its surface right at the blocking distance, and the target behind it: both gaps are
+    # equally good and noise decides; counts changes of the chosen direction by more than a bin
+    rng = np.random.default_rng(1)
+    environment = Environment([ (0.0, 38.0, 8.0) ])
+    fusion = SweepFusion()
+    if hysteresis:
+        histogram = VectorFieldHistogram()
+    else:
+        histogram = VectorFieldHistogram(near=30.0, far=30.0, previous_weight=0.0)
+    bearings = []
+    for i in range(updates):
+        steering = histogram.update(profile(environment, fusion, 1.0, rng), rng.normal(0, 2.0), rng.normal(0, 1.0) % 360, 0.1 * i)
+        bearings.append(steering.bearing if steering.bearing is not None else np.nan)
+    bearings = np.array(bearings)
+    return int(np.count_nonzero(np.abs(np.diff(bearings)) > histogram.bin_width))
+
+def drive(mode: str, duration: float = 20.0, obstacle: tuple = (0.0, 60.0, 10.0), goal: tuple = (0.0, 180.0), **options) -> dict:
+    simulation = Simulation([ obstacle ])
+    board = Board(bus=simulation.arbiter)
+    compass_sensor = CompassSensor(Compass(bus=simulation.arbiter))
+    # 'avoid+adaptive': the controller's direction steers the sweep
+    scheduler = AdaptiveSweep() if mode == 'avoid+adaptive' else None
+    distance_sensor = DistanceSensor(board, 0, lambda: None, profile_interval=8, scheduler=scheduler)
+    motor_controller = MotorController(board)
+    detector = SimulatedTargetDetector(simulation, goal, (0.0, 0.0))
+    if mode.startswith('avoid'):
+        # 'avoid+pose': the simulated pose as odometry
+        position = (lambda: simulation.environment.get_pose()[:2]) if mode == 'avoid+pose' else None
+        controller = AvoidanceController(distance_sensor, detector, motor_controller, compass_sensor, position=position, **options)
+    else:
+        controller = FollowController(detector, motor_controller)
+    compass_sensor.start()
+    distance_sensor.start()
+    motor_controller.start()
+    detector.start()
+    time.sleep(0.5)
+    controller.start()
+
+    start = time.monotonic()
+    clearance, reached = math.inf, None
+    focus_errors = []
+    while time.monotonic() - start < duration:
+        if scheduler is not None and controller.steering is not None and controller.steering.bearing is not None and scheduler.focus is not None:
+            # servo angle the sweep centres on vs the controller's chosen direction
+            focus_errors.append(abs(scheduler.focus - (90.0 - controller.steering.bearing)))
+        x, y, _ = simulation.environment.get_pose()
+        clearance = min(clearance, math.hypot(x - obstacle[0], y - obstacle[1]) - obstacle[2])
+        if math.hypot(x - goal[0], y - goal[1]) < 40.0:
+            reached = time.monotonic() - start
+            break
+        time.sleep(0.01)
+    controller.stop()
+    motor_controller.stop()
+    distance_sensor.stop()
+    compass_sensor.stop()
+    detector.running = False
+    return {
+        'reached_s': reached if reached is not None else float('nan'),
+        # centre of the robot to the obstacle surface, the body is ~9 cm around the centre
+        'min_clearance_cm': clearance,
+        'profiles': distance_sensor.profiles.version,
+        'focus_error_deg': float(np.mean(focus_errors)) if focus_errors else float('nan'),
+    }
+
+if __name__ == '__main__':
+    for bin_width in (10.0, 5.0, 2.0, 1.0):
+        result = update_time(bin_width)
+        print('bins: %3d (%4.1f deg)  update: %6.1f us (p99 %6.1f)  points per profile: %4.1f' % (
+            int(360 / bin_width), bin_width, result['update_us'], result['update_p99_us'], result['points']))
+    for hysteresis in (False, True):
+        print('hysteresis: %-5s  direction changes over 200 noisy updates: %3d' % (hysteresis, flapping(hysteresis)))
+    for mode in ('follow', 'avoid', 'avoid+pose', 'avoid+adaptive'):
+        result = drive(mode)
+        line = '%-14s reached target: %5.1f s  min clearance: %6.1f cm  profiles: %3d' % (mode, result['reached_s'], result['min_clearance_cm'], result['profiles'])
+        if mode == 'avoid+adaptive':
+            line += '  sweep focus vs chosen direction: %.1f deg' % result['focus_error_deg']
+        print(line)
@@ -0,0 +1,179 @@
+import argparse
+import json
+import time
+import numpy as np
+from threading import Thread
+from board import Board
+from compass import Compass
+from compass_sensor import CompassSensor
+from distance_sensor import DistanceSensor
+from motor_controller import Direction, MotorController
+from simulation import Simulation
+from benchmark_tracking import SyntheticDetector
+
+# python benchmark_suite.py [--output run.json] [--compare baseline.json] - end-to-end benchmarks on the simulated hardware
+
+OBSTACLES = [ (10.0, 40.0, 8.0), (-25.0, 60.0, 10.0) ]
+
+def bench_commands(iterations: int = 50) -> dict:
+    simulation = Simulation(OBSTACLES)
+    board = Board(bus=simulation.arbiter)
+    board.stop()
+    commands = [ board.forward, board.forward, board.turn_left, board.forward, board.turn_right, board.stop ]
+    simulation.bus.reset_counters()
+    start = time.perf_counter()
+    for i in range(iterations):
+        commands[i % len(commands)]()
+    elapsed = time.perf_counter() - start
+    return {
+        'i2c_transactions_per_command': simulation.bus.total_transactions() / iterations,
+        'command_ms': 1000 * elapsed / iterations,
+    }
+
+def bench_motor_loop(duration: float = 2.0) -> dict:
+    # bus load of an idle and a driving MotorController and the delay from send_direction to the first motor write
+    simulation = Simulation()
+    board = Board(bus=simulation.arbiter)
+    motor_controller = MotorController(board)
+    motor_controller.start()
+    time.sleep(0.1)
+    simulation.bus.reset_counters()
+    time.sleep(duration)
+    idle = simulation.bus.total_transactions() / duration
+    writes = len(simulation.shield.motor_writes)
+    sent = time.monotonic()
+    motor_controller.send_direction(Direction.FORWARD, duration + 1.0)
+    while len(simulation.shield.motor_writes) == writes and time.monotonic() < sent + 1.0:
+        time.sleep(0.0002)
+    pickup = simulation.shield.motor_writes[writes][0] - sent if len(simulation.shield.motor_writes) > writes else float('nan')
+    time.sleep(0.1)
+    simulation.bus.reset_counters()
+    time.sleep(duration)
+    driving = simulation.bus.total_transactions() / duration
+    motor_controller.stop()
+    return {
+        'idle_i2c_per_second': idle,
+        'driving_i2c_per_second': driving,
+        'command_pickup_ms': 1000 * pickup,
+    }
+
+def bench_sweep(sweeps: int = 4) -> dict:
+    simulation = Simulation(OBSTACLES)
+    board = Board(bus=simulation.arbiter)
+    sensor = DistanceSensor(board, 5, lambda: None)
+    simulation.bus.reset_counters()
+    start = time.perf_counter()
+    points = 0
+    for i in range(sweeps):
+        points += len(sensor._get_distance_ahead_smoothed(i % 2 == 1))
+    elapsed = time.perf_counter() - start
+    return {
+        'sweep_ms': 1000 * elapsed / sweeps,
+        'sweep_i2c_transactions': simulation.bus.total_transactions() / sweeps,
+        'sweep_points': points / sweeps,
+    }
+
+def bench_heading(duration: float = 2.0) -> dict:
+    simulation = Simulation()
+    simulation.environment.set_pose(0, 0, 359)
+    sensor = CompassSensor(Compass(bus=simulation.arbiter), sample_buffer_size=int(duration * 400))
+    sensor.start()
+    time.sleep(0.2)
+    since = time.monotonic()
+    simulation.bus.reset_counters()
+    time.sleep(duration)
+    samples = len(sensor.get_samples(since))
+    heading = sensor.get_heading()
+    sensor.stop()
+    error = abs((heading.heading - 359 + 180) % 360 - 180) if heading else float('nan')
+    return {
+        'heading_rate_hz': samples / duration,
+        'compass_i2c_per_sample': simulation.bus.total_transactions() / max(samples, 1),
+        'heading_error_deg': error,
+    }
+
+def bench_detection(duration: float = 3.0) -> dict:
+    detector = SyntheticDetector(tracking=False)
+    detector.start()
+    time.sleep(0.5)
+    detections = detector.detections
+    start = time.perf_counter()
+    time.sleep(duration)
+    fps = (detector.detections - detections) / (time.perf_counter() - start)
+    detector.running = False
+    time.sleep(0.2)
+    return { 'detection_fps': fps }
+
+def bench_end_to_end(trials: int = 5) -> dict:
+    # target appears in the camera -> detector -> control loop -> MotorController -> first motor register write
+    simulation = Simulation()
+    board = Board(bus=simulation.arbiter)
+    motor_controller = MotorController(board)
+    detector = SyntheticDetector(tracking=False)
+    detector.start()
+    motor_controller.start()
+    camera = detector.camera
+    camera.visible = False
+    running = True
+
+    def control():
+        version = 0
+        while running:
+            snapshot = detector.wait_for_target(version, 0.05)
+            if snapshot:
+                version = snapshot.version
+                motor_controller.send_direction(Direction.FORWARD, 0.2)
+
+    controller = Thread(target=control, daemon=True)
+    controller.start()
+    latencies = []
+    for _ in range(trials):
+        time.sleep(0.5)
+        writes = len(simulation.shield.motor_writes)
+        appeared = time.monotonic()
+        camera.visible = True
+        deadline = appeared + 2.0
+        while time.monotonic() < deadline:
+            started = [ timestamp for timestamp, register, value in simulation.shield.motor_writes[writes:] if register in (4, 5) and value > 0 ]
+            if started:
+                latencies.append(started[0] - appeared)
+                break
+            time.sleep(0.001)
+        camera.visible = False
+        time.sleep(0.5)
+    running = False
+    controller.join()
+    motor_controller.stop()
+    detector.running = False
+    time.sleep(0.2)
+    return {
+        'target_to_motor_ms': 1000 * float(np.mean(latencies)) if latencies else float('nan'),
+        'target_to_motor_max_ms': 1000 * float(np.max(latencies)) if latencies else float('nan'),
+    }
+
+BENCHMARKS = { 'commands': bench_commands, 'motor_loop': bench_motor_loop, 'sweep': bench_sweep, 'heading': bench_heading, 'detection': bench_detection, 'end_to_end': bench_end_to_end }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--only', nargs='*', choices=list(BENCHMARKS), help='run a subset of the benchmarks')
+    args = parser.parse_args()
+
+    results = {}
+    for name, benchmark in BENCHMARKS.items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = benchmark()
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    for name, values in results.items():
+        for key, value in values.items():
+            previous = baseline.get(name, {}).get(key)
+            change = ' (was %.3f)' % previous if previous is not None else ''
+            print('%-12s %-32s %10.3f%s' % (name, key, value, change))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,93 @@
+import numpy as np
+from board import Board
+from distance_sensor import AdaptiveSweep, DistanceSensor, FixedSweep, SweepFusion
+from fake_smbus import FakeSMBus
+
+# python benchmark_sweep_scheduler.py - fixed vs adaptive sweeps on a synthetic scene (no servo/sonar timing, counts samples);
+# then the box is removed, its fused points have to be gone after a few passes, and once the scan window moves away from
+# the box, the readings no longer revisited have to age out (max_age of the fusion); last the sweep a DistanceSensor
+# schedules for the focus it is given (bearing relative to the robot, as from the steering)
+
+SAMPLE_TIME = 0.016 # servo write + two sonic reads with 5ms gaps
+
+def scene(angle: int) -> float:
+    # a box slightly right of centre at 30cm, free space (no echo within range) elsewhere
+    return 30.0 if 82 <= angle <= 88 else 0.0
+
+def empty_scene(angle: int) -> float:
+    return 0.0
+
+def run(scheduler, focus: float = 90, passes: int = 50, noise: float = 0.2, seed: int = 0, fusion: SweepFusion = None, scene=scene, start: float = 0.0) -> dict:
+    random = np.random.default_rng(seed)
+    fusion = fusion or SweepFusion()
+    samples = 0
+    obstacle_updates = 0
+    focus_refreshes = 0
+    for i in range(passes):
+        for angle in scheduler.angles(fusion, i % 2 == 1):
+            distance = scene(angle)
+            if distance > 0:
+                distance += random.normal(0, noise)
+                obstacle_updates += 1
+            if abs(angle - focus) <= 2:
+                focus_refreshes += 1
+            # simulated time, SAMPLE_TIME per sample
+            fusion.update(angle, distance, start + (samples + 1) * SAMPLE_TIME)
+            samples += 1
+    return {
+        'samples_per_pass': samples / passes,
+        'passes_per_second': passes / (samples * SAMPLE_TIME),
+        'samples_per_obstacle_update': samples / max(obstacle_updates, 1),
+        'focus_updates_per_second': focus_refreshes / (samples * SAMPLE_TIME),
+        'obstacle_points': len(fusion.get_profile()),
+        'end': start + samples * SAMPLE_TIME,
+    }
+
+def removed_obstacle(passes: int = 5) -> int:
+    # the focused adaptive sweep refines around the box, then the box goes: fused points left after `passes` clear passes
+    scheduler = AdaptiveSweep()
+    scheduler.set_focus(90)
+    fusion = SweepFusion()
+    result = run(scheduler, fusion=fusion)
+    return run(scheduler, passes=passes, fusion=fusion, scene=empty_scene, start=result['end'])['obstacle_points']
+
+def window_moved(focus: float = 100, passes: int = 20) -> tuple:
+    # the window moves off the box (82-88 degrees): fused points after a pass and after `passes` passes
+    scheduler = AdaptiveSweep()
+    scheduler.set_focus(90)
+    fusion = SweepFusion()
+    end = run(scheduler, fusion=fusion)['end']
+    scheduler.set_focus(focus)
+    result = run(scheduler, focus=focus, passes=1, fusion=fusion, start=end)
+    first = result['obstacle_points']
+    return first, run(scheduler, focus=focus, passes=passes, fusion=fusion, start=result['end'])['obstacle_points']
+
+def follows_focus() -> list:
+    # (bearing, turning, servo angles of the next pass) per focus input
+    sensor = DistanceSensor(Board(bus=FakeSMBus()), 0, lambda: None, scheduler=AdaptiveSweep())
+    passes = []
+    for bearing, turning in ((None, False), (-10.0, False), (12.0, False), (12.0, True)):
+        sensor.set_focus(bearing, turning)
+        passes.append((bearing, turning, list(sensor.scheduler.angles(sensor.fusion))))
+    return passes
+
+if __name__ == '__main__':
+    adaptive = AdaptiveSweep()
+    adaptive.set_focus(90)
+    turning = AdaptiveSweep()
+    turning.set_focus(90, turning=True)
+    for name, scheduler in (('fixed', FixedSweep()), ('adaptive', adaptive), ('adaptive (turning)', turning)):
+        result = run(scheduler)
+        print('%-18s samples/pass: %5.1f  passes/s: %5.2f  samples per obstacle update: %5.2f  focus updates/s: %6.2f  fused points: %d' % (
+            name, result['samples_per_pass'], result['passes_per_second'], result['samples_per_obstacle_update'], result['focus_updates_per_second'], result['obstacle_points']))
+    left = removed_obstacle()
+    print('box removed:  %d fused points left after 5 clear passes (%s)' % (left, 'ok' if left == 0 else 'FAIL'))
+    first, left = window_moved()
+    print('window moved: %d fused points left after a pass, %d after 20 passes (max_age %.1f s, %s)' % (first, left, SweepFusion().max_age, 'ok' if left == 0 else 'FAIL'))
+    fusion = SweepFusion()
+    for bearing, turning, angles in follows_focus():
+        # servo 90 is ahead, larger angles to the left (negative bearings)
+        expected = (fusion.min_angle, fusion.max_angle) if bearing is None or turning else (
+            max(int(90 - bearing) - AdaptiveSweep().scan_width, fusion.min_angle), min(int(90 - bearing) + AdaptiveSweep().scan_width, fusion.max_angle))
+        print('focus %-5s turning: %-5s  swept %3d-%3d deg in %2d samples (%s)' % (
+            '-' if bearing is None else '%+.0f' % bearing, turning, min(angles), max(angles), len(angles), 'ok' if (min(angles), max(angles)) == expected else 'FAIL'))
@@ -0,0 +1,81 @@
+import time
+import cv2
+from typing import Optional, Tuple
+from fake_camera import SyntheticCamera
+from vision import FPS, TargetDetector
+
+# python benchmark_vision_pipeline.py - detection FPS and process CPU% with the frame ring vs the previous copy-and-spin loop
+
+class SyntheticDetector(TargetDetector):
+    # fixed-cost stand-in for the network so only the pipeline overhead differs
+    def __init__(self, inference_time: float = 0.02):
+        super().__init__(logger_name='SyntheticDetector')
+        self.inference_time = inference_time
+
+    def _open_camera(self):
+        return SyntheticCamera(fps=FPS)
+
+    def _call_model(self, image):
+        blob = cv2.dnn.blobFromImage(image, 0.007843, (300, 300), 127.5, swapRB=True)
+        time.sleep(self.inference_time)
+        return blob
+
+    def _find_object(self, results, image, object_class: int, confidence_threshold: float, timestamp: Optional[float] = None) -> Optional[Tuple[int, int, int, int, float]]:
+        return None
+
+class LegacySyntheticDetector(SyntheticDetector):
+    # the previous single-image handoff: copy + cvtColor per frame, detector polls without waiting
+    def start(self):
+        self.image = None
+        self.has_image = False
+        super().start()
+
+    def _capture(self):
+        while self.running:
+            try:
+                for _ in range(2):
+                    self.camera.grab()
+                has_image, image = self.camera.retrieve()
+                if has_image:
+                    with self.target_lock:
+                        self.image = image
+                        self.has_image = True
+            finally:
+                time.sleep(1.0 / (FPS-1))
+
+    def _detect(self):
+        while self.running:
+            image = None
+            with self.target_lock:
+                if self.has_image:
+                    image = self.image.copy()
+                    self.has_image = False
+            if image is not None:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                self._call_model(image)
+                self.detections += 1
+
+    def _call_model(self, image):
+        blob = cv2.dnn.blobFromImage(image, 0.007843, (300, 300), 127.5)
+        time.sleep(self.inference_time)
+        return blob
+
+def run(detector: TargetDetector, duration: float = 3.0) -> dict:
+    detector.start()
+    time.sleep(0.5)
+    detections = detector.detections
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    time.sleep(duration)
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    detections = detector.detections - detections
+    detector.running = False
+    time.sleep(0.2)
+    return {
+        'detection_fps': detections / wall,
+        'cpu_percent': 100 * cpu / wall,
+    }
+
+if __name__ == '__main__':
+    for name, detector in (('before', LegacySyntheticDetector()), ('after', SyntheticDetector())):
+        result = run(detector)
+        print('%-6s detection FPS: %5.1f  CPU: %5.1f%%' % (name, result['detection_fps'], result['cpu_percent']))
@@ -1,6 +1,12 @@
-import smbus
 import time
 from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+from metrics import registry
+from i2c_bus import BatchError, Operation, Priority, get_arbiter
+
+def moves_forward(dir1: int, dir2: int, pwm1: int, pwm2: int) -> bool:
+    # the wheels together push the car forward (dir 1 = forward); turning in place or reversing does not
+    return (pwm1 if dir1 else -pwm1) + (pwm2 if dir2 else -pwm2) > 0
 
 class Board:
     CMD_SERVO1 = 0
@@ -10,87 +16,160 @@ class Board:
     CMD_DIR2 = 7
     CMD_SONIC = 12
     SONIC_MAX_HIGH_BYTE = 50
+    SONIC_PING_INTERVAL = 0.01 # the shield starts a new ping at most this often, reads in between return the last echo
     SERVO_MAX_PULSE_WIDTH = 2500
     SERVO_MIN_PULSE_WIDTH = 500
-    
-    def __init__(self, addr=0x18):
+    WRITE_RETRIES = 2
+    RETRY_DELAY = 0.001
+
+    def __init__(self, addr=0x18, bus=None):
+        # bus: a BusArbiter shared with the other devices, or a raw smbus-like bus for a private one
         self.address = addr
-        self.bus=smbus.SMBus(1)
-        self.bus.open(1)
+        self.arbiter = get_arbiter(bus)
+        self.bus = self.arbiter.bus
         self.mutex = Lock()
+        # last value successfully written per register, used to skip redundant writes
+        self.registers: Dict[int, int] = {}
+        self.recorder = None
+        self.i2c_errors = registry.counter('i2c.errors')
+        self.transactions = registry.counter('board.i2c_transactions')
+        # motor register writes only (set_drive, emergency_stop), the sonar and servo traffic is in i2c_transactions
+        self.motor_writes = registry.counter('board.motor_writes')
+        self.drive_generation = 0
+        # set by a held emergency stop: drive commands that move the car forward are replaced by stopped motors until
+        # release_stop(), turning in place and reversing still go through
+        self.forward_blocked = False
+        self.blocked_commands = registry.counter('board.blocked_drive_commands')
+
+    def _transfer(self, priority: Priority, operations: List[Operation]) -> List[Any]:
+        try:
+            results = self.arbiter.execute('board', priority, operations)
+        except BatchError as e:
+            self.transactions.inc(e.index + 1)
+            raise
+        self.transactions.inc(len(operations))
+        return results
+
+    def _write_batch(self, writes: List[Tuple[int, int]], priority: Priority) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]:
+        # one bus request for all writes, a failed write is retried together with the rest of the batch,
+        # once it keeps failing the rest is given up; returns (written, failed)
+        written, pending = [], list(writes)
+        failures = 0
+        while pending:
+            try:
+                self._transfer(priority, [ ('write_i2c_block_data', (self.address, target, [value>>8, value&0xff])) for target, value in pending ])
+                return written + pending, []
+            except BatchError as e:
+                print('I2C Error :', e.error)
+                self.i2c_errors.inc()
+                written += pending[:e.index]
+                pending = pending[e.index:]
+                failures = failures + 1 if e.index == 0 else 1
+                if failures > self.WRITE_RETRIES:
+                    break
+                time.sleep(self.RETRY_DELAY)
+        return written, pending
 
     def _write_registers(self, target: int, value: any):
         with self.mutex:
+            self._apply_writes([(target, value)], force=True, priority=Priority.SONAR)
+
+    def _apply_writes(self, writes: List[Tuple[int, int]], force: bool = False, priority: Priority = Priority.MOTOR) -> int:
+        # caller holds the mutex: writes changed registers back-to-back in one batch, returns the number of bus writes
+        # that went through
+        changed = []
+        registers = dict(self.registers)
+        for target, value in writes:
             value = int(value)
-            data = [value>>8, value&0xff]
-            try:
-                self.bus.write_i2c_block_data(self.address, target, data)
-                time.sleep(0.001)
-                self.bus.write_i2c_block_data(self.address, target, data)
-                time.sleep(0.001)
-                self.bus.write_i2c_block_data(self.address, target, data)
-                time.sleep(0.001)
-            except Exception as e:
-                print('I2C Error :', e)
-
-    def _read_register(self, target: int) -> int:		
-        with self.mutex:
-            self.bus.write_byte(self.address, target)
-            high_byte = self.bus.read_byte_data(self.address, target)
-            
-            self.bus.write_byte(self.address, target + 1)
-            low_byte = self.bus.read_byte_data(self.address, target + 1)
-            
-            if(high_byte < self.SONIC_MAX_HIGH_BYTE):
-                return high_byte << 8 | low_byte
-            else:
-                return 0
+            if not force and registers.get(target) == value:
+                continue
+            registers[target] = value
+            changed.append((target, value))
+        if not changed:
+            return 0
+        written, failed = self._write_batch(changed, priority)
+        for target, value in written:
+            self.registers[target] = value
+        for target, _ in failed:
+            self.registers.pop(target, None)
+        return len(written)
+
+    def _read_register(self, target: int) -> int:
+        # no mutex: the arbiter serializes the bus and reads do not touch the register cache;
+        # high and low byte in one block read (one transaction instead of pointer write + read per byte)
+        high_byte, low_byte = self._transfer(Priority.SONAR, [ ('read_i2c_block_data', (self.address, target, 2)) ])[0]
+        if(high_byte < self.SONIC_MAX_HIGH_BYTE):
+            return high_byte << 8 | low_byte
+        else:
+            return 0
 
     def _convert_angle_to_servo_pwm(self, angle: float) -> int:
         return int((self.SERVO_MAX_PULSE_WIDTH - self.SERVO_MIN_PULSE_WIDTH) * angle / 180.0 + self.SERVO_MIN_PULSE_WIDTH)
 
+    def get_drive(self) -> Optional[Tuple[int, int, int, int]]:
+        with self.mutex:
+            try:
+                return tuple(self.registers[target] for target in (self.CMD_DIR1, self.CMD_DIR2, self.CMD_PWM1, self.CMD_PWM2))
+            except KeyError:
+                return None
+
+    def reset_drive_state(self):
+        # forget the cached motor state, the next set_drive writes every register again
+        with self.mutex:
+            for target in (self.CMD_DIR1, self.CMD_DIR2, self.CMD_PWM1, self.CMD_PWM2):
+                self.registers.pop(target, None)
+
+    def set_drive(self, dir1: int, dir2: int, pwm1: int, pwm2: int, force: bool = False) -> int:
+        with self.mutex:
+            if self.forward_blocked and moves_forward(dir1, dir2, pwm1, pwm2):
+                pwm1 = pwm2 = 0
+                self.blocked_commands.inc()
+            writes = [(self.CMD_DIR1, dir1), (self.CMD_DIR2, dir2), (self.CMD_PWM1, pwm1), (self.CMD_PWM2, pwm2)]
+            if self.recorder:
+                self.recorder.record_motor(time.monotonic(), dir1, dir2, pwm1, pwm2)
+            count = self._apply_writes(writes, force)
+            self.motor_writes.inc(count)
+            # counted once the writes are on the bus, see emergency_stop
+            self.drive_generation += 1
+            return count
+
     def stop(self):
-        self._write_registers(self.CMD_DIR1, 1)
-        self._write_registers(self.CMD_DIR2, 1)
-        
-        self._write_registers(self.CMD_PWM1, 0)
-        self._write_registers(self.CMD_PWM2, 0)
-    
-    def forward(self, pwm: int = 500):
-        self._write_registers(self.CMD_DIR1, 1)
-        self._write_registers(self.CMD_DIR2, 1)
+        self.set_drive(1, 1, 0, 0)
+
+    def emergency_stop(self, hold: bool = False):
+        # cuts both PWM registers unconditionally, bypassing the change-only cache, the motor queue and the register mutex
+        # (a motor command holding it may itself still be waiting for the bus); hold: block forward drive commands until
+        # release_stop()
+        if hold:
+            self.forward_blocked = True
+        generation = self.drive_generation
+        written, _ = self._write_batch([(self.CMD_PWM1, 0), (self.CMD_PWM2, 0)], Priority.EMERGENCY)
+        self.motor_writes.inc(len(written))
+        with self.mutex:
+            if self.drive_generation != generation:
+                # a drive command went out after the stop, the emergency stop wins
+                self.motor_writes.inc(self._apply_writes([(self.CMD_PWM1, 0), (self.CMD_PWM2, 0)], force=True, priority=Priority.EMERGENCY))
+            else:
+                for target, value in written:
+                    self.registers[target] = value
+            if self.recorder:
+                self.recorder.record_motor(time.monotonic(), self.registers.get(self.CMD_DIR1, 1), self.registers.get(self.CMD_DIR2, 1), 0, 0)
+
+    def release_stop(self):
+        with self.mutex:
+            self.forward_blocked = False
 
-        self._write_registers(self.CMD_PWM1, 1000)
-        self._write_registers(self.CMD_PWM2, 1000)
-        self._write_registers(self.CMD_PWM1, pwm)
-        self._write_registers(self.CMD_PWM2, pwm)
+    def forward(self, pwm: int = 500):
+        self.set_drive(1, 1, pwm, pwm)
 
     def backward(self, pwm: int = 500):
-        self._write_registers(self.CMD_DIR1, 0)
-        self._write_registers(self.CMD_DIR2, 0)
-        
-        self._write_registers(self.CMD_PWM1, 1000)
-        self._write_registers(self.CMD_PWM2, 1000)
-        self._write_registers(self.CMD_PWM1, pwm)
-        self._write_registers(self.CMD_PWM2, pwm)
+        self.set_drive(0, 0, pwm, pwm)
 
     def turn_left(self, pwm: int = 500):
-        self._write_registers(self.CMD_DIR1, 1)
-        self._write_registers(self.CMD_DIR2, 0)
-        
-        self._write_registers(self.CMD_PWM1, 1000)
-        self._write_registers(self.CMD_PWM2, 1000)
-        self._write_registers(self.CMD_PWM1, pwm)
-        self._write_registers(self.CMD_PWM2, pwm)
-    
+        self.set_drive(1, 0, pwm, pwm)
+
     def turn_right(self, pwm: int = 500):
-        self._write_registers(self.CMD_DIR1, 0)
-        self._write_registers(self.CMD_DIR2, 1)
-        
-        self._write_registers(self.CMD_PWM1, 1000)
-        self._write_registers(self.CMD_PWM2, 1000)
-        self._write_registers(self.CMD_PWM1, pwm)
-        self._write_registers(self.CMD_PWM2, pwm)
+        self.set_drive(0, 1, pwm, pwm)
 
     def set_servo_angle(self, servo: int, angle: float):
         self._write_registers(servo, self._convert_angle_to_servo_pwm(angle))
@@ -98,4 +177,4 @@ class Board:
     def get_sonic_distance(self):
         sonic_time = self._read_register(self.CMD_SONIC)
         distance = sonic_time * 0.5 * 343.0 / 10000.0
-        return distance
\ No newline at end of file
+        return distance
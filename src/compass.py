@@ -1,15 +1,31 @@
 # https://github.com/e-Gizmo/QMC5883L-GY-271-Compass-module/blob/master/QMC5883L%20Datasheet%201.0%20.pdf
-import smbus
 import time
 from threading import Lock
 import ctypes
 import math
+from typing import NamedTuple, Optional
+from i2c_bus import Priority, get_arbiter
+
+class CompassSample(NamedTuple):
+    timestamp: float
+    x: int
+    y: int
+    z: int
+    temperature: int
+    status: int
 
 class Compass:
+    DATA_REGISTER =         0x00
+    STATUS_REGISTER =       0x06
     CONFIG_REGISTER_1 =     0x09
     CONFIG_REGISTER_2 =     0x0A
     RESET_REGISTER =        0x0B
-    
+    DATA_LENGTH =           9 # 0x00 - 0x08: X, Y, Z, status, temperature
+
+    STATUS_DRDY =           0b001
+    STATUS_OVL =            0b010
+    STATUS_DOR =            0b100
+
     STANDBY_MODE =          0b00 << 0
     CONTINUOUS_MODE =       0b01 << 0
     DATA_RATE_10 =          0b00 << 2
@@ -23,40 +39,82 @@ class Compass:
     OVERSAMPLING_128 =      0b10 << 6
     OVERSAMPLING_64 =       0b11 << 6
     CONFIG_REGISTER_VALUE = CONTINUOUS_MODE | DATA_RATE_200 | GAUSS_2 | OVERSAMPLING_512
-    
-    def __init__(self, addr=0x0d):
+    DATA_RATE = 200
+    STALE_PERIODS = 4 # last_ready older than this many conversions: the compass has not been seen, no deadline
+    HEADING_CORRECTION = 2.88 # https://www.magnetic-declination.com/Luxembourg/Letzeburg/1528005.html
+
+    def __init__(self, addr=0x0d, bus=None):
+        # bus: a BusArbiter shared with the other devices, or a raw smbus-like bus for a private one
         self.address = addr
-        self.bus = smbus.SMBus(1)
-        self.bus.open(1)
+        self.arbiter = get_arbiter(bus)
+        self.bus = self.arbiter.bus
         self.mutex = Lock()
+        self.last_ready: Optional[float] = None
 
         with self.mutex:
             try:
-                self.bus.write_byte_data(self.address, self.RESET_REGISTER, 0x01) # reset
-                self.bus.write_byte_data(self.address, self.CONFIG_REGISTER_1, self.CONFIG_REGISTER_VALUE)
-                self.bus.write_byte_data(self.address, self.CONFIG_REGISTER_2, 0x00)
+                self._transfer([
+                    ('write_byte_data', (self.address, self.RESET_REGISTER, 0x01)), # reset
+                    ('write_byte_data', (self.address, self.CONFIG_REGISTER_1, self.CONFIG_REGISTER_VALUE)),
+                    ('write_byte_data', (self.address, self.CONFIG_REGISTER_2, 0x00)),
+                ])
                 time.sleep(0.05)
             except IOError as err:
                 print(err)
 
-    def get_heading(self, heading_correction: float = 2.88) -> float: # https://www.magnetic-declination.com/Luxembourg/Letzeburg/1528005.html
+    def _deadline(self, conversions: int) -> Optional[float]:
+        # a conversion is overwritten by the next one: the data of the last seen conversion until one period after it,
+        # the next one until two periods after it. Once last_ready is stale (bus errors, no DRDY) the deadline would
+        # already have passed and make every retry urgent
+        if self.last_ready is None or time.monotonic() - self.last_ready > self.STALE_PERIODS / self.DATA_RATE:
+            return None
+        return self.last_ready + conversions / self.DATA_RATE
+
+    def _transfer(self, operations: list, deadline: Optional[float] = None) -> list:
+        return self.arbiter.execute('compass', Priority.COMPASS, operations, deadline)
+
+    def is_data_ready(self) -> bool:
         with self.mutex:
-            x = self.bus.read_byte_data(self.address, 0x01) << 8
-            x |= self.bus.read_byte_data(self.address, 0x00)
-            x = ctypes.c_int16(x).value
-            y = self.bus.read_byte_data(self.address, 0x03) << 8
-            y |= self.bus.read_byte_data(self.address, 0x02)
-            y = ctypes.c_int16(y).value
-            z = self.bus.read_byte_data(self.address, 0x05) << 8
-            z |= self.bus.read_byte_data(self.address, 0x04)
-            z = ctypes.c_int16(z).value
-            temp = self.bus.read_byte_data(self.address, 0x08) << 8
-            temp |= self.bus.read_byte_data(self.address, 0x07)
-            temp = ctypes.c_int16(temp).value
-            status = self.bus.read_byte_data(self.address, 0x06)
-            #print(x, y, z, temp)
-    
-            heading = math.degrees(math.atan2(y, x))
-            heading += 2.88 # https://www.magnetic-declination.com/Luxembourg/Letzeburg/1528005.html
-            heading %= 360
-            return heading
\ No newline at end of file
+            return bool(self._transfer([('read_byte_data', (self.address, self.STATUS_REGISTER))], self._deadline(2))[0] & self.STATUS_DRDY)
+
+    def get_sample(self) -> CompassSample:
+        # single block transaction over all output registers
+        with self.mutex:
+            data = self._transfer([('read_i2c_block_data', (self.address, self.DATA_REGISTER, self.DATA_LENGTH))], self._deadline(1))[0]
+            timestamp = time.monotonic()
+        x = ctypes.c_int16(data[1] << 8 | data[0]).value
+        y = ctypes.c_int16(data[3] << 8 | data[2]).value
+        z = ctypes.c_int16(data[5] << 8 | data[4]).value
+        temperature = ctypes.c_int16(data[8] << 8 | data[7]).value
+        return CompassSample(timestamp, x, y, z, temperature, data[6])
+
+    def wait_for_sample(self, last_timestamp: Optional[float] = None, timeout: float = 0.05, poll_interval: float = 0.0005) -> Optional[CompassSample]:
+        # polls DRDY instead of sleeping a fixed period, returns None on timeout
+        now = time.monotonic()
+        deadline = now + timeout
+        if last_timestamp is not None:
+            # no need to poll before the next conversion is due, measured from when the last one was seen rather
+            # than from the end of its read so the polling stays in phase with the conversions
+            next_sample = min(last_timestamp, self.last_ready or last_timestamp) + 1.0 / self.DATA_RATE - poll_interval
+            if next_sample > now:
+                time.sleep(next_sample - now)
+        while True:
+            # taken before the poll: on a shared bus the poll may first wait for other devices' transactions
+            polled = time.monotonic()
+            if self.is_data_ready():
+                break
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+        self.last_ready = polled
+        return self.get_sample()
+
+    @staticmethod
+    def to_heading(sample: CompassSample, heading_correction: float = HEADING_CORRECTION) -> float:
+        heading = math.degrees(math.atan2(sample.y, sample.x))
+        heading += heading_correction
+        heading %= 360
+        return heading
+
+    def get_heading(self, heading_correction: float = HEADING_CORRECTION) -> float:
+        return self.to_heading(self.get_sample(), heading_correction)
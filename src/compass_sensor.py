@@ -1,22 +1,169 @@
-from compass import Compass
+from compass import Compass, CompassSample
 import logging
+import math
 import time
-from typing import Optional
+from bisect import bisect_left, bisect_right, insort
+from enum import Enum
+from itertools import count
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 from timer import timer
+from metrics import registry
+from snapshots import Snapshot, SnapshotStore
 import numpy as np
-from collections import defaultdict
+from collections import deque
 from threading import Thread, Lock
 
+class HeadingEstimate(NamedTuple):
+    timestamp: float
+    heading: float
+    variance: float
+    turn_rate: float # deg/s, positive = clockwise
+
+class TurnDirection(Enum):
+    CLOCKWISE = 'clockwise'
+    COUNTER_CLOCKWISE = 'counter_clockwise'
+
+class HeadingTrigger(NamedTuple):
+    id: int
+    heading: float
+    direction: Optional[TurnDirection]
+    callback: Callable[[HeadingEstimate], None]
+    repeat: bool
+
+class HeadingTriggerIndex:
+    # pending triggers sorted by heading, each update fires the triggers on the arc swept since the last heading
+    def __init__(self):
+        self.keys: List[Tuple[float, int]] = []
+        self.triggers: Dict[int, HeadingTrigger] = {}
+        self.ids = count()
+
+    def __len__(self):
+        return len(self.triggers)
+
+    def add(self, heading: float, callback: Callable[[HeadingEstimate], None], direction: Optional[TurnDirection] = None, repeat: bool = False) -> int:
+        trigger = HeadingTrigger(next(self.ids), heading % 360, direction, callback, repeat)
+        self.triggers[trigger.id] = trigger
+        insort(self.keys, (trigger.heading, trigger.id))
+        return trigger.id
+
+    def remove(self, trigger_id: int) -> bool:
+        trigger = self.triggers.pop(trigger_id, None)
+        if trigger is None:
+            return False
+        del self.keys[bisect_left(self.keys, (trigger.heading, trigger.id))]
+        return True
+
+    def _range(self, start: float, stop: float, clockwise: bool) -> List[int]:
+        # trigger ids on the arc, the heading moved away from is excluded: (start, stop] clockwise, [start, stop) otherwise
+        if clockwise:
+            keys = self.keys[bisect_right(self.keys, (start, math.inf)):bisect_right(self.keys, (stop, math.inf))]
+        else:
+            keys = self.keys[bisect_left(self.keys, (start, -1)):bisect_left(self.keys, (stop, -1))]
+        return [ trigger_id for _, trigger_id in keys ]
+
+    def crossed(self, previous: float, current: float, tolerance: float = 0.0) -> List[HeadingTrigger]:
+        delta = (current - previous + 180) % 360 - 180
+        if delta >= 0:
+            direction = TurnDirection.CLOCKWISE
+            start, stop = previous, previous + delta + tolerance
+        else:
+            direction = TurnDirection.COUNTER_CLOCKWISE
+            start, stop = previous + delta - tolerance, previous
+        clockwise = direction == TurnDirection.CLOCKWISE
+        if stop - start >= 360:
+            trigger_ids = [ trigger_id for _, trigger_id in self.keys ]
+        elif start < 0:
+            trigger_ids = self._range(start + 360, 360, clockwise) + self._range(-1, stop, clockwise)
+        elif stop >= 360:
+            trigger_ids = self._range(start, 360, clockwise) + self._range(-1, stop - 360, clockwise)
+        else:
+            trigger_ids = self._range(start, stop, clockwise)
+        fired = [ self.triggers[trigger_id] for trigger_id in trigger_ids if self.triggers[trigger_id].direction in (None, direction) ]
+        for trigger in fired:
+            if not trigger.repeat:
+                self.remove(trigger.id)
+        return fired
+
+class HeadingEstimator:
+    # streaming circular statistics over a ring buffer of unit vectors, headings near 0/360 average correctly
+    def __init__(self, window: int = 5, smoothing: Optional[float] = None):
+        self.window = window
+        self.smoothing = smoothing
+        self.cos = np.zeros(window)
+        self.sin = np.zeros(window)
+        self.timestamps = np.zeros(window)
+        self.radians = np.zeros(window)
+        self.index = 0
+        self.count = 0
+        self.smoothed: Optional[np.ndarray] = None
+
+    def reset(self):
+        self.index = 0
+        self.count = 0
+        self.smoothed = None
+
+    def _ordered(self, values: np.ndarray) -> np.ndarray:
+        if self.count < self.window:
+            return values[:self.count]
+        return np.roll(values, -self.index)
+
+    def _turn_rate(self) -> float:
+        if self.count < 2:
+            return 0.0
+        timestamps = self._ordered(self.timestamps)
+        angles = np.unwrap(self._ordered(self.radians))
+        dt = timestamps - timestamps.mean()
+        denominator = (dt * dt).sum()
+        if denominator <= 0:
+            return 0.0
+        return math.degrees((dt * (angles - angles.mean())).sum() / denominator)
+
+    def update(self, timestamp: float, heading: float) -> HeadingEstimate:
+        radians = math.radians(heading)
+        self.cos[self.index] = math.cos(radians)
+        self.sin[self.index] = math.sin(radians)
+        self.timestamps[self.index] = timestamp
+        self.radians[self.index] = radians
+        self.index = (self.index + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+
+        mean = np.array([self.cos[:self.count].mean(), self.sin[:self.count].mean()])
+        variance = 1.0 - math.hypot(mean[0], mean[1])
+        if self.smoothing is not None:
+            if self.smoothed is None:
+                self.smoothed = mean
+            else:
+                self.smoothed = self.smoothing * mean + (1.0 - self.smoothing) * self.smoothed
+            mean = self.smoothed
+        heading = math.degrees(math.atan2(mean[1], mean[0])) % 360
+        return HeadingEstimate(timestamp, heading, variance, self._turn_rate())
+
 class CompassSensor:
-    def __init__(self, compass: Compass):
+    # after an I2C error the loop sleeps, doubling up to ERROR_BACKOFF_MAX while the errors go on; the error is logged
+    # at most every ERROR_LOG_INTERVAL with the count since the last report
+    ERROR_BACKOFF_MIN = 0.005
+    ERROR_BACKOFF_MAX = 1.0
+    ERROR_LOG_INTERVAL = 5.0
+
+    def __init__(self, compass: Compass, sample_buffer_size: int = 200, window: int = 5, smoothing: Optional[float] = None, trigger_tolerance: float = 0.0):
         self.logger = logging.getLogger('CompassSensor')
         self.compass = compass
 
         # Thread control
         self.running = False
         self.thread = None
-        self.heading: Optional[float] = None
+        self.headings = SnapshotStore()
+        self.estimator = HeadingEstimator(window, smoothing)
         self.lock = Lock()
+        self.samples = deque([], maxlen=sample_buffer_size)
+        self.overflow_count = 0
+        self.skipped_count = 0
+        self.triggers = HeadingTriggerIndex()
+        self.trigger_tolerance = trigger_tolerance
+        self.recorder = None
+        self.sample_interval = registry.histogram('compass.sample_interval')
+        self.i2c_errors = registry.counter('i2c.errors')
+        self.overflow_counter = registry.counter('compass.overflows')
 
     def start(self):
         if not self.running:
@@ -24,33 +171,103 @@ class CompassSensor:
             self.thread = Thread(target=self._compass_loop, daemon=True)
             self.thread.start()
             logging.info('Compass sensor started')
-    
+
     def stop(self):
         self.running = False
         if self.thread:
             self.thread.join()
         logging.info('Compass sensor stopped')
 
+    def _read_sample(self, last_timestamp: Optional[float]) -> Optional[CompassSample]:
+        sample = self.compass.wait_for_sample(last_timestamp)
+        if sample is None:
+            return None
+        if sample.status & Compass.STATUS_DOR:
+            self.skipped_count += 1
+        if sample.status & Compass.STATUS_OVL:
+            self.overflow_count += 1
+            self.overflow_counter.inc()
+            return None
+        return sample
+
     #@timer
-    def _get_heading(self, attempts: int = 5) -> float:
-        sum = 0.0
-        for _ in range(attempts):
-            sum += self.compass.get_heading()
-            time.sleep(0.005) # 200 HZ compass
-        return sum / attempts
-    
+    def _get_heading(self, sample: CompassSample) -> HeadingEstimate:
+        return self.estimator.update(sample.timestamp, Compass.to_heading(sample))
+
     def _compass_loop(self):
         self.logger.info('Compass sensor loop started')
-        
+
+        last_timestamp = None
+        previous: Optional[HeadingEstimate] = None
+        backoff = self.ERROR_BACKOFF_MIN
+        errors = 0
+        next_error_log = 0.0
         while self.running:
+            try:
+                sample = self._read_sample(last_timestamp)
+            except IOError as e:
+                self.i2c_errors.inc()
+                errors += 1
+                now = time.monotonic()
+                if now >= next_error_log:
+                    self.logger.error('I2C error: %s (%d since the last report, retrying in %.3f s)', e, errors, backoff)
+                    errors = 0
+                    next_error_log = now + self.ERROR_LOG_INTERVAL
+                time.sleep(backoff)
+                backoff = min(2 * backoff, self.ERROR_BACKOFF_MAX)
+                continue
+            backoff = self.ERROR_BACKOFF_MIN
+            if sample is None:
+                continue
+            if last_timestamp is not None:
+                self.sample_interval.record(sample.timestamp - last_timestamp)
+            last_timestamp = sample.timestamp
+            if self.recorder:
+                self.recorder.record_compass(sample)
+            heading = self._get_heading(sample)
+            self.headings.publish(heading, heading.timestamp)
             with self.lock:
-                self.heading = self._get_heading()
-                
+                self.samples.append(sample)
+                fired = self.triggers.crossed(previous.heading, heading.heading, self.trigger_tolerance) if previous and len(self.triggers) else []
+            previous = heading
+            self._run_callbacks(fired, heading)
+
         self.logger.info('Compass sensor loop stopped')
 
-    def get_heading(self) -> Optional[float]:
-        with self.lock:
+    def _run_callbacks(self, triggers: List[HeadingTrigger], heading: HeadingEstimate):
+        # called outside the lock so callbacks may register or cancel triggers
+        for trigger in triggers:
             try:
-                return self.heading
-            finally:
-                self.heading = None
\ No newline at end of file
+                trigger.callback(heading)
+            except Exception as e:
+                self.logger.error('Heading callback failed: %s', e)
+
+    def register_callback(self, heading: float, callback: Callable[[HeadingEstimate], None], direction: Optional[TurnDirection] = None, repeat: bool = False) -> int:
+        # fires once the heading passes `heading` (in `direction`, if given), also when a sample jumps past it
+        with self.lock:
+            return self.triggers.add(heading, callback, direction, repeat)
+
+    def cancel_callback(self, trigger_id: int) -> bool:
+        with self.lock:
+            return self.triggers.remove(trigger_id)
+
+    def get_samples(self, since: Optional[float] = None) -> List[CompassSample]:
+        # raw timestamped XYZ samples, optionally only those newer than `since`
+        with self.lock:
+            return [ sample for sample in self.samples if since is None or sample.timestamp > since ]
+
+    def heading_at(self, timestamps: np.ndarray) -> Optional[np.ndarray]:
+        # raw headings interpolated to `timestamps` from the buffered samples (clamped to the buffer), None without samples
+        with self.lock:
+            samples = list(self.samples)
+        if not samples:
+            return None
+        times = np.array([ sample.timestamp for sample in samples ])
+        radians = np.unwrap(np.arctan2([ sample.y for sample in samples ], [ sample.x for sample in samples ]))
+        return (np.degrees(np.interp(timestamps, times, radians)) + Compass.HEADING_CORRECTION) % 360
+
+    def get_heading(self) -> Optional[HeadingEstimate]:
+        return self.headings.get_value()
+
+    def wait_for_heading(self, version: int = 0, timeout: Optional[float] = None) -> Optional[Snapshot]:
+        return self.headings.wait_for(version, timeout)
@@ -1,11 +1,13 @@
 import logging
 from board import Board
 import time
-from typing import Callable, Optional
+from collections import deque
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
 from timer import timer
+from metrics import registry
+from snapshots import Snapshot, SnapshotStore
 import numpy as np
-from collections import defaultdict
-from threading import Thread, Lock
+from threading import Thread
 
 '''
 # simple logic
@@ -21,8 +23,265 @@ def get_distance_ahead(reverse: bool = False, min_angle: float = 45, max_angle:
     return coordinates
 '''
 
+class SonicEstimate(NamedTuple):
+    distance: float # median of the agreeing echoes, 0: no echo (nothing in range), NaN: not valid
+    valid: bool # enough pings agreed
+    pings: int
+    outliers: int # echoes that disagreed with the estimate
+    first_agreeing: int = 0 # index of the first sample that agreed, when the estimate was first seen
+
+def robust_distance(samples: List[float], min_agreeing: int = 2, prior: Optional[float] = None, tolerance: float = 1.5, relative_tolerance: float = 0.03) -> SonicEstimate:
+    # the largest group of echoes within tolerance of one of them (no echo, 0, only agrees with no echo), the median of its
+    # samples; `prior` (e.g. the neighbouring angle's estimate) votes but is not a sample. A dropout or a stray echo is
+    # outvoted instead of pulling an average
+    votes = samples + ([ prior ] if prior is not None else [])
+    best: List[int] = []
+    for vote in votes:
+        limit = max(tolerance, relative_tolerance * vote)
+        group = [ index for index, other in enumerate(votes) if (other > 0) == (vote > 0) and abs(other - vote) <= limit ]
+        if len(group) > len(best) and group[0] < len(samples):
+            best = group
+    agreeing = [ samples[index] for index in best if index < len(samples) ]
+    valid = len(best) >= min_agreeing
+    return SonicEstimate(float(np.median(agreeing)) if valid else np.nan, valid, len(samples), len(samples) - len(agreeing) if valid else 0, best[0] if valid else 0)
+
+class ServoModel:
+    # where the servo (and the sensor on it) is while it follows a ramp of commands: the commanded angle delayed by a lag
+    # (PWM frame, dead band, gear play) that differs between increasing (forward) and decreasing (reverse) angles.
+    # Calibrated at one sweep speed (see DistanceSensor.calibrate_servo), the play makes the lag depend on it
+    def __init__(self, lag: float = 0.0, reverse_lag: Optional[float] = None, slew_speed: float = 500.0):
+        self.lag = lag
+        self.reverse_lag = lag if reverse_lag is None else reverse_lag
+        self.slew_speed = slew_speed # deg/s when commanded straight to the target
+
+    def lag_for(self, reverse: bool) -> float:
+        return self.reverse_lag if reverse else self.lag
+
+    def settle_time(self, difference: float) -> float:
+        # from commanding a step of `difference` degrees until the servo is there
+        return self.lag_for(difference < 0) + abs(difference) / self.slew_speed
+
+    def angles(self, elapsed: np.ndarray, start_angle: float, end_angle: float, speed: float) -> np.ndarray:
+        # servo angle `elapsed` seconds after a ramp from start_angle to end_angle at `speed` deg/s was started
+        reverse = end_angle < start_angle
+        travelled = np.clip(speed * (np.asarray(elapsed) - self.lag_for(reverse)), 0.0, abs(end_angle - start_angle))
+        return start_angle - travelled if reverse else start_angle + travelled
+
+def fit_servo_lag(elapsed: np.ndarray, distances: np.ndarray, reference: np.ndarray, start_angle: int, end_angle: int, speed: float,
+                  max_lag: float = 0.1, resolution: float = 0.001, far: float = 100.0) -> float:
+    # the lag that lines readings taken on the move up best with a settled reference sweep (one distance per degree from
+    # min(start, end)): each candidate puts the readings at its angles, they are compared with the reference interpolated
+    # there (no echo counts as `far`, differences capped so a stray echo does not dominate)
+    lags = np.arange(0.0, max_lag + resolution / 2, resolution)
+    reverse = end_angle < start_angle
+    travelled = np.clip(speed * (np.asarray(elapsed)[None, :] - lags[:, None]), 0.0, abs(end_angle - start_angle))
+    angles = start_angle - travelled if reverse else start_angle + travelled
+    reference = np.where(reference > 0, reference, far)
+    expected = np.interp(angles.ravel(), np.arange(min(start_angle, end_angle), min(start_angle, end_angle) + len(reference)), reference).reshape(angles.shape)
+    measured = np.where(np.asarray(distances) > 0, distances, far)
+    cost = np.minimum(np.abs(expected - measured[None, :]), 20.0).mean(axis=1)
+    return float(lags[np.argmin(cost)])
+
+class SweepFusion:
+    # angle-indexed accumulator: each reading is spread over +-measuring_range degrees (the sensor's ~15 degree beam);
+    # readings older than max_age seconds drop out, angles a sweep no longer visits (refined or outside the scan window)
+    # would otherwise keep reporting an obstacle that has gone
+    def __init__(self, min_angle: int = 75, max_angle: int = 105, measuring_range: int = 7, lower_threshold: float = 5, upper_threshold: float = 70, variance_threshold: float = 0.3,
+                 max_age: float = 1.0):
+        self.min_angle = min_angle
+        self.max_angle = max_angle
+        self.measuring_range = measuring_range
+        self.lower_threshold = lower_threshold
+        self.upper_threshold = upper_threshold
+        self.variance_threshold = variance_threshold
+        self.max_age = max_age
+        self.offset = min_angle - measuring_range
+        self.angles = np.arange(self.offset, max_angle + measuring_range + 1)
+        self.cos = np.cos(np.radians(self.angles))
+        self.sin = np.sin(np.radians(self.angles))
+        self.count = np.zeros(len(self.angles))
+        self.sum = np.zeros(len(self.angles))
+        self.sum_of_squares = np.zeros(len(self.angles))
+        # latest accepted reading per measured angle, replaced on the next pass over that angle
+        self.readings = np.full(max_angle - min_angle + 1, np.nan)
+        # when each measured angle was last read, a profile angle takes the time of the nearest measured one
+        self.timestamps = np.zeros(max_angle - min_angle + 1)
+        self.nearest_reading = np.clip(self.angles - min_angle, 0, max_angle - min_angle)
+
+    def reset(self):
+        self.count[:] = 0
+        self.sum[:] = 0
+        self.sum_of_squares[:] = 0
+        self.readings[:] = np.nan
+        self.timestamps[:] = 0
+
+    def _spread(self, angle: int, distance: float, sign: float):
+        start = angle - self.measuring_range - self.offset
+        stop = angle + self.measuring_range + 1 - self.offset
+        self.count[start:stop] += sign
+        self.sum[start:stop] += sign * distance
+        self.sum_of_squares[start:stop] += sign * distance * distance
+
+    def _remove(self, index: int):
+        self._spread(index + self.min_angle, self.readings[index], -1.0)
+        self.readings[index] = np.nan
+
+    def discard(self, angle: int):
+        if not np.isnan(self.readings[angle - self.min_angle]):
+            self._remove(angle - self.min_angle)
+
+    def expire(self, now: float):
+        for index in np.flatnonzero(~np.isnan(self.readings) & (now - self.timestamps > self.max_age)):
+            self._remove(index)
+
+    def update(self, angle: int, distance: float, timestamp: Optional[float] = None):
+        index = angle - self.min_angle
+        timestamp = timestamp if timestamp is not None else time.monotonic()
+        self.timestamps[index] = timestamp
+        if not np.isnan(self.readings[index]):
+            self._remove(index)
+        self.expire(timestamp)
+        if distance >= self.lower_threshold and distance <= self.upper_threshold:
+            self._spread(angle, distance, 1.0)
+            self.readings[index] = distance
+
+    def get_profile(self, timestamps: bool = False) -> np.array:
+        # (n, 2) x (right), y (ahead) in cm; with timestamps (n, 3), the third column when the point was read
+        count = np.round(self.count)
+        measured = count > 0
+        mean = np.divide(self.sum, count, out=np.zeros_like(self.sum), where=measured)
+        variance = np.divide(self.sum_of_squares, count, out=np.zeros_like(self.sum), where=measured) - mean * mean
+        mask = measured & (variance < self.variance_threshold)
+        columns = [ self.cos[mask] * mean[mask], self.sin[mask] * mean[mask] ]
+        if timestamps:
+            columns.append(self.timestamps[self.nearest_reading[mask]])
+        return np.stack(columns, axis=1)
+
+class FixedSweep:
+    # every angle at a fixed step, alternating direction
+    def __init__(self, step: int = 1):
+        self.step = step
+
+    def angles(self, fusion: SweepFusion, reverse: bool = False) -> Iterator[int]:
+        angles = list(range(fusion.min_angle, fusion.max_angle + 1, self.step))
+        return iter(angles[::-1] if reverse else angles)
+
+class AdaptiveSweep:
+    # coarse pass over the scan window, then refines between coarse samples around edges and close obstacles;
+    # the window narrows around the focus (steering / target bearing, servo degrees, 90 = ahead) and widens while turning
+    def __init__(self, coarse_step: int = 5, scan_width: int = 10, focus_width: int = 2, edge_threshold: float = 5.0, near_distance: float = 30.0):
+        self.coarse_step = coarse_step
+        self.scan_width = scan_width
+        self.focus_width = focus_width
+        self.edge_threshold = edge_threshold
+        self.near_distance = near_distance
+        self.focus: Optional[int] = None
+        self.turning = False
+
+    def set_focus(self, angle: Optional[float], turning: bool = False):
+        self.focus = None if angle is None else int(round(angle))
+        self.turning = turning
+
+    def _window(self, fusion: SweepFusion, focus: Optional[int], turning: bool) -> range:
+        if focus is None or turning:
+            return range(fusion.min_angle, fusion.max_angle + 1)
+        focus = min(max(focus, fusion.min_angle), fusion.max_angle)
+        return range(max(focus - self.scan_width, fusion.min_angle), min(focus + self.scan_width, fusion.max_angle) + 1)
+
+    def _needs_refinement(self, first: float, second: float) -> bool:
+        if np.isnan(first) != np.isnan(second):
+            return True
+        if np.isnan(first):
+            return False
+        return abs(first - second) > self.edge_threshold or min(first, second) < self.near_distance
+
+    def angles(self, fusion: SweepFusion, reverse: bool = False) -> Iterator[int]:
+        # set_focus comes from the steering thread, one pass uses the focus it started with
+        focus, turning = self.focus, self.turning
+        window = self._window(fusion, focus, turning)
+        coarse = set(window[::self.coarse_step]) | { window[-1] }
+        if focus is not None:
+            coarse |= { angle for angle in range(focus - self.focus_width, focus + self.focus_width + 1) if angle in window }
+        coarse = sorted(coarse)
+        for angle in (coarse[::-1] if reverse else coarse):
+            yield angle
+
+        # the caller has fed every coarse reading into the fusion by now
+        readings = { angle: fusion.readings[angle - fusion.min_angle] for angle in coarse }
+        refine = []
+        for first, second in zip(coarse, coarse[1:]):
+            if self._needs_refinement(readings[first], readings[second]):
+                refine.extend(range(first + 1, second))
+            else:
+                # not read again while this stays smooth, the coarse readings around it are the current ones
+                for angle in range(first + 1, second):
+                    fusion.discard(angle)
+        # walk back towards where the sweep started to keep servo travel short
+        yield from (refine if reverse else refine[::-1])
+
+class ReflexStop:
+    # evaluates every raw sonic sample, stops the board directly when an obstacle is too close or closing in too fast;
+    # the stop is held (forward drive commands are blocked on the board) until no sample has triggered for release_time,
+    # longer than a sweep, so the obstacle is seen clear at every bearing first
+    def __init__(self, board: Board, stop_distance: float, time_to_collision: float = 0.5, max_sample_age: float = 1.0, smoothing: float = 0.2, callback: Optional[Callable[[], None]] = None,
+                 release_time: float = 1.0):
+        self.board = board
+        self.stop_distance = stop_distance
+        self.time_to_collision = time_to_collision
+        self.max_sample_age = max_sample_age
+        self.callback = callback
+        self.smoothing = smoothing
+        # last (timestamp, distance) per servo angle: closing speed only compares readings at the same bearing, between
+        # bearings any depth edge swept past would look like an approach
+        self.last_samples: Dict[Optional[int], Tuple[float, float]] = {}
+        self.closing_speed = 0.0
+        self.triggered = False
+        self.release_time = release_time
+        self.last_trigger = 0.0
+        self.stop_count = 0
+        self.reaction_times = deque([], maxlen=100)
+        self.reaction_time = registry.histogram('sonar.reaction_time')
+        self.stop_counter = registry.counter('sonar.emergency_stops')
+
+    def check(self, timestamp: float, angle: Optional[int], distance: float, first_seen: Optional[float] = None) -> bool:
+        # timestamp: the reading that completed the estimate, first_seen: its first ping (the reaction time starts there)
+        if self.triggered and timestamp - self.last_trigger > self.release_time:
+            self.triggered = False
+            self.board.release_stop()
+        if not distance > 0: # no echo or not valid
+            return False
+        last = self.last_samples.get(angle)
+        if last is not None and 0 < timestamp - last[0] <= self.max_sample_age:
+            # smoothed, single noisy sample pairs close together would otherwise look like very fast approaches
+            speed = (last[1] - distance) / (timestamp - last[0])
+            self.closing_speed = self.smoothing * speed + (1 - self.smoothing) * self.closing_speed
+        self.last_samples[angle] = (timestamp, distance)
+
+        too_close = distance < self.stop_distance
+        closing = self.closing_speed > 0 and distance / self.closing_speed < self.time_to_collision
+        if not (too_close or closing):
+            return False
+        self.last_trigger = timestamp
+        if self.triggered:
+            return True
+        self.triggered = True
+        self.board.emergency_stop(hold=True)
+        reaction_time = time.monotonic() - (first_seen if first_seen is not None else timestamp)
+        self.reaction_times.append(reaction_time)
+        self.reaction_time.record(reaction_time)
+        self.stop_count += 1
+        self.stop_counter.inc()
+        if self.callback:
+            self.callback()
+        return True
+
+    def get_reaction_times(self) -> List[float]:
+        # seconds from the first ping showing the obstacle to the stopped motors
+        return list(self.reaction_times)
+
 class DistanceSensor:
-    def __init__(self, board: Board, emergency_stop_distance_threshold: float, emergency_stop_callback: Callable[[], None]):
+    def __init__(self, board: Board, emergency_stop_distance_threshold: float, emergency_stop_callback: Callable[[], None], fusion: Optional[SweepFusion] = None, scheduler: Optional[FixedSweep | AdaptiveSweep] = None, profile_interval: int = 0, min_agreeing: int = 2, max_pings: int = 4, neighbour_angle: int = 2,
+                 continuous: bool = False, sweep_speed: float = 100.0, servo_model: Optional[ServoModel] = None):
         self.logger = logging.getLogger('DistanceSensor')
         self.board = board
         self.servo = board.CMD_SERVO1
@@ -30,11 +289,40 @@ class DistanceSensor:
         # Thread control
         self.running = False
         self.thread = None
-        self.distances: Optional[np.array] = None
-        self.lock = Lock()
+        # one fused (n, 3) profile per sweep: x, y and when the point was read (empty: nothing in range), timestamped when
+        # the sweep completed; with profile_interval also every profile_interval readings during the sweep (the profile
+        # keeps the last reading of the other angles)
+        self.profiles = SnapshotStore()
+        self.profile_interval = profile_interval
+        # the raw (timestamp, servo angle, distance) readings of each sweep, e.g. for the occupancy grid
+        self.sweeps = SnapshotStore()
+        self.sweep_readings: List[Tuple[float, float, float]] = []
         self.emergency_stop_distance_threshold = emergency_stop_distance_threshold
         self.emergency_stop_callback = emergency_stop_callback
-
+        self.fusion = fusion or SweepFusion()
+        self.scheduler = scheduler or FixedSweep()
+        self.recorder = None
+        self.reflex = ReflexStop(board, emergency_stop_distance_threshold, callback=emergency_stop_callback)
+        self.read_time = registry.histogram('sonar.read')
+        # robust ranging: pings per angle until min_agreeing echoes agree, at most max_pings
+        self.min_agreeing = min_agreeing
+        self.max_pings = max_pings
+        self.neighbour_angle = neighbour_angle
+        self.last_estimate: Optional[Tuple[Optional[int], float]] = None
+        self.ping_interval = board.SONIC_PING_INTERVAL
+        self.next_ping = 0.0
+        self.pings = registry.counter('sonar.pings')
+        self.outliers = registry.counter('sonar.outliers')
+        self.invalid = registry.counter('sonar.invalid')
+        # continuous sweeps: the servo is ramped across the whole arc at sweep_speed (deg/s, 100 = a degree per ping) while
+        # pinging back-to-back, each reading placed at the angle the servo model gives for its timestamp (the scheduler
+        # only steers stepped sweeps); stepped sweeps wait for the model's settle time before pinging. Both are bound by
+        # the ping rate: at the same spacing a continuous sweep takes as long as a stepped one (plus the lag at the end
+        # of the ramp), what it buys is angle accuracy without settling, not sweep rate
+        self.continuous = continuous
+        self.sweep_speed = sweep_speed
+        self.servo_model = servo_model or ServoModel()
+        self.servo_angle: Optional[float] = None # last commanded
 
     def start(self):
         if not self.running:
@@ -49,27 +337,172 @@ class DistanceSensor:
             self.thread.join()
         logging.info('Distance sensor stopped')
 
-    def _get_distance(self, attempts: int = 2) -> float:
-        sum = 0.0
-        for _ in range(attempts):
-            sum += self.board.get_sonic_distance()
-            time.sleep(0.005) # enough time to have sound pass ~1.7m
-        return sum / attempts
+    def set_focus(self, bearing: Optional[float], turning: bool = False):
+        # bearing relative to the robot (degrees, clockwise > 0, None: no preference) an adaptive sweep samples around,
+        # over the whole arc while turning; a fixed sweep ignores it
+        if isinstance(self.scheduler, AdaptiveSweep):
+            self.scheduler.set_focus(None if bearing is None else 90.0 - bearing, turning)
+
+    def _measure(self, angle: Optional[int] = None) -> SonicEstimate:
+        # pings until min_agreeing echoes agree (at most max_pings), each read as soon as the shield has pinged again:
+        # the wait for the next ping overlaps with whatever came since the last one (e.g. moving the servo). The last
+        # estimate votes too if it was taken at most neighbour_angle away: through the ~15 degree beam neighbouring angles
+        # mostly see the same echo, one agreeing ping is enough there.
+        # The reflex sees the agreed distance, a single stray short echo does not stop the car
+        prior = None
+        if self.last_estimate is not None and angle is not None:
+            last_angle, last_distance = self.last_estimate
+            if last_angle is not None and abs(angle - last_angle) <= self.neighbour_angle:
+                prior = last_distance
+        samples = []
+        timestamps = []
+        while True:
+            wait = self.next_ping - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            start = time.perf_counter()
+            distance = self.board.get_sonic_distance()
+            self.read_time.record(time.perf_counter() - start)
+            timestamp = time.monotonic()
+            self.next_ping = timestamp + self.ping_interval
+            if self.recorder:
+                self.recorder.record_sonic(timestamp, angle, distance)
+            samples.append(distance)
+            timestamps.append(timestamp)
+            estimate = robust_distance(samples, self.min_agreeing, prior)
+            if estimate.valid or len(samples) >= self.max_pings:
+                break
+        self.last_estimate = (angle, estimate.distance) if estimate.valid else None
+        if estimate.valid:
+            self.reflex.check(timestamp, angle, estimate.distance, timestamps[estimate.first_agreeing])
+        self.pings.inc(estimate.pings)
+        self.outliers.inc(estimate.outliers)
+        if not estimate.valid:
+            self.invalid.inc()
+        return estimate
+
+    def _get_distance(self, angle: Optional[int] = None) -> float:
+        # 0: no echo (nothing in range), NaN: no trustworthy estimate (the pings disagreed)
+        return self._measure(angle).distance
+
+    def _move_servo(self, angle: float):
+        # commands the servo and holds the next ping until the model says it has arrived
+        if angle == self.servo_angle:
+            return
+        difference = angle - self.servo_angle if self.servo_angle is not None else 90.0
+        self.board.set_servo_angle(self.servo, angle)
+        self.servo_angle = angle
+        self.next_ping = max(self.next_ping, time.monotonic() + self.servo_model.settle_time(difference))
+
+    def _ramp(self, start_angle: int, end_angle: int, lag: float) -> Iterator[Tuple[float, float, float]]:
+        # settles at start_angle, then commands the servo along the ramp to end_angle (a new command before every ping)
+        # and pings back-to-back until the servo, `lag` behind the commands, has arrived;
+        # yields (timestamp, seconds since the ramp started, distance) per ping
+        self._move_servo(start_angle)
+        wait = self.next_ping - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        travel = abs(end_angle - start_angle) / self.sweep_speed
+        direction = 1.0 if end_angle >= start_angle else -1.0
+        start = time.monotonic()
+        elapsed = 0.0
+        while elapsed < travel + lag:
+            wait = self.next_ping - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            moving = time.monotonic() - start
+            commanded = start_angle + direction * self.sweep_speed * moving if moving < travel else end_angle
+            if commanded != self.servo_angle:
+                self.board.set_servo_angle(self.servo, commanded)
+                self.servo_angle = commanded
+            read_start = time.perf_counter()
+            distance = self.board.get_sonic_distance()
+            self.read_time.record(time.perf_counter() - read_start)
+            timestamp = time.monotonic()
+            self.next_ping = timestamp + self.ping_interval
+            self.pings.inc()
+            elapsed = timestamp - start
+            yield timestamp, elapsed, distance
+
+    def _add_reading(self, timestamp: float, angle: float, distance: float):
+        self.sweep_readings.append((timestamp, angle, distance))
+        self.fusion.update(int(round(angle)), distance, timestamp)
+        if self.profile_interval and len(self.sweep_readings) % self.profile_interval == 0:
+            self.profiles.publish(self.fusion.get_profile(timestamps=True))
+
+    def _confirm(self, reading: Tuple[float, float, float], neighbour: Optional[Tuple[float, float, float]]) -> bool:
+        # a single ping on the move is trusted once the reading next to it (at most neighbour_angle away) agrees
+        if neighbour is None or abs(reading[1] - neighbour[1]) > self.neighbour_angle:
+            return False
+        estimate = robust_distance([ reading[2] ], self.min_agreeing, neighbour[2])
+        if not estimate.valid:
+            return False
+        self._add_reading(reading[0], reading[1], estimate.distance)
+        self.reflex.check(reading[0], int(round(reading[1])), estimate.distance, min(reading[0], neighbour[0]))
+        return True
+
+    def _sweep_continuous(self, reverse: bool):
+        # one ping per reading, confirmed by the previous reading or, failing that, by the next one
+        fusion = self.fusion
+        start_angle, end_angle = (fusion.max_angle, fusion.min_angle) if reverse else (fusion.min_angle, fusion.max_angle)
+        previous = pending = None
+        for timestamp, elapsed, distance in self._ramp(start_angle, end_angle, self.servo_model.lag_for(reverse)):
+            reading = (timestamp, float(self.servo_model.angles(elapsed, start_angle, end_angle, self.sweep_speed)), distance)
+            if self.recorder:
+                self.recorder.record_sonic(*reading)
+            if pending is not None and not self._confirm(pending, reading):
+                self._add_reading(pending[0], pending[1], np.nan)
+                self.invalid.inc()
+            pending = None if self._confirm(reading, previous) else reading
+            previous = reading
+        if pending is not None:
+            self._add_reading(pending[0], pending[1], np.nan)
+            self.invalid.inc()
+        self.last_estimate = None
 
     @timer
-    def _get_distance_ahead_smoothed(self, reverse: bool = False, min_angle: float = 75, max_angle: float = 105, lower_threshold: float = 5, upper_threshold: float = 70, variance_threshold: float = 0.3, measuring_range: int = 7) -> np.array:
-        distances = defaultdict(list)
-        angle_range = range(min_angle, max_angle + 1, 1) if not reverse else range(max_angle, min_angle - 1, -1)
-        for angle in angle_range:
-            self.board.set_servo_angle(self.board.CMD_SERVO1, angle)
-            distance = self._get_distance()
-            if (distance >= lower_threshold and distance <= upper_threshold):
-                for a in range(angle + (-1) * measuring_range, angle + measuring_range + 1):
-                    distances[a].append(distance)
-        smoothed_distances = [ (k, np.array(v).mean()) for k, v in distances.items() if np.array(v).var() < variance_threshold ]
-        coordinates = np.array([ [ np.cos(np.radians(angle)) * distance, np.sin(np.radians(angle)) * distance ] for (angle, distance) in smoothed_distances ])
-        return coordinates
-    
+    def _get_distance_ahead_smoothed(self, reverse: bool = False) -> np.array:
+        self.sweep_readings = []
+        if self.continuous:
+            self._sweep_continuous(reverse)
+        else:
+            for angle in self.scheduler.angles(self.fusion, reverse):
+                self._move_servo(angle)
+                distance = self._get_distance(angle)
+                self._add_reading(time.monotonic(), angle, distance)
+        return self.fusion.get_profile(timestamps=True)
+
+    def calibrate_servo(self, sweeps: int = 3, max_lag: float = 0.1, settle: float = 0.15) -> ServoModel:
+        # with the loop stopped and something with edges in range: stepped reference sweeps with the servo settled at
+        # every angle, then continuous sweeps each way at sweep_speed; per direction the lag that lines them up best
+        # with the reference becomes the servo model. The reference approaches every angle from both sides, settled
+        # after a step the play leaves the sensor short of the commanded angle
+        fusion = self.fusion
+        angles = list(range(fusion.min_angle, fusion.max_angle + 1))
+        passes = np.zeros((2, len(angles)))
+        for approach, sweep in enumerate((angles, angles[::-1])):
+            for angle in sweep:
+                self._move_servo(angle)
+                time.sleep(settle)
+                passes[approach, angle - fusion.min_angle] = self._get_distance(angle)
+            self.last_estimate = None
+        # an invalid estimate carries no more than a missing echo
+        passes = np.nan_to_num(passes)
+        reference = np.where(passes.min(axis=0) > 0, passes.mean(axis=0), passes.max(axis=0))
+        lags = []
+        for start_angle, end_angle in ((fusion.min_angle, fusion.max_angle), (fusion.max_angle, fusion.min_angle)):
+            elapsed, distances = [], []
+            for _ in range(sweeps):
+                self._move_servo(start_angle)
+                time.sleep(settle)
+                for _, seconds, distance in self._ramp(start_angle, end_angle, max_lag):
+                    elapsed.append(seconds)
+                    distances.append(distance)
+            lags.append(fit_servo_lag(np.array(elapsed), np.array(distances), reference, start_angle, end_angle, self.sweep_speed, max_lag))
+        self.servo_model = ServoModel(lags[0], lags[1], self.servo_model.slew_speed)
+        self.logger.info('Servo lag at %.0f deg/s: %.1f ms forward, %.1f ms reverse', self.sweep_speed, 1000 * lags[0], 1000 * lags[1])
+        return self.servo_model
+
     def _distance_loop(self):
         self.logger.info('Distance sensor loop started')
 
@@ -77,19 +510,16 @@ class DistanceSensor:
         
         while self.running:
             distances = self._get_distance_ahead_smoothed(is_reversed)
-            if len(distances.shape) == 2:
-                with self.lock:
-                    self.distances = distances
-                is_reversed = not is_reversed
-                
-                if np.median(distances[:, 1]) < self.emergency_stop_distance_threshold:
-                    self.emergency_stop_callback()
-        
-        self.logger.info('Distance sensor loop started')
+            if self.sweep_readings:
+                self.sweeps.publish(np.array(self.sweep_readings))
+            self.profiles.publish(distances)
+            is_reversed = not is_reversed
+
+        self.logger.info('Distance sensor loop stopped')
 
     def get_distances(self) -> Optional[np.array]:
-        with self.lock:
-            try:
-                return self.distances
-            finally:
-                self.distances = None
\ No newline at end of file
+        # the latest profile, not consumed: see profiles.get() for its version and timestamp
+        return self.profiles.get_value()
+
+    def wait_for_distances(self, version: int = 0, timeout: Optional[float] = None) -> Optional[Snapshot]:
+        return self.profiles.wait_for(version, timeout)
\ No newline at end of file
@@ -0,0 +1,60 @@
+import time
+import numpy as np
+from typing import Optional
+
+# stand-in for cv2.VideoCapture: renders a moving red/white checkered box on a static background at a fixed frame rate
+class SyntheticCamera:
+    def __init__(self, width: int = 640, height: int = 480, fps: float = 30, box_size: int = 80, speed: float = 120.0):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.box_size = box_size
+        self.speed = speed # pixels per second
+        self.start = time.monotonic()
+        self.next_frame = self.start
+        self.frames = 0
+        self.visible = True
+        background = np.linspace(40, 200, width, dtype=np.uint8)
+        self.background = np.repeat(np.repeat(background[np.newaxis, :, np.newaxis], height, axis=0), 3, axis=2)
+        # textured like a real target so template matching has something to lock on to
+        checker = (np.indices((box_size, box_size)) // 10).sum(axis=0) % 2 == 0
+        self.box = np.where(checker[:, :, np.newaxis], np.array([0, 0, 255], dtype=np.uint8), np.array([255, 255, 255], dtype=np.uint8))
+
+    def isOpened(self) -> bool:
+        return True
+
+    def set(self, prop: int, value: float) -> bool:
+        return True
+
+    def release(self):
+        pass
+
+    def grab(self) -> bool:
+        # blocks like a real camera until the next frame is exposed
+        now = time.monotonic()
+        if self.next_frame > now:
+            time.sleep(self.next_frame - now)
+        self.next_frame = max(self.next_frame + 1.0 / self.fps, time.monotonic())
+        self.frames += 1
+        return True
+
+    def box_position(self, timestamp: Optional[float] = None) -> tuple:
+        elapsed = (timestamp if timestamp is not None else time.monotonic()) - self.start
+        travel = self.width - self.box_size
+        offset = int(self.speed * elapsed) % (2 * travel)
+        x = offset if offset < travel else 2 * travel - offset
+        y = (self.height - self.box_size) // 2
+        return x, y
+
+    def retrieve(self, image: Optional[np.ndarray] = None) -> tuple:
+        if image is None or image.shape != self.background.shape or image.dtype != np.uint8:
+            image = np.empty_like(self.background)
+        np.copyto(image, self.background)
+        if self.visible:
+            x, y = self.box_position()
+            image[y:y + self.box_size, x:x + self.box_size] = self.box
+        return True, image
+
+    def read(self) -> tuple:
+        self.grab()
+        return self.retrieve()
@@ -0,0 +1,64 @@
+import time
+from collections import defaultdict
+from threading import Lock
+from typing import Dict, List
+
+# stand-in for smbus.SMBus, counts transactions and simulates bus time (no hardware required)
+class FakeSMBus:
+    def __init__(self, bus: int = 1, transaction_time: float = 0.0004):
+        self.transaction_time = transaction_time
+        self.lock = Lock()
+        self.registers: Dict[int, Dict[int, int]] = defaultdict(dict)
+        self.transactions = 0
+        self.writes: List[tuple] = []
+        self.failures = 0
+
+    def _transaction(self):
+        with self.lock:
+            self.transactions += 1
+            if self.failures > 0:
+                self.failures -= 1
+                raise IOError('Simulated I2C failure')
+        if self.transaction_time > 0:
+            time.sleep(self.transaction_time)
+
+    def fail_next(self, count: int = 1):
+        with self.lock:
+            self.failures += count
+
+    def reset_counters(self):
+        with self.lock:
+            self.transactions = 0
+            self.writes = []
+
+    def open(self, bus: int):
+        pass
+
+    def close(self):
+        pass
+
+    def write_byte(self, addr: int, value: int):
+        self._transaction()
+
+    def read_byte(self, addr: int) -> int:
+        self._transaction()
+        return 0
+
+    def write_byte_data(self, addr: int, register: int, value: int):
+        self._transaction()
+        self.registers[addr][register] = value & 0xff
+        self.writes.append((addr, register, [value & 0xff]))
+
+    def read_byte_data(self, addr: int, register: int) -> int:
+        self._transaction()
+        return self.registers[addr].get(register, 0)
+
+    def write_i2c_block_data(self, addr: int, register: int, data: List[int]):
+        self._transaction()
+        for offset, value in enumerate(data):
+            self.registers[addr][register + offset] = value & 0xff
+        self.writes.append((addr, register, list(data)))
+
+    def read_i2c_block_data(self, addr: int, register: int, length: int) -> List[int]:
+        self._transaction()
+        return [ self.registers[addr].get(register + offset, 0) for offset in range(length) ]
@@ -0,0 +1,125 @@
+import logging
+import time
+from threading import Thread
+from typing import Optional
+from motor_controller import MotorController
+from vision import WIDTH, TargetDetector
+from metrics import registry
+
+class PID:
+    def __init__(self, kp: float, ki: float = 0.0, kd: float = 0.0, output_limit: float = 1.0, integral_limit: Optional[float] = None):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.output_limit = output_limit
+        self.integral_limit = integral_limit if integral_limit is not None else output_limit
+        self.integral = 0.0
+        self.previous: Optional[float] = None
+
+    def reset(self):
+        self.integral = 0.0
+        self.previous = None
+
+    def update(self, error: float, dt: float) -> float:
+        derivative = 0.0
+        if self.previous is not None and dt > 0:
+            derivative = (error - self.previous) / dt
+            # anti-windup: the integral term alone never exceeds integral_limit
+            if self.ki:
+                self.integral = max(-self.integral_limit / self.ki, min(self.integral_limit / self.ki, self.integral + error * dt))
+        self.previous = error
+        output = self.kp * error + self.ki * self.integral + self.kd * derivative
+        return max(-self.output_limit, min(self.output_limit, output))
+
+def rate_limit(current: float, target: float, max_rate: float, dt: float) -> float:
+    step = max_rate * dt
+    return current + max(-step, min(step, target - current))
+
+class FollowController:
+    # steers towards the detector's target: one PID update per new target on the horizontal offset, sent as drive(linear, angular)
+    def __init__(self, detector: TargetDetector, motor_controller: MotorController, kp: float = 0.4, ki: float = 0.1, kd: float = 0.02,
+                 max_angular: float = 0.6, max_angular_rate: float = 3.0, linear_speed: float = 0.5, max_linear_rate: float = 1.0,
+                 slow_down_offset: float = 0.5, lost_timeout: float = 0.5, width: int = WIDTH):
+        self.logger = logging.getLogger('FollowController')
+        self.detector = detector
+        self.motor_controller = motor_controller
+        self.pid = PID(kp, ki, kd, max_angular)
+        self.max_angular_rate = max_angular_rate # per second
+        self.linear_speed = linear_speed
+        self.max_linear_rate = max_linear_rate # per second
+        self.slow_down_offset = slow_down_offset # offset at which the linear speed reaches 0
+        self.lost_timeout = lost_timeout
+        self.width = width
+        self.linear = 0.0
+        self.angular = 0.0
+        self.last_target: Optional[float] = None
+        self.last_command: Optional[float] = None
+
+        # Thread control
+        self.running = False
+        self.thread = None
+        self.offset_gauge = registry.gauge('follow.offset')
+        self.update_interval = registry.histogram('follow.update_interval')
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = Thread(target=self._follow_loop, daemon=True)
+            self.thread.start()
+            self.logger.info('Follow controller started')
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        self.motor_controller.drive(0, 0)
+        self.logger.info('Follow controller stopped')
+
+    def reset(self):
+        self.pid.reset()
+        self.linear = 0.0
+        self.angular = 0.0
+        self.last_target = None
+        self.last_command = None
+
+    def offset(self, x: float) -> float:
+        # -1 (left edge) .. 1 (right edge)
+        return (x - self.width / 2) / (self.width / 2)
+
+    def update(self, x: float, timestamp: float):
+        offset = self.offset(x)
+        dt = timestamp - self.last_target if self.last_target is not None else 0.0
+        self.last_target = timestamp
+        angular = self.pid.update(offset, dt)
+        linear = self.linear_speed * max(0.0, 1.0 - abs(offset) / self.slow_down_offset)
+
+        now = time.monotonic()
+        # after a (re)start the motors have been stopped for at least lost_timeout
+        elapsed = min(now - self.last_command, self.lost_timeout) if self.last_command is not None else self.lost_timeout
+        self.last_command = now
+        self.angular = rate_limit(self.angular, angular, self.max_angular_rate, elapsed)
+        self.linear = rate_limit(self.linear, linear, self.max_linear_rate, elapsed)
+        self.offset_gauge.set(offset)
+        if dt:
+            self.update_interval.record(dt)
+        # the command outlives a few missed detections, then the motor controller stops by itself
+        self.motor_controller.drive(self.linear, self.angular, self.lost_timeout)
+
+    def _follow_loop(self):
+        self.logger.info('Follow loop started')
+
+        version = 0
+        while self.running:
+            snapshot = self.detector.wait_for_target(version, self.lost_timeout)
+            if snapshot is None or time.monotonic() - snapshot.timestamp > self.lost_timeout:
+                if self.last_target is not None:
+                    self.logger.debug('Target lost')
+                    self.reset()
+                if snapshot is not None:
+                    version = snapshot.version
+                continue
+            version = snapshot.version
+            target = self.detector.predict_target(snapshot.value)
+            self.update(target.x, target.timestamp)
+
+        self.logger.info('Follow loop stopped')
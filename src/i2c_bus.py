@@ -0,0 +1,138 @@
+import math
+import time
+from enum import IntEnum
+from itertools import count
+from threading import Condition
+from typing import Any, Dict, List, Optional, Tuple
+from metrics import registry
+
+# the shield and the compass share one physical bus: every transaction goes through a single BusArbiter
+
+class Priority(IntEnum):
+    EMERGENCY = 0
+    MOTOR = 1
+    SONAR = 2
+    COMPASS = 3
+
+Operation = Tuple[str, tuple] # smbus method name and arguments, e.g. ('read_byte_data', (0x18, 12))
+
+class BatchError(IOError):
+    # operation `index` of a batch failed, the operations before it were executed
+    def __init__(self, index: int, results: list, error: Exception):
+        super().__init__(str(error))
+        self.index = index
+        self.results = results
+        self.error = error
+
+class DeviceStats:
+    def __init__(self, name: str):
+        self.requests = 0
+        self.transactions = 0
+        self.errors = 0
+        self.missed_deadlines = 0
+        self.busy_time = 0.0
+        self.queue_delay = registry.histogram('i2c.%s.queue_delay' % name)
+        self.transaction_counter = registry.counter('i2c.%s.transactions' % name)
+
+class BusArbiter:
+    # non-preemptive priority arbitration: a waiting request runs its whole batch back-to-back once it is granted the bus,
+    # ordered by priority, then earliest deadline. A request that would miss its deadline otherwise goes ahead of
+    # everything but emergencies. Callers execute their own batches, there is no bus thread.
+    URGENCY = 0.002 # s before the deadline
+
+    def __init__(self, bus=None):
+        if bus is None:
+            import smbus
+            bus = smbus.SMBus(1)
+            bus.open(1)
+        self.bus = bus
+        self.condition = Condition()
+        self.waiting: List[Tuple[int, float, int]] = []
+        self.busy = False
+        self.granted: Optional[Tuple[int, float, int]] = None
+        self.sequence = count()
+        self.stats: Dict[str, DeviceStats] = {}
+        self.started = time.monotonic()
+
+    def _device_stats(self, device: str) -> DeviceStats:
+        stats = self.stats.get(device)
+        if stats is None:
+            stats = self.stats.setdefault(device, DeviceStats(device))
+        return stats
+
+    def _next(self, now: float) -> Tuple[int, float, int]:
+        # called with the condition held, decided by whoever frees the bus so waiters never disagree
+        best = min(self.waiting)
+        if best[0] > Priority.EMERGENCY:
+            urgent = [ key for key in self.waiting if key[1] - now < self.URGENCY ]
+            if urgent:
+                return min(urgent, key=lambda key: (key[1], key[0], key[2]))
+        return best
+
+    def execute(self, device: str, priority: Priority, operations: List[Operation], deadline: Optional[float] = None) -> List[Any]:
+        key = (int(priority), deadline if deadline is not None else math.inf, next(self.sequence))
+        stats = self._device_stats(device)
+        submitted = time.monotonic()
+        with self.condition:
+            self.waiting.append(key)
+            if not self.busy and self.granted is None:
+                self.granted = key
+            while self.granted != key:
+                self.condition.wait()
+            self.waiting.remove(key)
+            self.granted = None
+            self.busy = True
+
+        started = time.monotonic()
+        results = []
+        try:
+            for name, args in operations:
+                results.append(getattr(self.bus, name)(*args))
+        except Exception as e:
+            stats.errors += 1
+            raise BatchError(len(results), results, e)
+        finally:
+            finished = time.monotonic()
+            executed = min(len(results) + 1, len(operations))
+            with self.condition:
+                self.busy = False
+                if self.waiting:
+                    self.granted = self._next(finished)
+                stats.requests += 1
+                stats.transactions += executed
+                stats.busy_time += finished - started
+                if deadline is not None and started > deadline:
+                    stats.missed_deadlines += 1
+                self.condition.notify_all()
+            stats.queue_delay.record(started - submitted)
+            stats.transaction_counter.inc(executed)
+        return results
+
+    def reset_stats(self):
+        with self.condition:
+            for stats in self.stats.values():
+                stats.requests = stats.transactions = stats.errors = stats.missed_deadlines = 0
+                stats.busy_time = 0.0
+                stats.queue_delay.reset()
+            self.started = time.monotonic()
+
+    def get_stats(self) -> Dict[str, dict]:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        with self.condition:
+            return {
+                device: {
+                    'requests': stats.requests,
+                    'transactions': stats.transactions,
+                    'errors': stats.errors,
+                    'missed_deadlines': stats.missed_deadlines,
+                    'utilization': stats.busy_time / elapsed,
+                    'queue_delay_p50': stats.queue_delay.percentile(50),
+                    'queue_delay_p99': stats.queue_delay.percentile(99),
+                    'queue_delay_max': stats.queue_delay.max,
+                }
+                for device, stats in self.stats.items()
+            }
+
+def get_arbiter(bus=None) -> BusArbiter:
+    # devices accept an arbiter (shared bus), a raw smbus-like bus or nothing (opens smbus 1), the latter two get a private arbiter
+    return bus if isinstance(bus, BusArbiter) else BusArbiter(bus)
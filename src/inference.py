@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import os
+import platform
+import time
+import cv2
+import numpy as np
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+class InferenceSettings(NamedTuple):
+    backend: str = 'opencv' # cv2.dnn backend (see DNN_BACKENDS), 'onnxruntime' (CPU) or 'torch' (YOLO)
+    target: str = 'cpu' # cv2.dnn target (see DNN_TARGETS)
+    input_size: int = 300 # square network input, pixels
+    threads: int = 0 # 0: the library's default
+
+class TuningResult(NamedTuple):
+    settings: InferenceSettings
+    fps: float # single detector thread: model call and result parsing
+    confidence: float # mean confidence of the target over the clip, frames without it count as 0
+
+DNN_BACKENDS = { 'opencv': 'DNN_BACKEND_OPENCV', 'openvino': 'DNN_BACKEND_INFERENCE_ENGINE', 'vulkan': 'DNN_BACKEND_VKCOM', 'cuda': 'DNN_BACKEND_CUDA' }
+DNN_TARGETS = { 'cpu': 'DNN_TARGET_CPU', 'opencl': 'DNN_TARGET_OPENCL', 'opencl_fp16': 'DNN_TARGET_OPENCL_FP16', 'vulkan': 'DNN_TARGET_VULKAN', 'cuda': 'DNN_TARGET_CUDA' }
+
+def thread_options() -> List[int]:
+    cpus = os.cpu_count() or 1
+    return [ threads for threads in (1, 2) if threads < cpus ] + [ cpus ]
+
+class OnnxRuntimeNetwork:
+    # cv2.dnn.Net-like (setInput / forward) over an ONNX Runtime CPU session, the model has to give the same output
+    def __init__(self, path: str, threads: int = 0):
+        import onnxruntime # only needed for this backend
+        options = onnxruntime.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.blob: Optional[np.ndarray] = None
+
+    def setInput(self, blob: np.ndarray):
+        self.blob = blob
+
+    def forward(self) -> np.ndarray:
+        return self.session.run(None, { self.input_name: self.blob })[0]
+
+def load_network(settings: InferenceSettings, prototxt: str, caffemodel: str, onnx_model: Optional[str] = None):
+    if settings.backend == 'onnxruntime':
+        if onnx_model is None:
+            raise ValueError('The onnxruntime backend needs an ONNX model')
+        return OnnxRuntimeNetwork(onnx_model, settings.threads)
+    network = cv2.dnn.readNetFromCaffe(prototxt, caffemodel)
+    network.setPreferableBackend(getattr(cv2.dnn, DNN_BACKENDS[settings.backend]))
+    network.setPreferableTarget(getattr(cv2.dnn, DNN_TARGETS[settings.target]))
+    # process-wide, every cv2 network shares the pool (negative: back to the default)
+    cv2.setNumThreads(settings.threads if settings.threads > 0 else -1)
+    return network
+
+def model_fingerprint(paths: Sequence[str]) -> List[list]:
+    # name, size and modification time: a replaced model invalidates cached settings
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            fingerprint.append([ os.path.basename(path), stat.st_size, int(stat.st_mtime) ])
+        except OSError:
+            fingerprint.append([ os.path.basename(path), None, None ])
+    return fingerprint
+
+class Autotuner:
+    # measures every candidate on a small reference clip (frames shaped like the camera's) and keeps the fastest one that
+    # reaches target_fps at min_confidence; the choice is cached on disk per model, frame shape, candidates and machine,
+    # later startups skip the measurements
+    def __init__(self, cache_path: Optional[str] = 'inference_settings.json', target_fps: float = 10.0, min_confidence: float = 0.5):
+        self.logger = logging.getLogger('Autotuner')
+        self.cache_path = cache_path
+        self.target_fps = target_fps
+        self.min_confidence = min_confidence
+        self.results: List[TuningResult] = []
+        self.cached = False
+
+    def key(self, candidates: Sequence[InferenceSettings], context: Dict) -> str:
+        description = dict(context, candidates=[ list(candidate) for candidate in candidates ], target_fps=self.target_fps, min_confidence=self.min_confidence,
+                           machine=platform.machine(), cpus=os.cpu_count(), opencv=cv2.__version__)
+        return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def _load_cache(self) -> Dict:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            self.logger.warning('Ignoring the settings cache %s: %s', self.cache_path, e)
+            return {}
+
+    def _save_cache(self, key: str, result: TuningResult):
+        if not self.cache_path:
+            return
+        cache = self._load_cache()
+        cache[key] = { 'settings': result.settings._asdict(), 'fps': result.fps, 'confidence': result.confidence, 'tuned': time.time() }
+        with open(self.cache_path, 'w') as file:
+            json.dump(cache, file, indent=1)
+
+    def select(self, results: Sequence[TuningResult]) -> TuningResult:
+        # fastest that meets both; else the fastest confident enough; else the most confident
+        confident = [ result for result in results if result.confidence >= self.min_confidence ]
+        passing = [ result for result in confident if result.fps >= self.target_fps ]
+        if passing:
+            return max(passing, key=lambda result: result.fps)
+        if confident:
+            self.logger.warning('No setting reaches %.1f FPS, taking the fastest confident one', self.target_fps)
+            return max(confident, key=lambda result: result.fps)
+        self.logger.warning('No setting reaches confidence %.2f on the clip, taking the most confident one', self.min_confidence)
+        return max(results, key=lambda result: result.confidence)
+
+    def tune(self, measure: Callable[[InferenceSettings], TuningResult], candidates: Sequence[InferenceSettings], context: Dict) -> InferenceSettings:
+        key = self.key(candidates, context)
+        cached = self._load_cache().get(key)
+        if cached is not None:
+            self.cached = True
+            return InferenceSettings(**cached['settings'])
+        self.cached = False
+        self.results = []
+        for candidate in candidates:
+            try:
+                result = measure(candidate)
+            except Exception as e:
+                # backend or target not available here
+                self.logger.info('Skipping %s: %s', candidate, e)
+                continue
+            self.logger.info('%s: %.1f FPS, confidence %.2f', candidate, result.fps, result.confidence)
+            self.results.append(result)
+        if not self.results:
+            raise RuntimeError('No inference setting could be measured')
+        best = self.select(self.results)
+        self._save_cache(key, best)
+        self.logger.info('Selected %s: %.1f FPS, confidence %.2f', best.settings, best.fps, best.confidence)
+        return best.settings
@@ -0,0 +1,158 @@
+import bisect
+import logging
+from threading import Event, Lock, Thread
+from typing import Dict, Optional
+
+# log-spaced latency buckets from 1us to ~100s, 10 per decade
+BUCKET_BOUNDS = [ 10 ** (exponent / 10) for exponent in range(-60, 21) ]
+
+class Histogram:
+    # fixed-memory latency histogram in seconds, percentiles are bucket upper bounds (<= 26% relative error)
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = Lock()
+        self.counts = [ 0 ] * (len(BUCKET_BOUNDS) + 1)
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value: float):
+        # hot path: one bisect and three updates under an uncontended lock
+        index = bisect.bisect_left(BUCKET_BOUNDS, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, percentile: float) -> float:
+        with self.lock:
+            counts, maximum = list(self.counts), self.max
+        count = sum(counts)
+        if count == 0:
+            return 0.0
+        rank = percentile / 100 * count
+        total = 0
+        for index, bucket in enumerate(counts):
+            total += bucket
+            if total >= rank and bucket:
+                return min(BUCKET_BOUNDS[index] if index < len(BUCKET_BOUNDS) else maximum, maximum)
+        return maximum
+
+    def reset(self):
+        with self.lock:
+            self.counts = [ 0 ] * (len(BUCKET_BOUNDS) + 1)
+            self.sum = 0.0
+            self.max = 0.0
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            count, total, maximum = sum(self.counts), self.sum, self.max
+        return {
+            'count': count,
+            'mean': total / count if count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': maximum,
+        }
+
+class Counter:
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = Lock()
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        with self.lock:
+            self.value += amount
+
+    def reset(self):
+        with self.lock:
+            self.value = 0
+
+    def snapshot(self) -> int:
+        return self.value
+
+class Gauge:
+    def __init__(self, name: str):
+        self.name = name
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def reset(self):
+        self.value = 0.0
+
+    def snapshot(self) -> float:
+        return self.value
+
+class Registry:
+    def __init__(self):
+        self.lock = Lock()
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, Counter] = {}
+        self.gauges: Dict[str, Gauge] = {}
+        self.reporter: Optional[Thread] = None
+        self.reporter_stop = Event()
+
+    def _get(self, metrics: dict, name: str, factory):
+        metric = metrics.get(name)
+        if metric is None:
+            with self.lock:
+                metric = metrics.setdefault(name, factory(name))
+        return metric
+
+    def histogram(self, name: str) -> Histogram:
+        return self._get(self.histograms, name, Histogram)
+
+    def counter(self, name: str) -> Counter:
+        return self._get(self.counters, name, Counter)
+
+    def gauge(self, name: str) -> Gauge:
+        return self._get(self.gauges, name, Gauge)
+
+    def snapshot(self) -> dict:
+        return {
+            'histograms': { name: histogram.snapshot() for name, histogram in list(self.histograms.items()) },
+            'counters': { name: counter.snapshot() for name, counter in list(self.counters.items()) },
+            'gauges': { name: gauge.snapshot() for name, gauge in list(self.gauges.items()) },
+        }
+
+    def reset(self):
+        for metrics in (self.histograms, self.counters, self.gauges):
+            for metric in list(metrics.values()):
+                metric.reset()
+
+    def format_summary(self) -> str:
+        snapshot = self.snapshot()
+        lines = []
+        for name, histogram in sorted(snapshot['histograms'].items()):
+            lines.append('%-40s n=%-7d p50=%9.3fms p99=%9.3fms max=%9.3fms' % (name, histogram['count'], 1000 * histogram['p50'], 1000 * histogram['p99'], 1000 * histogram['max']))
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('%-40s %d' % (name, value))
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append('%-40s %.3f' % (name, value))
+        return '\n'.join(lines)
+
+    def start_reporter(self, interval: float = 10.0, logger: Optional[logging.Logger] = None):
+        # logs a summary every `interval` seconds from a daemon thread
+        if self.reporter is not None:
+            return
+        logger = logger or logging.getLogger('Metrics')
+        self.reporter_stop.clear()
+
+        def report():
+            while not self.reporter_stop.wait(interval):
+                logger.info('Metrics:\n%s', self.format_summary())
+
+        self.reporter = Thread(target=report, daemon=True)
+        self.reporter.start()
+
+    def stop_reporter(self):
+        self.reporter_stop.set()
+        if self.reporter:
+            self.reporter.join()
+        self.reporter = None
+
+registry = Registry()
@@ -1,26 +1,67 @@
 from board import Board
+from compass_sensor import CompassSensor, HeadingEstimate, TurnDirection
+import logging
+import math
 import threading
 import time
 import queue
 from enum import Enum
+from typing import Optional, Tuple
+from metrics import registry
 
 SPEED = 500
+MAX_PWM = 1000
 
 class Direction(Enum):
     FORWARD = 'forward'
     LEFT = 'left'
     RIGHT = 'right'
     NONE = 'none'
+    DRIVE = 'drive'
+
+# (linear, angular) of the fixed directions, as fractions of MAX_PWM
+DIRECTION_SPEEDS = {
+    Direction.FORWARD: (SPEED / MAX_PWM, 0.0),
+    Direction.LEFT: (0.0, -SPEED / MAX_PWM),
+    Direction.RIGHT: (0.0, SPEED / MAX_PWM),
+    Direction.NONE: (0.0, 0.0),
+}
+
+def wheel_commands(linear: float, angular: float) -> Tuple[int, int, int, int]:
+    # differential drive: angular > 0 turns clockwise, motor 1 is the right wheel, motor 2 the left one
+    left, right = linear + angular, linear - angular
+    scale = max(1.0, abs(left), abs(right))
+    left, right = left / scale, right / scale
+    return int(right >= 0), int(left >= 0), int(round(abs(right) * MAX_PWM)), int(round(abs(left) * MAX_PWM))
 
 class MotorController:
-    def __init__(self, board):
+    REPORT_INTERVAL = 1.0
+
+    def __init__(self, board, compass_sensor: Optional[CompassSensor] = None):
+        self.logger = logging.getLogger('MotorController')
         self.board = board
         self.board.stop()
+        self.compass_sensor = compass_sensor
 
         # Thread control
         self.running = False
         self.thread = None
         self.direction_queue = queue.Queue()
+        # motor state as last written by this controller, the board is only touched when it changes
+        self.state = Direction.NONE
+        self.speeds = DIRECTION_SPEEDS[Direction.NONE]
+        self.command_until = 0.0
+        self.state_lock = threading.Lock()
+        self.turn_trigger: Optional[int] = None
+        self.command_time = registry.histogram('motor.command')
+        self.queue_depth = registry.gauge('motor.queue_depth')
+        self.motor_writes = registry.counter('board.motor_writes')
+        self.bus_rate = { key: registry.gauge('motor.bus_transactions_per_second.' + key) for key in ('idle', 'driving') }
+        self.bus_time = { key: 0.0 for key in self.bus_rate }
+        self.bus_count = { key: 0 for key in self.bus_rate }
+        self.accounted = 0.0
+        self.accounted_writes = 0
+        self.next_report = 0.0
 
     def start(self):
         if not self.running:
@@ -28,46 +69,138 @@ class MotorController:
             self.thread = threading.Thread(target=self._control_loop, daemon=True)
             self.thread.start()
             self.logger.info('Motor controller started')
-    
+
     def stop(self):
-        self.board.stop()
         self.running = False
+        self._wake()
         if self.thread:
             self.thread.join()
+        self._cancel_turn()
+        with self.state_lock:
+            self._apply(Direction.NONE)
         self.logger.info('Motor controller stopped')
-    
+
     def send_direction(self, direction, duration: float = 0.5):
-        self.direction_queue.put((direction, duration))
+        if direction not in DIRECTION_SPEEDS:
+            # DRIVE is the state of a drive() command, it has no fixed speeds
+            raise ValueError('No fixed speeds for %s, use drive(linear, angular) instead' % direction)
+        self._cancel_turn()
+        self.direction_queue.put((direction, duration, DIRECTION_SPEEDS[direction]))
+
+    def drive(self, linear: float, angular: float, duration: float = 0.5):
+        # continuous command: linear (forward > 0) and angular (clockwise > 0) speeds in [-1, 1] of MAX_PWM,
+        # the motors stop unless another command follows within `duration`
+        linear, angular = max(-1.0, min(1.0, linear)), max(-1.0, min(1.0, angular))
+        self._cancel_turn()
+        direction = Direction.NONE if linear == 0 and angular == 0 else Direction.DRIVE
+        self.direction_queue.put((direction, duration, (linear, angular)))
+
+    def _wake(self):
+        self.direction_queue.put((None, None, None))
+
+    def _cancel_turn(self):
+        with self.state_lock:
+            self._drop_turn_trigger()
+
+    def _drop_turn_trigger(self):
+        # caller holds the state lock
+        if self.turn_trigger is not None:
+            self.compass_sensor.cancel_callback(self.turn_trigger)
+            self.turn_trigger = None
+
+    def turn_by(self, degrees: float, timeout: float = 2.0) -> threading.Event:
+        # closed-loop turn (positive = clockwise): the compass thread stops the motors as soon as the target heading is crossed
+        if self.compass_sensor is None:
+            raise ValueError('turn_by requires a compass sensor')
+        heading = self.compass_sensor.get_heading()
+        if heading is None:
+            raise ValueError('No compass heading available')
+
+        reached = threading.Event()
+        clockwise = degrees > 0
+        target = (heading.heading + degrees) % 360
+
+        def on_target(estimate: HeadingEstimate):
+            with self.state_lock:
+                if self.turn_trigger != trigger_id:
+                    return
+                self.turn_trigger = None
+                self._apply(Direction.NONE)
+            self.logger.debug('Turn reached %.1f (target %.1f)', estimate.heading, target)
+            reached.set()
+
+        self._cancel_turn()
+        # the turn supersedes any queued command
+        while not self.direction_queue.empty():
+            try:
+                self.direction_queue.get_nowait()
+            except queue.Empty:
+                break
+        with self.state_lock:
+            trigger_id = self.compass_sensor.register_callback(target, on_target, TurnDirection.CLOCKWISE if clockwise else TurnDirection.COUNTER_CLOCKWISE)
+            self.turn_trigger = trigger_id
+            self.command_until = time.monotonic() + timeout
+            self._apply(Direction.RIGHT if clockwise else Direction.LEFT)
+        # the loop has to pick up the new deadline
+        self._wake()
+        return reached
+
+    def _apply(self, direction: Direction, speeds: Optional[Tuple[float, float]] = None):
+        # caller holds the state lock
+        speeds = speeds or DIRECTION_SPEEDS[direction]
+        self.board.set_drive(*wheel_commands(*speeds))
+        self.state = direction
+        self.speeds = speeds
+
+    def _account_bus(self, now: float, state: Direction):
+        # attributes the motor register writes since the last wakeup to the motor state that was active
+        writes = self.motor_writes.snapshot()
+        key = 'idle' if state == Direction.NONE else 'driving'
+        self.bus_time[key] += now - self.accounted
+        self.bus_count[key] += writes - self.accounted_writes
+        self.accounted, self.accounted_writes = now, writes
+        if now >= self.next_report:
+            for key, gauge in self.bus_rate.items():
+                if self.bus_time[key] > 0:
+                    gauge.set(self.bus_count[key] / self.bus_time[key])
+                self.bus_time[key], self.bus_count[key] = 0.0, 0
+            self.next_report = now + self.REPORT_INTERVAL
 
     def _control_loop(self):
         self.logger.info('Motor control loop started')
+        self.accounted, self.accounted_writes = time.monotonic(), self.motor_writes.snapshot()
+        self.next_report = self.accounted + self.REPORT_INTERVAL
 
-        command_until = 0
-        
         while self.running:
-            # Process any pending commands
+            # sleeps until a command arrives, the running command expires or the bus rates are due
+            with self.state_lock:
+                state, deadline = self.state, self.command_until if self.state != Direction.NONE else math.inf
+            self.queue_depth.set(self.direction_queue.qsize())
+            direction, duration, speeds = None, None, None
             try:
-                direction, duration = None, None
-                while not self.direction_queue.empty():
-                    direction, duration = self.direction_queue.get_nowait()
-                if direction:
-                    self.logger.debug(f'Direction: {direction}, duration: {duration}ms')
-                    if direction == Direction.FORWARD:
-                        self.board.forward(SPEED)
-                    elif direction == Direction.LEFT:
-                        self.board.turn_left(SPEED)
-                    elif direction == Direction.RIGHT:
-                        self.board.turn_right(SPEED)
-                    else:
-                        self.board.stop()
-                    command_until = time.time() + duration
+                item = self.direction_queue.get(timeout=max(min(deadline, self.next_report) - time.monotonic(), 0))
+                # only the latest command matters, (None, None, None) just wakes the loop up
+                while True:
+                    if item[0] is not None:
+                        direction, duration, speeds = item
+                    item = self.direction_queue.get_nowait()
             except queue.Empty:
                 pass
 
-            now = time.time()
-            if now > command_until:
-                self.board.stop()
+            now = time.monotonic()
+            self._account_bus(now, state)
+            if direction is not None:
+                start = time.perf_counter()
+                self.logger.debug(f'Direction: {direction} {speeds}, duration: {duration}s')
+                with self.state_lock:
+                    self._apply(direction, speeds)
+                    self.command_until = now + duration
+                self.command_time.record(time.perf_counter() - start)
+            elif state != Direction.NONE and now >= deadline:
+                # re-checked under the lock: a turn_by() or drive() since the deadline was read keeps its trigger
+                with self.state_lock:
+                    if self.state != Direction.NONE and time.monotonic() >= self.command_until:
+                        self._drop_turn_trigger()
+                        self._apply(Direction.NONE)
 
-            time.sleep(0.01)
-        
-        self.logger.info('Motor control loop stopped')
\ No newline at end of file
+        self.logger.info('Motor control loop stopped')
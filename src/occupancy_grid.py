@@ -0,0 +1,177 @@
+import logging
+import math
+import time
+import numpy as np
+from threading import Lock, Thread
+from typing import Callable, Optional, Tuple
+from compass_sensor import CompassSensor
+from distance_sensor import DistanceSensor
+from metrics import registry
+
+# world frame: x = east, y = north (heading 0), cm; grid rows go along y, columns along x
+
+class OccupancyGrid:
+    # fixed-size log-odds grid centred on the robot, scrolls in whole cells as the robot moves (memory stays size * size)
+    def __init__(self, size: int = 128, resolution: float = 2.0, beam_width: float = 15.0, max_range: float = 70.0,
+                 occupied: float = 0.85, free: float = -0.4, clamp: float = 4.0):
+        self.size = size
+        self.resolution = resolution
+        self.max_range = max_range
+        self.occupied = occupied
+        self.free = free
+        self.clamp = clamp
+        self.lock = Lock()
+        self.log_odds = np.zeros((size, size), dtype=np.float32)
+        # world coordinates of the centre of cell (0, 0)
+        self.origin = np.array([ -(size // 2) * resolution, -(size // 2) * resolution ])
+        # rays across the beam: neighbouring rays at most a cell apart at max_range
+        rays = max(2, int(math.ceil(math.radians(beam_width) * max_range / resolution)) + 1)
+        self.ray_offsets = np.linspace(-beam_width / 2, beam_width / 2, rays)
+        # samples along each ray every half cell
+        self.ranges = np.arange(0.0, max_range, resolution / 2)
+        self.free_mask = np.zeros(size * size, dtype=bool)
+        self.occupied_mask = np.zeros(size * size, dtype=bool)
+        self.update_time = registry.histogram('grid.update')
+
+    def _scroll(self, rows: int, columns: int):
+        # moves the window by whole cells, the uncovered cells become unknown (0)
+        grid = self.log_odds
+        if abs(rows) >= self.size or abs(columns) >= self.size:
+            grid[:] = 0
+        else:
+            grid[:] = np.roll(grid, (-rows, -columns), axis=(0, 1))
+            if rows > 0:
+                grid[-rows:, :] = 0
+            elif rows < 0:
+                grid[:-rows, :] = 0
+            if columns > 0:
+                grid[:, -columns:] = 0
+            elif columns < 0:
+                grid[:, :-columns] = 0
+        self.origin += np.array([ columns, rows ]) * self.resolution
+
+    def recenter(self, x: float, y: float):
+        centre = self.origin + (self.size // 2) * self.resolution
+        columns = int(round((x - centre[0]) / self.resolution))
+        rows = int(round((y - centre[1]) / self.resolution))
+        if rows or columns:
+            self._scroll(rows, columns)
+
+    def _cells(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        # flat cell indices, -1 outside the window
+        columns = np.floor((x - self.origin[0]) / self.resolution + 0.5).astype(np.int64)
+        rows = np.floor((y - self.origin[1]) / self.resolution + 0.5).astype(np.int64)
+        inside = (columns >= 0) & (columns < self.size) & (rows >= 0) & (rows < self.size)
+        return np.where(inside, rows * self.size + columns, -1)
+
+    def update(self, bearings: np.ndarray, distances: np.ndarray, x: float = 0.0, y: float = 0.0):
+        # bearings: world bearing of each beam centre (degrees, clockwise from north), distances in cm (NaN: no valid
+        # reading, skipped; <= 0: no echo and beyond max_range: nothing hit, free up to max_range); robot at (x, y).
+        # All beams of a sweep are applied in one vectorized pass.
+        start = time.perf_counter()
+        with self.lock:
+            self.recenter(x, y)
+            distances = np.asarray(distances, dtype=float)
+            valid = ~np.isnan(distances)
+            bearings, distances = np.asarray(bearings)[valid], distances[valid]
+            if len(distances) == 0:
+                return
+            distances = np.where(distances > 0, distances, np.inf)
+            radians = np.radians(bearings[:, None] + self.ray_offsets[None, :])
+            dx, dy = np.sin(radians), np.cos(radians)
+            hit = distances < self.max_range
+
+            # free: every sample in front of the echo (half a cell margin), up to max_range without an echo
+            reach = np.minimum(distances, self.max_range)[:, None, None] - self.resolution / 2
+            ranges = self.ranges[None, None, :]
+            cells = self._cells(x + dx[:, :, None] * ranges, y + dy[:, :, None] * ranges)
+            free_cells = cells[np.broadcast_to(ranges < reach, cells.shape)]
+            # occupied: the arc at the echo distance
+            occupied_cells = self._cells(x + dx[hit] * distances[hit, None], y + dy[hit] * distances[hit, None]).ravel()
+
+            # each cell counts once per sweep, however many rays cross it; a hit overrides free
+            self.free_mask[:] = False
+            self.occupied_mask[:] = False
+            self.free_mask[free_cells[free_cells >= 0]] = True
+            self.occupied_mask[occupied_cells[occupied_cells >= 0]] = True
+            self.free_mask &= ~self.occupied_mask
+            flat = self.log_odds.reshape(-1)
+            flat[self.free_mask] += self.free
+            flat[self.occupied_mask] += self.occupied
+            np.clip(self.log_odds, -self.clamp, self.clamp, out=self.log_odds)
+        self.update_time.record(time.perf_counter() - start)
+
+    def probabilities(self) -> np.ndarray:
+        with self.lock:
+            return 1.0 / (1.0 + np.exp(-self.log_odds))
+
+    def occupied_points(self, threshold: float = 0.7) -> np.ndarray:
+        # world (x, y) of the cells above `threshold` occupancy probability, (n, 2)
+        limit = math.log(threshold / (1.0 - threshold))
+        with self.lock:
+            rows, columns = np.nonzero(self.log_odds > limit)
+            origin = self.origin.copy()
+        return np.stack([ origin[0] + columns * self.resolution, origin[1] + rows * self.resolution ], axis=1)
+
+    def probability_at(self, x: float, y: float) -> float:
+        with self.lock:
+            cell = int(self._cells(np.array([ x ]), np.array([ y ]))[0])
+            if cell < 0:
+                return 0.5
+            return float(1.0 / (1.0 + math.exp(-self.log_odds.flat[cell])))
+
+def servo_to_bearing(angles: np.ndarray, headings: np.ndarray) -> np.ndarray:
+    # servo 90 = ahead, larger angles to the left
+    return (headings + 90.0 - angles) % 360
+
+class OccupancyMapper:
+    # feeds every sweep into the grid, each reading rotated by the compass heading at its timestamp;
+    # position: callable returning the robot's (x, y) in cm (there is no odometry yet, default keeps the robot at the origin)
+    def __init__(self, distance_sensor: DistanceSensor, compass_sensor: CompassSensor, grid: Optional[OccupancyGrid] = None,
+                 position: Optional[Callable[[], Tuple[float, float]]] = None):
+        self.logger = logging.getLogger('OccupancyMapper')
+        self.distance_sensor = distance_sensor
+        self.compass_sensor = compass_sensor
+        self.grid = grid or OccupancyGrid()
+        self.position = position or (lambda: (0.0, 0.0))
+
+        # Thread control
+        self.running = False
+        self.thread = None
+        self.sweeps = 0
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = Thread(target=self._mapping_loop, daemon=True)
+            self.thread.start()
+            self.logger.info('Occupancy mapper started')
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        self.logger.info('Occupancy mapper stopped')
+
+    def apply(self, readings: np.ndarray) -> bool:
+        # readings: (n, 3) timestamp, servo angle, distance
+        headings = self.compass_sensor.heading_at(readings[:, 0])
+        if headings is None:
+            return False
+        x, y = self.position()
+        self.grid.update(servo_to_bearing(readings[:, 1], headings), readings[:, 2], x, y)
+        self.sweeps += 1
+        return True
+
+    def _mapping_loop(self):
+        self.logger.info('Occupancy mapping loop started')
+
+        version = 0
+        while self.running:
+            snapshot = self.distance_sensor.sweeps.wait_for(version, 0.5)
+            if snapshot is None:
+                continue
+            version = snapshot.version
+            self.apply(snapshot.value)
+
+        self.logger.info('Occupancy mapping loop stopped')
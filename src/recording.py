@@ -0,0 +1,268 @@
+import json
+import os
+import time
+import numpy as np
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+from board import moves_forward
+from compass import Compass, CompassSample
+
+# append-only, memory-mapped logs: one file per stream, each column stored contiguously (frames are a column of fixed-size slots)
+# <stream>.json holds the schema, <stream>.bin a 64 byte header (magic, capacity, count) followed by the column regions
+
+MAGIC = b'RCV3'
+HEADER_SIZE = 64
+ALIGNMENT = 64
+
+SONIC_COLUMNS = [ ('timestamp', 'f8', ()), ('angle', 'f4', ()), ('distance', 'f4', ()) ]
+COMPASS_COLUMNS = [ ('timestamp', 'f8', ()), ('x', 'i2', ()), ('y', 'i2', ()), ('z', 'i2', ()), ('temperature', 'i2', ()), ('status', 'u1', ()) ]
+MOTOR_COLUMNS = [ ('timestamp', 'f8', ()), ('dir1', 'i2', ()), ('dir2', 'i2', ()), ('pwm1', 'i2', ()), ('pwm2', 'i2', ()) ]
+
+def _frame_columns(shape: Tuple[int, int, int]) -> list:
+    return [ ('timestamp', 'f8', ()), ('sequence', 'i8', ()), ('image', 'u1', tuple(shape)) ]
+
+class ColumnLog:
+    def __init__(self, path: str, columns: Optional[list] = None, capacity: int = 0):
+        # with columns: creates a new log of `capacity` rows, without: opens an existing one read-only
+        self.path = path
+        self.lock = Lock()
+        if columns is not None:
+            with open(path + '.json', 'w') as file:
+                json.dump({ 'columns': [ [ name, dtype, list(shape) ] for name, dtype, shape in columns ], 'capacity': capacity }, file)
+            mode = 'w+'
+        else:
+            with open(path + '.json') as file:
+                schema = json.load(file)
+            columns = [ (name, dtype, tuple(shape)) for name, dtype, shape in schema['columns'] ]
+            capacity = schema['capacity']
+            mode = 'r'
+        self.capacity = capacity
+
+        offsets = []
+        size = HEADER_SIZE
+        for _, dtype, shape in columns:
+            offsets.append(size)
+            size += -(-(capacity * np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64))) // ALIGNMENT) * ALIGNMENT
+        self.buffer = np.memmap(path + '.bin', dtype=np.uint8, mode=mode, shape=(size,))
+        self.header = self.buffer[:HEADER_SIZE].view(np.uint64)
+        if mode == 'w+':
+            self.buffer[:4] = np.frombuffer(MAGIC, dtype=np.uint8)
+            self.header[1] = capacity
+            self.header[2] = 0
+        elif bytes(self.buffer[:4]) != MAGIC:
+            raise ValueError('Not a recording: %s' % path)
+        self.columns: Dict[str, np.ndarray] = {}
+        for (name, dtype, shape), offset in zip(columns, offsets):
+            length = capacity * np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64))
+            self.columns[name] = self.buffer[offset:offset + length].view(dtype).reshape((capacity,) + shape)
+        self.dropped = 0
+
+    def __len__(self):
+        return int(self.header[2])
+
+    def append(self, **values) -> bool:
+        with self.lock:
+            index = len(self)
+            if index >= self.capacity:
+                self.dropped += 1
+                return False
+            for name, value in values.items():
+                self.columns[name][index] = value
+            # the row only becomes visible once every column is written
+            self.header[2] = index + 1
+            return True
+
+    def column(self, name: str) -> np.ndarray:
+        return self.columns[name][:len(self)]
+
+    def flush(self):
+        self.buffer.flush()
+
+class Recorder:
+    def __init__(self, path: str, frame_shape: Tuple[int, int, int] = (480, 640, 3), max_frames: int = 900, max_samples: int = 200000):
+        os.makedirs(path, exist_ok=True)
+        self.frames = ColumnLog(os.path.join(path, 'frames'), _frame_columns(frame_shape), max_frames)
+        self.sonic = ColumnLog(os.path.join(path, 'sonic'), SONIC_COLUMNS, max_samples)
+        self.compass = ColumnLog(os.path.join(path, 'compass'), COMPASS_COLUMNS, max_samples)
+        self.motor = ColumnLog(os.path.join(path, 'motor'), MOTOR_COLUMNS, max_samples)
+
+    def attach(self, detector=None, distance_sensor=None, compass_sensor=None, board=None):
+        for component in (detector, distance_sensor, compass_sensor, board):
+            if component is not None:
+                component.recorder = self
+
+    def record_frame(self, timestamp: float, sequence: int, image: np.ndarray):
+        if image.shape == self.frames.columns['image'].shape[1:]:
+            self.frames.append(timestamp=timestamp, sequence=sequence, image=image)
+        else:
+            self.frames.dropped += 1
+
+    def record_sonic(self, timestamp: float, angle: Optional[float], distance: float):
+        self.sonic.append(timestamp=timestamp, angle=np.nan if angle is None else angle, distance=distance)
+
+    def record_compass(self, sample: CompassSample):
+        self.compass.append(timestamp=sample.timestamp, x=sample.x, y=sample.y, z=sample.z, temperature=sample.temperature, status=sample.status)
+
+    def record_motor(self, timestamp: float, dir1: int, dir2: int, pwm1: int, pwm2: int):
+        self.motor.append(timestamp=timestamp, dir1=dir1, dir2=dir2, pwm1=pwm1, pwm2=pwm2)
+
+    def close(self):
+        for log in (self.frames, self.sonic, self.compass, self.motor):
+            log.flush()
+
+class Recording:
+    def __init__(self, path: str):
+        self.frames = ColumnLog(os.path.join(path, 'frames'))
+        self.sonic = ColumnLog(os.path.join(path, 'sonic'))
+        self.compass = ColumnLog(os.path.join(path, 'compass'))
+        self.motor = ColumnLog(os.path.join(path, 'motor'))
+
+    def start_time(self) -> float:
+        starts = [ log.column('timestamp')[0] for log in (self.frames, self.sonic, self.compass, self.motor) if len(log) ]
+        return float(min(starts)) if starts else 0.0
+
+    def clip(self, count: int = 10) -> np.ndarray:
+        # `count` frames spread over the recording, e.g. the reference clip for TargetDetector.autotune
+        images = self.frames.column('image')
+        return np.array(images[np.linspace(0, len(images) - 1, min(count, len(images))).astype(int)])
+
+class ReplayClock:
+    # realtime: waits until a recorded timestamp is due on the wall clock, otherwise runs as fast as possible
+    def __init__(self, origin: float, realtime: bool = True):
+        self.origin = origin
+        self.realtime = realtime
+        self.start = time.monotonic()
+
+    def wait_until(self, timestamp: float):
+        if self.realtime:
+            delay = self.start + (timestamp - self.origin) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+class ReplayCamera:
+    # stand-in for cv2.VideoCapture
+    def __init__(self, recording: Recording, clock: ReplayClock, loop: bool = False):
+        self.log = recording.frames
+        self.clock = clock
+        self.loop = loop
+        self.index = -1
+
+    def isOpened(self) -> bool:
+        return True
+
+    def set(self, prop: int, value: float) -> bool:
+        return True
+
+    def release(self):
+        pass
+
+    def grab(self) -> bool:
+        if self.index + 1 >= len(self.log):
+            if not self.loop or len(self.log) == 0:
+                return False
+            self.index = -1
+        self.index += 1
+        self.clock.wait_until(self.log.columns['timestamp'][self.index])
+        return True
+
+    def retrieve(self, image: Optional[np.ndarray] = None) -> tuple:
+        if self.index < 0:
+            return False, None
+        frame = self.log.columns['image'][self.index]
+        if image is None or image.shape != frame.shape:
+            return True, np.array(frame)
+        np.copyto(image, frame)
+        return True, image
+
+    def read(self) -> tuple:
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+class ReplayBoard:
+    # stand-in for Board: sonic readings come from the recording, motor commands are collected
+    CMD_SERVO1 = 0
+    SONIC_PING_INTERVAL = 0.0 # readings are paced by their recorded timestamps
+
+    def __init__(self, recording: Recording, clock: ReplayClock):
+        self.log = recording.sonic
+        self.clock = clock
+        self.index = 0
+        self.servo_angle: Optional[float] = None
+        self.commands: List[Tuple[float, int, int, int, int]] = []
+        self.forward_blocked = False
+
+    def set_servo_angle(self, servo: int, angle: float):
+        self.servo_angle = angle
+
+    def get_sonic_distance(self) -> float:
+        if self.index >= len(self.log):
+            return 0.0
+        self.clock.wait_until(self.log.columns['timestamp'][self.index])
+        distance = float(self.log.columns['distance'][self.index])
+        self.index += 1
+        return distance
+
+    def set_drive(self, dir1: int, dir2: int, pwm1: int, pwm2: int, force: bool = False) -> int:
+        if self.forward_blocked and moves_forward(dir1, dir2, pwm1, pwm2):
+            pwm1 = pwm2 = 0
+        self.commands.append((time.monotonic(), dir1, dir2, pwm1, pwm2))
+        return 0
+
+    def get_drive(self) -> Optional[Tuple[int, int, int, int]]:
+        return self.commands[-1][1:] if self.commands else None
+
+    def stop(self):
+        self.set_drive(1, 1, 0, 0)
+
+    def emergency_stop(self, hold: bool = False):
+        if hold:
+            self.forward_blocked = True
+        self.set_drive(1, 1, 0, 0)
+
+    def release_stop(self):
+        self.forward_blocked = False
+
+    def forward(self, pwm: int = 500):
+        self.set_drive(1, 1, pwm, pwm)
+
+    def backward(self, pwm: int = 500):
+        self.set_drive(0, 0, pwm, pwm)
+
+    def turn_left(self, pwm: int = 500):
+        self.set_drive(1, 0, pwm, pwm)
+
+    def turn_right(self, pwm: int = 500):
+        self.set_drive(0, 1, pwm, pwm)
+
+class ReplayCompass:
+    # stand-in for Compass, samples keep their recorded timestamps
+    STATUS_DRDY = Compass.STATUS_DRDY
+    STATUS_OVL = Compass.STATUS_OVL
+    STATUS_DOR = Compass.STATUS_DOR
+    DATA_RATE = Compass.DATA_RATE
+    to_heading = staticmethod(Compass.to_heading)
+
+    def __init__(self, recording: Recording, clock: ReplayClock):
+        self.log = recording.compass
+        self.clock = clock
+        self.index = 0
+
+    def is_data_ready(self) -> bool:
+        return self.index < len(self.log)
+
+    def get_sample(self) -> CompassSample:
+        index = min(self.index, len(self.log) - 1)
+        self.index += 1
+        columns = self.log.columns
+        self.clock.wait_until(columns['timestamp'][index])
+        return CompassSample(float(columns['timestamp'][index]), int(columns['x'][index]), int(columns['y'][index]), int(columns['z'][index]), int(columns['temperature'][index]), int(columns['status'][index]))
+
+    def wait_for_sample(self, last_timestamp: Optional[float] = None, timeout: float = 0.05, poll_interval: float = 0.0005) -> Optional[CompassSample]:
+        if not self.is_data_ready():
+            time.sleep(timeout)
+            return None
+        return self.get_sample()
+
+    def get_heading(self, heading_correction: float = Compass.HEADING_CORRECTION) -> float:
+        return Compass.to_heading(self.get_sample(), heading_correction)
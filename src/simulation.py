@@ -0,0 +1,276 @@
+import math
+import random
+import time
+from collections import defaultdict, deque
+from threading import Lock
+from typing import Deque, Dict, List, Optional, Tuple
+from compass import Compass
+from i2c_bus import BusArbiter
+
+# simulated I2C bus with the motor/servo/sonic shield (0x18) and the QMC5883L compass (0x0d) in a scripted 2D world
+# distances in cm, angles in degrees, headings clockwise from north (+y), robot coordinates: x = right, y = ahead
+
+class Environment:
+    def __init__(self, obstacles: Optional[List[Tuple[float, float, float]]] = None, max_speed: float = 40.0, wheel_base: float = 15.0):
+        self.lock = Lock()
+        self.obstacles = list(obstacles or []) # circles (x, y, radius) in world coordinates
+        self.max_speed = max_speed # cm/s at pwm 1000
+        self.wheel_base = wheel_base
+        self.x = 0.0
+        self.y = 0.0
+        self.heading = 0.0
+        self.wheel_speeds = (0.0, 0.0) # right (motor 1), left (motor 2)
+        self.updated = time.monotonic()
+
+    def _integrate(self, now: float):
+        dt = now - self.updated
+        self.updated = now
+        if dt <= 0:
+            return
+        right, left = self.wheel_speeds
+        speed = (right + left) / 2
+        self.heading = (self.heading + math.degrees((left - right) / self.wheel_base * dt)) % 360
+        self.x += speed * math.sin(math.radians(self.heading)) * dt
+        self.y += speed * math.cos(math.radians(self.heading)) * dt
+
+    def get_pose(self) -> Tuple[float, float, float]:
+        with self.lock:
+            self._integrate(time.monotonic())
+            return self.x, self.y, self.heading
+
+    def set_motors(self, dir1: int, dir2: int, pwm1: int, pwm2: int):
+        with self.lock:
+            self._integrate(time.monotonic())
+            right = self.max_speed * min(pwm1, 1000) / 1000 * (1 if dir1 else -1)
+            left = self.max_speed * min(pwm2, 1000) / 1000 * (1 if dir2 else -1)
+            self.wheel_speeds = (right, left)
+
+    def set_pose(self, x: float, y: float, heading: float):
+        with self.lock:
+            self.updated = time.monotonic()
+            self.x, self.y, self.heading = x, y, heading % 360
+
+    def range(self, bearing: float, beam_width: float = 15.0, rays: int = 5) -> float:
+        # nearest obstacle within the sonar cone around `bearing` (relative to the robot heading), inf if none
+        x, y, heading = self.get_pose()
+        nearest = math.inf
+        for i in range(rays):
+            direction = math.radians(heading + bearing + beam_width * (i / (rays - 1) - 0.5))
+            dx, dy = math.sin(direction), math.cos(direction)
+            for ox, oy, radius in self.obstacles:
+                # ray / circle intersection
+                fx, fy = x - ox, y - oy
+                b = fx * dx + fy * dy
+                c = fx * fx + fy * fy - radius * radius
+                discriminant = b * b - c
+                if discriminant < 0:
+                    continue
+                distance = -b - math.sqrt(discriminant)
+                if 0 <= distance < nearest:
+                    nearest = distance
+        return nearest
+
+class ShieldDevice:
+    # motor/servo/sonic shield: 16 bit registers written as [high, low] blocks, sonic echo time in us at 12/13
+    SERVO_SPEED = 500.0 # deg/s
+    PING_INTERVAL = 0.01
+    SOUND_FACTOR = 0.5 * 343.0 / 10000.0
+
+    def __init__(self, environment: Environment, noise: float = 0.3, dropout_rate: float = 0.0, outlier_rate: float = 0.0, seed: int = 0,
+                 servo_dead_time: float = 0.0, servo_reverse_speed: Optional[float] = None, servo_backlash: float = 0.0):
+        self.environment = environment
+        self.noise = noise
+        self.dropout_rate = dropout_rate
+        self.outlier_rate = outlier_rate # specular reflections / crosstalk: an echo from anywhere in range
+        self.random = random.Random(seed)
+        self.registers: Dict[int, int] = defaultdict(int)
+        self.pointer = 0
+        # servo: a new pulse width is taken up dead_time after the write (PWM frame, dead band), the gear then moves at
+        # SERVO_SPEED towards increasing angles and servo_reverse_speed towards decreasing ones (load, cable drag),
+        # the horn (and the sensor on it) follows the gear through servo_backlash degrees of play
+        self.servo_dead_time = servo_dead_time
+        self.servo_reverse_speed = servo_reverse_speed or self.SERVO_SPEED
+        self.servo_backlash = servo_backlash
+        self.servo_commands: Deque[Tuple[float, float]] = deque()
+        self.servo_target = 90.0
+        self.servo_gear = 90.0
+        self.servo_angle = 90.0
+        self.servo_updated = time.monotonic()
+        self.ping_angles: Deque[Tuple[float, float]] = deque(maxlen=10000) # (time, horn angle) of every ping
+        self.echo_time = 0
+        self.pinged = 0.0
+        self.motor_writes: List[Tuple[float, int, int]] = []
+
+    def _move_servo(self, now: float):
+        elapsed = now - self.servo_updated
+        if elapsed <= 0:
+            return
+        self.servo_updated = now
+        difference = self.servo_target - self.servo_gear
+        step = (self.SERVO_SPEED if difference > 0 else self.servo_reverse_speed) * elapsed
+        self.servo_gear += max(-step, min(step, difference))
+        play = self.servo_backlash / 2
+        self.servo_angle = min(max(self.servo_angle, self.servo_gear - play), self.servo_gear + play)
+
+    def _servo_position(self, now: float) -> float:
+        while self.servo_commands and self.servo_commands[0][0] <= now:
+            applied, target = self.servo_commands.popleft()
+            self._move_servo(applied)
+            self.servo_target = target
+        self._move_servo(now)
+        return self.servo_angle
+
+    def _ping(self, now: float):
+        if now - self.pinged < self.PING_INTERVAL:
+            return
+        self.pinged = now
+        angle = self._servo_position(now)
+        self.ping_angles.append((now, angle))
+        bearing = 90.0 - angle # servo 90 = ahead, larger angles to the left
+        distance = self.environment.range(bearing)
+        if self.random.random() < self.outlier_rate:
+            self.echo_time = int(self.random.uniform(3.0, 200.0) / self.SOUND_FACTOR)
+        elif math.isinf(distance) or self.random.random() < self.dropout_rate:
+            self.echo_time = 0xffff
+        else:
+            self.echo_time = int(max(distance + self.random.gauss(0, self.noise), 0) / self.SOUND_FACTOR)
+
+    def write(self, register: int, data: List[int]):
+        now = time.monotonic()
+        if len(data) >= 2:
+            value = data[0] << 8 | data[1]
+            self.registers[register] = value
+            if register == 0:
+                self._servo_position(now)
+                self.servo_commands.append((now + self.servo_dead_time, (value - 500) * 180.0 / 2000))
+                self._servo_position(now)
+            elif 4 <= register <= 7:
+                self.motor_writes.append((now, register, value))
+                self.environment.set_motors(self.registers[6], self.registers[7], self.registers[4], self.registers[5])
+        self.pointer = register
+
+    def read(self, register: int, length: int) -> List[int]:
+        self._ping(time.monotonic())
+        values = []
+        for offset in range(length):
+            target = register + offset
+            if target == 12:
+                values.append(min(self.echo_time >> 8, 0xff))
+            elif target == 13:
+                values.append(self.echo_time & 0xff)
+            else:
+                values.append(self.registers[target] & 0xff)
+        return values
+
+class CompassDevice:
+    # QMC5883L: continuous conversions at the configured rate, DRDY until the data registers are read
+    def __init__(self, environment: Environment, data_rate: float = 200.0, field: float = 3000.0, noise: float = 10.0, seed: int = 0):
+        self.environment = environment
+        self.period = 1.0 / data_rate
+        self.field = field
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.registers: Dict[int, int] = defaultdict(int)
+        self.start = time.monotonic()
+        self.last_read_conversion = -1
+        self.pointer = 0
+
+    def _conversion(self, now: float) -> int:
+        return int((now - self.start) / self.period)
+
+    def write(self, register: int, data: List[int]):
+        for offset, value in enumerate(data):
+            self.registers[register + offset] = value
+        self.pointer = register
+
+    def read(self, register: int, length: int) -> List[int]:
+        now = time.monotonic()
+        conversion = self._conversion(now)
+        if register < Compass.STATUS_REGISTER:
+            # reading data registers clears DRDY, skipped conversions raise DOR
+            _, _, heading = self.environment.get_pose()
+            angle = math.radians(heading - Compass.HEADING_CORRECTION)
+            values = [ int(self.field * math.cos(angle) + self.random.gauss(0, self.noise)), int(self.field * math.sin(angle) + self.random.gauss(0, self.noise)), 0 ]
+            status = (Compass.STATUS_DRDY if conversion > self.last_read_conversion else 0) | (Compass.STATUS_DOR if conversion > self.last_read_conversion + 1 else 0)
+            self.last_read_conversion = conversion
+            data = []
+            for value in values:
+                value &= 0xffff
+                data += [ value & 0xff, value >> 8 ]
+            data += [ status, 0, 0 ]
+        else:
+            data = [ 0 ] * 9
+            data[Compass.STATUS_REGISTER] = Compass.STATUS_DRDY if conversion > self.last_read_conversion else 0
+        registers = { index: value for index, value in enumerate(data) }
+        return [ registers.get(register + offset, self.registers[register + offset]) for offset in range(length) ]
+
+class SimulatedBus:
+    # smbus.SMBus stand-in routing to simulated devices, sleeps for the wire time of every transaction (100 kHz by default)
+    def __init__(self, devices: Dict[int, object], clock: int = 100000, overhead: float = 0.00002, error_rate: float = 0.0, seed: int = 0):
+        self.devices = devices
+        self.byte_time = 9.0 / clock
+        self.overhead = overhead
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = Lock() # one physical bus
+        self.transactions: Dict[int, int] = defaultdict(int)
+        self.busy_time: Dict[int, float] = defaultdict(float)
+
+    def _transaction(self, addr: int, size: int):
+        duration = self.overhead + size * self.byte_time
+        self.transactions[addr] += 1
+        self.busy_time[addr] += duration
+        time.sleep(duration)
+        if addr not in self.devices:
+            raise IOError('No device at 0x%02x' % addr)
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise IOError('Simulated I2C error')
+        return self.devices[addr]
+
+    def reset_counters(self):
+        self.transactions.clear()
+        self.busy_time.clear()
+
+    def total_transactions(self) -> int:
+        return sum(self.transactions.values())
+
+    def open(self, bus: int):
+        pass
+
+    def close(self):
+        pass
+
+    def write_byte(self, addr: int, value: int):
+        with self.lock:
+            self._transaction(addr, 2).pointer = value
+
+    def read_byte(self, addr: int) -> int:
+        with self.lock:
+            device = self._transaction(addr, 2)
+            return device.read(device.pointer, 1)[0]
+
+    def write_byte_data(self, addr: int, register: int, value: int):
+        with self.lock:
+            self._transaction(addr, 3).write(register, [value & 0xff])
+
+    def read_byte_data(self, addr: int, register: int) -> int:
+        with self.lock:
+            return self._transaction(addr, 4).read(register, 1)[0]
+
+    def write_i2c_block_data(self, addr: int, register: int, data: List[int]):
+        with self.lock:
+            self._transaction(addr, 2 + len(data)).write(register, list(data))
+
+    def read_i2c_block_data(self, addr: int, register: int, length: int) -> List[int]:
+        with self.lock:
+            return self._transaction(addr, 3 + length).read(register, length)
+
+class Simulation:
+    # one environment behind one bus, the shared arbiter goes into Board(bus=...) and Compass(bus=...)
+    def __init__(self, obstacles: Optional[List[Tuple[float, float, float]]] = None, sonar_noise: float = 0.3, sonar_dropout_rate: float = 0.0, error_rate: float = 0.0, seed: int = 0,
+                 sonar_outlier_rate: float = 0.0, servo_dead_time: float = 0.0, servo_reverse_speed: Optional[float] = None, servo_backlash: float = 0.0):
+        self.environment = Environment(obstacles)
+        self.shield = ShieldDevice(self.environment, sonar_noise, sonar_dropout_rate, sonar_outlier_rate, seed, servo_dead_time, servo_reverse_speed, servo_backlash)
+        self.compass = CompassDevice(self.environment, seed=seed)
+        self.bus = SimulatedBus({ 0x18: self.shield, 0x0d: self.compass }, error_rate=error_rate, seed=seed)
+        self.arbiter = BusArbiter(self.bus)
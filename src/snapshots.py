@@ -0,0 +1,40 @@
+import time
+from threading import Condition
+from typing import Any, NamedTuple, Optional
+
+class Snapshot(NamedTuple):
+    version: int # increases by one per published value
+    timestamp: float # capture time (time.monotonic)
+    value: Any
+
+class SnapshotStore:
+    # latest value of one stream: the producer publishes under a condition, readers take the current snapshot
+    # without locking (a single reference read) and never hold up the producer; any number of readers see every value
+    def __init__(self):
+        self.condition = Condition()
+        self.latest: Optional[Snapshot] = None
+        self.version = 0
+
+    def publish(self, value: Any, timestamp: Optional[float] = None) -> int:
+        with self.condition:
+            self.version += 1
+            self.latest = Snapshot(self.version, timestamp if timestamp is not None else time.monotonic(), value)
+            self.condition.notify_all()
+            return self.version
+
+    def get(self) -> Optional[Snapshot]:
+        return self.latest
+
+    def get_value(self) -> Any:
+        latest = self.latest
+        return latest.value if latest is not None else None
+
+    def wait_for(self, version: int = 0, timeout: Optional[float] = None) -> Optional[Snapshot]:
+        # the latest snapshot once it is newer than `version` (0: any), None on timeout
+        latest = self.latest
+        if latest is not None and latest.version > version:
+            return latest
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.latest is not None and self.latest.version > version, timeout):
+                return None
+            return self.latest
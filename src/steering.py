@@ -0,0 +1,273 @@
+import logging
+import math
+import time
+import numpy as np
+from threading import Thread
+from typing import Callable, NamedTuple, Optional, Tuple
+from compass_sensor import CompassSensor
+from distance_sensor import DistanceSensor
+from follow_controller import PID, rate_limit
+from motor_controller import MotorController
+from vision import FIELD_OF_VIEW, WIDTH, TargetDetector
+from metrics import registry
+
+# profile coordinates as from DistanceSensor: x = right, y = ahead (cm); bearings in degrees, clockwise (to the right) > 0
+
+class Steering(NamedTuple):
+    bearing: Optional[float] # chosen direction relative to the robot, None: every direction is blocked
+    clearance: float # nearest (widened) obstacle in that direction, inf: nothing seen
+
+def target_bearing(x: float, width: int = WIDTH, field_of_view: float = FIELD_OF_VIEW) -> float:
+    # pinhole camera: bearing of image column x
+    return math.degrees(math.atan((x - width / 2) / (width / 2) * math.tan(math.radians(field_of_view / 2))))
+
+class VectorFieldHistogram:
+    # polar histogram (VFH+) of the nearest obstacle per bearing bin, each obstacle widened by the angle the robot needs to
+    # pass it. A bin becomes blocked below `near` and free again only beyond `far`, and moving away from the previous
+    # direction costs, so the choice does not flap between two similar gaps. Bins are kept in the world frame (compass
+    # heading): the sonar only sweeps `sensed_field`, obstacles outside it are remembered as world points for `memory`
+    # seconds while the robot turns away from them, seen from the robot's position if known (no odometry: turning in
+    # place). Without a heading only the current profile counts.
+    # Binning is O(points), widening O(bins) per obstacle bin, the choice of direction one vectorized pass over the bins.
+    def __init__(self, bin_width: float = 5.0, field: float = 180.0, sensed_field: float = 44.0, robot_radius: float = 9.0,
+                 clearance: float = 8.0, near: float = 30.0, far: float = 40.0, memory: float = 3.0,
+                 target_weight: float = 5.0, ahead_weight: float = 2.0, previous_weight: float = 2.0):
+        self.bin_width = bin_width
+        self.bins = int(round(360.0 / bin_width))
+        self.centres = (np.arange(self.bins) + 0.5) * bin_width
+        self.field = field # directions to choose from, centred ahead
+        self.sensed_field = sensed_field
+        self.radius = robot_radius + clearance
+        self.padding = int(math.ceil(90.0 / bin_width)) + 1 # the widest widening, for obstacles within `radius`
+        self.near = near
+        self.far = far
+        self.memory = memory
+        self.target_weight = target_weight
+        self.ahead_weight = ahead_weight
+        self.previous_weight = previous_weight
+        self.points = np.zeros((0, 2)) # remembered obstacles, world x, y
+        self.times = np.zeros(0)
+        self.blocked = np.zeros(self.bins, dtype=bool)
+        self.previous: Optional[float] = None # world bearing
+        self.update_time = registry.histogram('steering.update')
+
+    def reset(self):
+        self.points = np.zeros((0, 2))
+        self.times = np.zeros(0)
+        self.blocked[:] = False
+        self.previous = None
+
+    def _widen(self, nearest: np.ndarray) -> np.ndarray:
+        # every bin sees the nearest obstacle whose widening (asin(radius / distance)) reaches it: the widened intervals are
+        # written farthest first into a padded copy (nearer ones overwrite), the padding wraps around 0/360
+        occupied = np.flatnonzero(np.isfinite(nearest))
+        if not len(occupied):
+            return nearest.copy()
+        distances = nearest[occupied]
+        reach = np.floor(np.degrees(np.arcsin(np.minimum(1.0, self.radius / distances))) / self.bin_width + 0.5).astype(np.int64)
+        padding = self.padding
+        padded = np.full(self.bins + 2 * padding, np.inf)
+        order = np.argsort(-distances)
+        for centre, width, distance in zip((occupied[order] + padding).tolist(), reach[order].tolist(), distances[order].tolist()):
+            padded[centre - width:centre + width + 1] = distance
+        widened = padded[padding:padding + self.bins].copy()
+        np.minimum(widened[-padding:], padded[:padding], out=widened[-padding:])
+        np.minimum(widened[:padding], padded[padding + self.bins:], out=widened[:padding])
+        return widened
+
+    def update(self, coordinates: np.ndarray, target: Optional[float] = None, heading: Optional[float] = None,
+               timestamp: Optional[float] = None, position: Optional[Tuple[float, float]] = None, headings: Optional[np.ndarray] = None) -> Steering:
+        # coordinates: (n, 2+) profile, target: bearing relative to the robot (None: keep going ahead), heading: compass,
+        # position: world x, y of the robot (cm), headings: the heading when each point was read (default: heading)
+        start = time.perf_counter()
+        now = timestamp if timestamp is not None else time.monotonic()
+        remember = heading is not None and self.memory > 0
+        heading = heading if heading is not None else 0.0
+        x, y = position if position is not None else (0.0, 0.0)
+        relative = (self.centres - heading + 180) % 360 - 180
+        # forget what is too old and what the profile sweeps again
+        dx, dy = self.points[:, 0] - x, self.points[:, 1] - y
+        swept = np.abs((np.degrees(np.arctan2(dx, dy)) - heading + 180) % 360 - 180) <= self.sensed_field / 2
+        keep = (now - self.times <= self.memory) & ~swept & remember
+        if len(coordinates):
+            radians = np.radians(headings) if headings is not None and remember else math.radians(heading)
+            coordinates = np.asarray(coordinates)
+            # robot right = (cos, -sin), ahead = (sin, cos) in world coordinates
+            points = np.stack([ x + coordinates[:, 0] * np.cos(radians) + coordinates[:, 1] * np.sin(radians),
+                                y - coordinates[:, 0] * np.sin(radians) + coordinates[:, 1] * np.cos(radians) ], axis=1)
+            self.points = np.concatenate([ self.points[keep], points ])
+            self.times = np.concatenate([ self.times[keep], np.full(len(points), now) ])
+        else:
+            self.points, self.times = self.points[keep], self.times[keep]
+
+        nearest = np.full(self.bins, np.inf)
+        if len(self.points):
+            dx, dy = self.points[:, 0] - x, self.points[:, 1] - y
+            index = np.floor(np.degrees(np.arctan2(dx, dy)) % 360 / self.bin_width).astype(np.int64) % self.bins
+            np.minimum.at(nearest, index, np.hypot(dx, dy))
+
+        widened = self._widen(nearest)
+        self.blocked = np.where(widened < self.near, True, np.where(widened > self.far, False, self.blocked))
+
+        candidates = ~self.blocked & (np.abs(relative) <= self.field / 2)
+        if not candidates.any():
+            self.previous = None
+            self.update_time.record(time.perf_counter() - start)
+            return Steering(None, float(widened[np.abs(relative) <= self.field / 2].min()))
+        goal = target if target is not None else 0.0
+        # the direction within each bin closest to the goal: the goal itself if its bin is free
+        directions = np.clip(goal, relative - self.bin_width / 2, relative + self.bin_width / 2)
+        previous = (self.previous - heading + 180) % 360 - 180 if self.previous is not None else goal
+        cost = self.target_weight * np.abs(directions - goal) + self.ahead_weight * np.abs(directions) + self.previous_weight * np.abs(directions - previous)
+        best = int(np.argmin(np.where(candidates, cost, np.inf)))
+        bearing = float(directions[best])
+        self.previous = (bearing + heading) % 360
+        self.update_time.record(time.perf_counter() - start)
+        return Steering(bearing, float(widened[best]))
+
+class AvoidanceController:
+    # drives towards the detector's target along the histogram's free direction: one update per (partial) sonar profile,
+    # commands go to MotorController.drive, which only queues them. Boxed in, it turns on the spot towards the target.
+    # With a compass the target's world bearing is kept for `target_memory` seconds: going around an obstacle usually
+    # turns it out of the camera's view. position: callable returning the robot's world (x, y) in cm, if there is odometry.
+    # The chosen direction is the sonar's focus (see DistanceSensor.set_focus), the whole arc is swept while turning faster
+    # than turning_rate (deg/s, compass) or, without a compass, steering harder than half of max_angular.
+    def __init__(self, distance_sensor: DistanceSensor, detector: TargetDetector, motor_controller: MotorController,
+                 compass_sensor: Optional[CompassSensor] = None, histogram: Optional[VectorFieldHistogram] = None,
+                 position: Optional[Callable[[], Tuple[float, float]]] = None,
+                 kp: float = 0.4, ki: float = 0.0, kd: float = 0.02, max_angular: float = 0.3, max_angular_rate: float = 3.0,
+                 linear_speed: float = 0.5, max_linear_rate: float = 1.0, slow_down_offset: float = 0.5, slow_distance: float = 50.0,
+                 turn_speed: float = 0.2, lost_timeout: float = 0.5, target_memory: float = 5.0, field_of_view: float = FIELD_OF_VIEW, width: int = WIDTH,
+                 turning_rate: float = 45.0):
+        self.logger = logging.getLogger('AvoidanceController')
+        self.distance_sensor = distance_sensor
+        self.detector = detector
+        self.motor_controller = motor_controller
+        self.compass_sensor = compass_sensor
+        self.histogram = histogram or VectorFieldHistogram()
+        self.position = position
+        self.pid = PID(kp, ki, kd, max_angular)
+        self.max_angular = max_angular
+        self.turning_rate = turning_rate
+        self.max_angular_rate = max_angular_rate # per second
+        self.linear_speed = linear_speed
+        self.max_linear_rate = max_linear_rate # per second
+        self.slow_down_offset = slow_down_offset # steering offset at which the linear speed reaches 0
+        self.slow_distance = slow_distance # clearance below which the linear speed drops
+        self.turn_speed = turn_speed
+        self.lost_timeout = lost_timeout
+        self.target_memory = target_memory
+        self.field_of_view = field_of_view
+        self.width = width
+        self.linear = 0.0
+        self.angular = 0.0
+        self.steering: Optional[Steering] = None
+        self.goal: Optional[float] = None # world bearing of the target
+        self.goal_seen = 0.0
+        self.last_update: Optional[float] = None
+        self.last_command: Optional[float] = None
+
+        # Thread control
+        self.running = False
+        self.thread = None
+        self.bearing_gauge = registry.gauge('steering.bearing')
+        self.blocked = registry.counter('steering.blocked')
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = Thread(target=self._steering_loop, daemon=True)
+            self.thread.start()
+            self.logger.info('Avoidance controller started')
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        self.motor_controller.drive(0, 0)
+        self.logger.info('Avoidance controller stopped')
+
+    def reset(self):
+        self.pid.reset()
+        self.linear = 0.0
+        self.angular = 0.0
+        self.last_update = None
+        self.last_command = None
+        self.goal = None
+
+    def _heading(self, timestamp: float) -> Optional[float]:
+        if self.compass_sensor is None:
+            return None
+        headings = self.compass_sensor.heading_at(np.array([ timestamp ]))
+        return float(headings[0]) if headings is not None else None
+
+    def _target(self, heading: Optional[float]) -> Optional[float]:
+        # target bearing relative to the robot at `heading`. With a compass the detection is turned into a world bearing
+        # with the heading at its own timestamp (the robot may have turned since) and remembered; without, it is predicted
+        now = time.monotonic()
+        snapshot = self.detector.targets.get()
+        if snapshot is not None and now - snapshot.timestamp <= self.lost_timeout:
+            seen = self._heading(snapshot.timestamp) if heading is not None else None
+            if seen is None:
+                return target_bearing(self.detector.predict_target(snapshot.value).x, self.width, self.field_of_view)
+            self.goal = (seen + target_bearing(snapshot.value.x, self.width, self.field_of_view)) % 360
+            self.goal_seen = snapshot.timestamp
+        if heading is not None and self.goal is not None and now - self.goal_seen <= self.target_memory:
+            return (self.goal - heading + 180) % 360 - 180
+        return None
+
+    def _turning(self) -> bool:
+        # measured with a compass, commanded without
+        estimate = self.compass_sensor.get_heading() if self.compass_sensor is not None else None
+        if estimate is not None:
+            return abs(estimate.turn_rate) > self.turning_rate
+        return abs(self.angular) > self.max_angular / 2
+
+    def update(self, profile: np.ndarray, timestamp: float):
+        heading = self._heading(timestamp)
+        target = self._target(heading)
+        # each point turned by the heading it was read at: the profile holds readings up to a sweep old
+        headings = self.compass_sensor.heading_at(profile[:, 2]) if heading is not None and len(profile) and profile.shape[1] > 2 else None
+        self.steering = self.histogram.update(profile, target, heading, timestamp, self.position() if self.position else None, headings)
+        if target is None:
+            self.distance_sensor.set_focus(None)
+            if self.last_update is not None:
+                self.logger.debug('Target lost')
+                self.reset()
+                self.motor_controller.drive(0, 0)
+            return
+
+        dt = timestamp - self.last_update if self.last_update is not None else 0.0
+        self.last_update = timestamp
+        if self.steering.bearing is None:
+            self.blocked.inc()
+            self.pid.reset()
+            linear, angular = 0.0, math.copysign(self.turn_speed, target)
+        else:
+            offset = self.steering.bearing / (self.field_of_view / 2)
+            angular = self.pid.update(offset, dt)
+            linear = self.linear_speed * max(0.0, 1.0 - abs(offset) / self.slow_down_offset) * min(1.0, self.steering.clearance / self.slow_distance)
+            self.bearing_gauge.set(self.steering.bearing)
+
+        now = time.monotonic()
+        elapsed = min(now - self.last_command, self.lost_timeout) if self.last_command is not None else self.lost_timeout
+        self.last_command = now
+        self.angular = rate_limit(self.angular, angular, self.max_angular_rate, elapsed)
+        self.linear = rate_limit(self.linear, linear, self.max_linear_rate, elapsed)
+        self.motor_controller.drive(self.linear, self.angular, self.lost_timeout)
+        # boxed in: turning on the spot
+        self.distance_sensor.set_focus(target if self.steering.bearing is None else self.steering.bearing, self.steering.bearing is None or self._turning())
+
+    def _steering_loop(self):
+        self.logger.info('Steering loop started')
+
+        version = 0
+        while self.running:
+            snapshot = self.distance_sensor.wait_for_distances(version, self.lost_timeout)
+            if snapshot is None:
+                # no fresh profile: the last command runs out and the motors stop
+                continue
+            version = snapshot.version
+            self.update(snapshot.value, snapshot.timestamp)
+
+        self.logger.info('Steering loop stopped')
@@ -1,14 +1,15 @@
 from functools import wraps
 import time
-import logging
+from metrics import registry
 
 def timer(func):
-    logger = logging.getLogger('Timer')
+    # records every call's latency in the metrics registry histogram named after the function
+    histogram = registry.histogram(func.__qualname__)
     @wraps(func)
     def wrapper(*args, **kwargs):
         start = time.perf_counter()
-        result = func(*args, **kwargs)
-        end = time.perf_counter()
-        logger.info('Latency: %.6f sec', end - start)
-        return result
-    return wrapper
\ No newline at end of file
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.record(time.perf_counter() - start)
+    return wrapper
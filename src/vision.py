@@ -1,46 +1,287 @@
-from ultralytics.engine.results import Results
-from ultralytics import YOLO
+# backend libraries (ultralytics / torch, onnxruntime) are imported when a detector loads its model, not here
 import cv2
-from matplotlib import pyplot as plt
 import numpy as np
-from typing import Optional, Tuple
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+from collections import deque
 from collections.abc import Callable
-from threading import Thread, Lock
+from threading import Condition, Event, Thread, Lock
+import math
+import os
+import queue
 import time
 import logging
 from timer import timer
+from metrics import registry
+from snapshots import Snapshot, SnapshotStore
+from inference import Autotuner, InferenceSettings, TuningResult, load_network, model_fingerprint, thread_options
 from abc import ABC, abstractmethod
 
 WIDTH = 640
 HEIGHT = 480
 FPS = 30
+FIELD_OF_VIEW = 62.0 # horizontal, degrees
+
+class Frame(NamedTuple):
+    slot: int
+    sequence: int
+    timestamp: float
+    image: np.ndarray
+
+class FrameRing:
+    # preallocated frame buffers: the capture thread fills a free slot in place, the detector reads the newest one without copying
+    def __init__(self, size: int = 3, shape: Tuple[int, int, int] = (HEIGHT, WIDTH, 3)):
+        self.buffers: List[np.ndarray] = [ np.zeros(shape, dtype=np.uint8) for _ in range(size) ]
+        self.sequences = [ -1 ] * size
+        self.timestamps = [ 0.0 ] * size
+        self.condition = Condition()
+        self.latest: Optional[int] = None
+        self.reading: Optional[int] = None
+        self.sequence = 0
+        self.last_read = -1
+        self.dropped = 0
+        self.dropped_counter = registry.counter('camera.frames_dropped')
+
+    def acquire(self) -> int:
+        # a slot that is neither being read nor holds the newest frame
+        with self.condition:
+            for slot in range(len(self.buffers)):
+                if slot != self.reading and slot != self.latest:
+                    return slot
+        raise RuntimeError('No free frame slot')
+
+    def publish(self, slot: int, image: np.ndarray, timestamp: float) -> int:
+        with self.condition:
+            if image is not self.buffers[slot]:
+                # the backend allocated its own array (e.g. size changed), adopt it
+                self.buffers[slot] = image
+            if self.latest is not None and self.sequences[self.latest] > self.last_read:
+                self.dropped += 1
+                self.dropped_counter.inc()
+            self.sequences[slot] = self.sequence
+            self.timestamps[slot] = timestamp
+            self.sequence += 1
+            self.latest = slot
+            self.condition.notify_all()
+            return self.sequences[slot]
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[Frame]:
+        # blocks until a frame newer than the last one read is published, the slot stays reserved until release()
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.latest is not None and self.sequences[self.latest] > self.last_read, timeout):
+                return None
+            slot = self.latest
+            self.reading = slot
+            self.last_read = self.sequences[slot]
+            return Frame(slot, self.sequences[slot], self.timestamps[slot], self.buffers[slot])
+
+    def release(self, frame: Frame):
+        with self.condition:
+            if self.reading == frame.slot:
+                self.reading = None
+
+    def wake(self):
+        with self.condition:
+            self.condition.notify_all()
+
+class Target(NamedTuple):
+    x: int
+    y: int
+    width: int
+    height: int
+    source: str # 'detection' or 'tracking'
+    confidence: float
+    timestamp: float # capture time of the frame
+    sequence: int
+    uncertainty: float = 0.0 # position standard deviation in pixels
+    age: float = 0.0 # seconds since capture
+
+class TargetPredictor:
+    # constant-velocity Kalman filter over the target center, predicts where the target is at command time
+    def __init__(self, acceleration_noise: float = 400.0, measurement_noise: float = 15.0, max_age: float = 1.0):
+        self.acceleration_noise = acceleration_noise # px/s^2
+        self.measurement_noise = measurement_noise # px
+        self.max_age = max_age
+        self.state: Optional[np.ndarray] = None # x, y, vx, vy
+        self.covariance = np.eye(4)
+        self.timestamp = 0.0
+        self.observation = np.array([[1.0, 0, 0, 0], [0, 1.0, 0, 0]])
+
+    def _propagate(self, dt: float) -> Tuple[np.ndarray, np.ndarray]:
+        transition = np.eye(4)
+        transition[0, 2] = transition[1, 3] = dt
+        dt2, dt3, dt4 = dt * dt, dt * dt * dt / 2, dt * dt * dt * dt / 4
+        q = self.acceleration_noise ** 2
+        noise = q * np.array([[dt4, 0, dt3, 0], [0, dt4, 0, dt3], [dt3, 0, dt2, 0], [0, dt3, 0, dt2]])
+        return transition @ self.state, transition @ self.covariance @ transition.T + noise
+
+    def reset(self):
+        self.state = None
+
+    def is_tracking(self, timestamp: float) -> bool:
+        return self.state is not None and timestamp - self.timestamp <= self.max_age
+
+    def update(self, timestamp: float, x: float, y: float):
+        if not self.is_tracking(timestamp):
+            self.state = np.array([x, y, 0.0, 0.0])
+            self.covariance = np.diag([self.measurement_noise ** 2] * 2 + [200.0 ** 2] * 2)
+            self.timestamp = timestamp
+            return
+        state, covariance = self._propagate(max(timestamp - self.timestamp, 0.0))
+        innovation = np.array([x, y]) - self.observation @ state
+        innovation_covariance = self.observation @ covariance @ self.observation.T + np.eye(2) * self.measurement_noise ** 2
+        gain = covariance @ self.observation.T @ np.linalg.inv(innovation_covariance)
+        self.state = state + gain @ innovation
+        self.covariance = (np.eye(4) - gain @ self.observation) @ covariance
+        self.timestamp = max(timestamp, self.timestamp)
+
+    def predict(self, timestamp: float) -> Optional[Tuple[float, float, float]]:
+        # (x, y, position standard deviation) at `timestamp`, None when there is no recent measurement
+        if not self.is_tracking(timestamp):
+            return None
+        state, covariance = self._propagate(max(timestamp - self.timestamp, 0.0))
+        return float(state[0]), float(state[1]), float(np.sqrt((covariance[0, 0] + covariance[1, 1]) / 2))
+
+class TemplateTracker:
+    # follows the last detected box by normalized cross-correlation on a downscaled grayscale search window
+    def __init__(self, scale: float = 0.5, search_margin: float = 0.5, min_score: float = 0.5):
+        self.scale = scale
+        self.search_margin = search_margin
+        self.min_score = min_score
+        self.template: Optional[np.ndarray] = None
+        self.box: Optional[Tuple[int, int, int, int]] = None
+
+    def _crop(self, image: np.ndarray, x1: int, y1: int, x2: int, y2: int) -> np.ndarray:
+        # only the crop is converted and resized, never the full frame
+        crop = cv2.cvtColor(image[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+        return cv2.resize(crop, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def init(self, image: np.ndarray, box: Tuple[int, int, int, int]):
+        x, y, width, height = box
+        height_limit, width_limit = image.shape[:2]
+        x1, y1 = max(x - width // 2, 0), max(y - height // 2, 0)
+        x2, y2 = min(x1 + width, width_limit), min(y1 + height, height_limit)
+        if (x2 - x1) * self.scale < 4 or (y2 - y1) * self.scale < 4:
+            self.template = None
+            return
+        self.template = self._crop(image, x1, y1, x2, y2)
+        self.box = (x1, y1, x2 - x1, y2 - y1)
+
+    def reset(self):
+        self.template = None
+        self.box = None
+
+    def update(self, image: np.ndarray) -> Optional[Tuple[Tuple[int, int, int, int], float]]:
+        # returns the new (center x, center y, width, height) and its match score, None once the target is lost
+        if self.template is None:
+            return None
+        x, y, width, height = self.box
+        height_limit, width_limit = image.shape[:2]
+        margin_x, margin_y = int(width * self.search_margin), int(height * self.search_margin)
+        x1, y1 = max(x - margin_x, 0), max(y - margin_y, 0)
+        x2, y2 = min(x + width + margin_x, width_limit), min(y + height + margin_y, height_limit)
+        search = self._crop(image, x1, y1, x2, y2)
+        if search.shape[0] < self.template.shape[0] or search.shape[1] < self.template.shape[1]:
+            self.reset()
+            return None
+        scores = cv2.matchTemplate(search, self.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, location = cv2.minMaxLoc(scores)
+        if score < self.min_score:
+            self.reset()
+            return None
+        x, y = x1 + int(location[0] / self.scale), y1 + int(location[1] / self.scale)
+        self.box = (x, y, width, height)
+        return (x + width // 2, y + height // 2, width, height), float(score)
 
 class TargetDetector(ABC):
-    def __init__(self, camera_index: int = 0, confidence: float = 0.7, object_class: int = 1, logger_name: str = 'TargetDetector'):
+    def __init__(self, camera_index: int = 0, confidence: float = 0.7, object_class: int = 1, logger_name: str = 'TargetDetector', tracking: bool = False, detection_interval: Optional[int] = None):
         self.logger = logging.getLogger(logger_name)
         self.capture_thread = None
         self.detect_thread = None
+        self.camera_index = camera_index
         self.camera = None
         self.confidence = confidence
         self.object_class = object_class
-        self.image: Optional[any] = None
-        self.has_image: bool = False
-        self.target: Optional[Tuple[int, int]] = None
-        self.image_lock = Lock()
+        self.frames = FrameRing()
+        # every found target, raw (as detected); get_target predicts it to the present
+        self.targets = SnapshotStore()
         self.target_lock = Lock()
         self.running = False
+        self.detections = 0
+        self.target_sequence = -1
+        self.stale_results = 0
+        self.latencies = deque([], maxlen=100)
+        # detect-then-track: the network runs every detection_interval frames (None = from the measured inference time)
+        self.tracker = TemplateTracker() if tracking else None
+        self.detection_interval = detection_interval
+        self.inference_time: Optional[float] = None
+        self.frames_since_detection = 0
+        self.detection_share = 0.5
+        self.predictor = TargetPredictor()
+        self.association_gate = 3.0 # standard deviations around the predicted position
+        self.recorder = None
+        self.settings: Optional[InferenceSettings] = None
+        # the model loads and warms up in the background once started (or up front with load()), until then the
+        # detector is not ready: frames are captured but nothing is detected
+        self.ready = Event()
+        self.load_thread = None
+        self.load_time: Optional[float] = None
+        self.capture_time = registry.histogram('camera.capture')
+        self.frame_age = registry.gauge('detector.frame_age')
+        self.detection_latency = registry.histogram('detector.latency')
+        self.stale_counter = registry.counter('detector.stale_results')
 
-    def start(self):
-        self._call_model(np.zeros((640, 480, 3)))
-        
+    def _open_camera(self):
+        camera = cv2.VideoCapture(self.camera_index)
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, WIDTH)
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, HEIGHT)
+        camera.set(cv2.CAP_PROP_FPS, FPS)
+        camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'YUYV'))
+        return camera
+
+    def _load(self):
+        # detectors with a model load it here (if not loaded yet), importing their backend
+        pass
+
+    def load(self):
+        # blocking: loads the model and warms it up on a frame shaped like the camera's
+        if self.ready.is_set():
+            return
+        start = time.perf_counter()
+        self._load()
+        self._call_model(np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8))
+        self.load_time = time.perf_counter() - start
+        self.logger.info('Model ready after %.2f s', self.load_time)
+        self.ready.set()
+
+    def _load_in_background(self):
+        try:
+            self.load()
+        except Exception as e:
+            self.logger.error('Loading the model failed: %s', e)
+
+    def is_ready(self) -> bool:
+        return self.ready.is_set()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        return self.ready.wait(timeout)
+
+    def _wait_for_model(self) -> bool:
+        while self.running:
+            if self.ready.wait(0.1):
+                return True
+        return False
+
+    def start(self, camera=None):
+        # camera: any cv2.VideoCapture-like source (e.g. a replay), default opens camera_index;
+        # returns right away, the model loads in the background unless load() was called before
         self.running = True
 
-        self.camera = cv2.VideoCapture(0)
-        self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, WIDTH)
-        self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, HEIGHT)
-        self.camera.set(cv2.CAP_PROP_FPS, FPS)
-        self.camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-        self.camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'YUYV'))
+        if not self.ready.is_set():
+            self.load_thread = Thread(target=self._load_in_background, daemon=True)
+            self.load_thread.start()
+
+        self.camera = camera if camera is not None else self._open_camera()
 
         # Start capture thread
         self.camera_thread = Thread(target=self._capture)
@@ -53,113 +294,335 @@ class TargetDetector(ABC):
 
     def _capture(self):
         self.logger.info('Capture thread started')
-        counter = 0
         while self.running:
             try:
+                start = time.perf_counter()
                 for _ in range(2):
                     self.camera.grab()
-                has_image, image = self.camera.retrieve()
-                self.logger.debug("Retrieved: %s, %s, %s", has_image, type(image), counter)
+                timestamp = time.monotonic()
+                slot = self.frames.acquire()
+                # decode straight into the preallocated slot
+                has_image, image = self.camera.retrieve(image=self.frames.buffers[slot])
+                self.logger.debug("Retrieved: %s, %s", has_image, self.frames.sequence)
+                self.capture_time.record(time.perf_counter() - start)
                 if has_image:
-                    with self.image_lock:
-                        self.image = image
-                        self.has_image = True
+                    sequence = self.frames.publish(slot, image, timestamp)
+                    if self.recorder:
+                        # the slot is not rewritten before the next two publishes
+                        self.recorder.record_frame(timestamp, sequence, image)
             finally:
                 time.sleep(1.0 / (FPS-1))
 
     @abstractmethod
-    def _find_object(self, results, image, object_class: int, confidence_threshold: float) -> Optional[Tuple[int, int, int, int]]:
+    def _find_object(self, results, image, object_class: int, confidence_threshold: float, timestamp: Optional[float] = None) -> Optional[Tuple[int, int, int, int, float]]:
+        # (center x, center y, width, height, confidence)
         pass
 
+    def _associate(self, candidates: np.ndarray, timestamp: Optional[float]) -> Optional[Tuple[int, int, int, int, float]]:
+        # candidates: (n, 5) array of center x, center y, width, height, confidence;
+        # keeps following the current target when it is among them, otherwise takes the most confident one
+        if len(candidates) == 0:
+            return None
+        with self.target_lock:
+            prediction = self.predictor.predict(timestamp if timestamp is not None else time.monotonic())
+        best = int(np.argmax(candidates[:, 4]))
+        if prediction is not None:
+            x, y, deviation = prediction
+            distances = np.hypot(candidates[:, 0] - x, candidates[:, 1] - y)
+            closest = int(np.argmin(distances))
+            if distances[closest] <= self.association_gate * deviation + candidates[closest, 2] / 2:
+                best = closest
+        x, y, width, height, confidence = candidates[best]
+        return (int(x), int(y), int(width), int(height), float(confidence))
+
     @abstractmethod
     def _call_model(self, image):
+        # image is the BGR camera frame, channel order is handled by the model input preparation
         pass
 
+    def _apply_settings(self, settings: InferenceSettings):
+        # detectors with a tunable model (re)load it with the backend, input size and threads
+        self.settings = settings
+
+    def _candidate_settings(self) -> List[InferenceSettings]:
+        return []
+
+    def _model_files(self) -> List[str]:
+        return []
+
+    def _measure_settings(self, settings: InferenceSettings, clip: Sequence[np.ndarray]) -> TuningResult:
+        self._apply_settings(settings)
+        self._call_model(clip[0])
+        confidences = []
+        start = time.perf_counter()
+        for image in clip:
+            found_object = self._find_object(self._call_model(image), image, self.object_class, 0.0)
+            confidences.append(found_object[4] if found_object else 0.0)
+        return TuningResult(settings, len(clip) / (time.perf_counter() - start), float(np.mean(confidences)))
+
+    def autotune(self, clip: Sequence[np.ndarray], tuner: Optional[Autotuner] = None, candidates: Optional[List[InferenceSettings]] = None) -> InferenceSettings:
+        # before start(): picks the inference settings on a reference clip of camera frames showing the target
+        # (e.g. Recording.clip()) and applies them, see Autotuner
+        tuner = tuner or Autotuner(min_confidence=self.confidence)
+        candidates = candidates or self._candidate_settings()
+        if not candidates:
+            raise ValueError('No inference settings to tune for %s' % type(self).__name__)
+        context = { 'detector': type(self).__name__, 'object_class': self.object_class, 'frame_shape': list(clip[0].shape), 'models': model_fingerprint(self._model_files()) }
+        settings = tuner.tune(lambda candidate: self._measure_settings(candidate, clip), candidates, context)
+        self._apply_settings(settings)
+        return settings
+
     def _detect(self):
         self.logger.info('Detect thread started')
+        if not self._wait_for_model():
+            return
         while self.running:
+            frame = self.frames.wait(timeout=0.1)
+            if frame is None:
+                continue
+            self.frame_age.set(time.monotonic() - frame.timestamp)
             try:
-                image = None
-                has_image = False
-                with self.image_lock:
-                    if self.has_image:
-                        image = self.image.copy()
-                        has_image = True
-                        self.has_image = False
+                if self.tracker and self.frames_since_detection < self._get_detection_interval() and self._track(frame):
+                    continue
 
-                if has_image:
-                    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                    results = self._call_model(image)
-    
-                    found_object = self._find_object(results, image, self.object_class, self.confidence)
+                start = time.perf_counter()
+                results = self._call_model(frame.image)
+                found_object = self._find_object(results, frame.image, self.object_class, self.confidence, frame.timestamp)
+                elapsed = time.perf_counter() - start
+                self.inference_time = elapsed if self.inference_time is None else 0.9 * self.inference_time + 0.1 * elapsed
+
+                if self.tracker:
+                    self.frames_since_detection = 1
                     if found_object:
-                        x, y, _, _ = found_object
-                        self.logger.debug('Finding: %s %s', x, y)
-                        with self.target_lock:
-                            self.target = (x, y)                
+                        self.tracker.init(frame.image, found_object[:4])
+                    else:
+                        self.tracker.reset()
+                self._publish_target(found_object, frame.sequence, frame.timestamp)
             except Exception as e:
-                self.logger.error('Error', e)
+                self.logger.error('Error: %s', e)
+            finally:
+                self.frames.release(frame)
+
+    def _get_detection_interval(self) -> int:
+        if self.detection_interval is not None:
+            return self.detection_interval
+        if self.inference_time is None:
+            return 1
+        # keep the network to about detection_share of the detector thread's time
+        return 1 + math.ceil(self.inference_time * FPS * (1 - self.detection_share) / self.detection_share)
 
-    def get_target(self):
+    def _track(self, frame: Frame) -> bool:
+        tracked = self.tracker.update(frame.image)
+        if tracked is None:
+            # lost: detect on this frame
+            return False
+        box, score = tracked
+        self.frames_since_detection += 1
+        self._publish_target(box + (score,), frame.sequence, frame.timestamp, 'tracking')
+        return True
+
+    def _publish_target(self, found_object: Optional[Tuple[int, int, int, int, float]], sequence: int, timestamp: float, source: str = 'detection') -> bool:
+        # results may complete out of order, a result older than the last published one is dropped
         with self.target_lock:
-            try:
-                return self.target
-            finally:
-                self.target = None
+            if sequence <= self.target_sequence:
+                self.stale_results += 1
+                self.stale_counter.inc()
+                return False
+            self.target_sequence = sequence
+            self.detections += 1
+            latency = time.monotonic() - timestamp
+            self.latencies.append(latency)
+            self.detection_latency.record(latency)
+            if found_object:
+                x, y, width, height, confidence = found_object
+                self.logger.debug('Finding: %s %s (%s)', x, y, source)
+                self.predictor.update(timestamp, x, y)
+                self.targets.publish(Target(x, y, width, height, source, confidence, timestamp, sequence), timestamp)
+            return True
+
+    def predict_target(self, target: Target, timestamp: Optional[float] = None) -> Target:
+        # the target's position predicted to `timestamp` (default: now) to compensate for pipeline latency
+        timestamp = timestamp if timestamp is not None else time.monotonic()
+        with self.target_lock:
+            prediction = self.predictor.predict(timestamp)
+        if prediction is None:
+            return target._replace(age=timestamp - target.timestamp)
+        x, y, deviation = prediction
+        return target._replace(x=int(round(x)), y=int(round(y)), uncertainty=deviation, age=timestamp - target.timestamp)
+
+    def get_target(self, timestamp: Optional[float] = None) -> Optional[Target]:
+        # the latest target, predicted; not consumed, `age` tells how old the detection is
+        target = self.targets.get_value()
+        return self.predict_target(target, timestamp) if target is not None else None
+
+    def wait_for_target(self, version: int = 0, timeout: Optional[float] = None) -> Optional[Snapshot]:
+        # the first target found after `version`, as a snapshot of the raw target (see predict_target), None on timeout
+        return self.targets.wait_for(version, timeout)
 
     def stop(self):
         self.running = False
+        self.frames.wake()
         del self.camera
 
 
 
 # wget https://github.com/chuanqi305/MobileNet-SSD/raw/master/deploy.prototxt
 # wget https://github.com/chuanqi305/MobileNet-SSD/raw/master/mobilenet_iter_73000.caffemodel
+MOBILENET_PROTOTXT = 'deploy.prototxt'
+MOBILENET_MODEL = 'mobilenet_iter_73000.caffemodel'
+# optional, for the onnxruntime backend: an ONNX export of the same network with the same (1, 1, n, 7) detection output
+MOBILENET_ONNX = 'mobilenet_ssd.onnx'
 
 class TargetDetectorMobileNet(TargetDetector):
-    def __init__(self, camera_index: int = 0, confidence: float = 0.7, object_class: int = 15):
-        super().__init__(camera_index, confidence, object_class, 'TargetDetectorMobileNet')
-        self.mobile_net = cv2.dnn.readNetFromCaffe(
-            'deploy.prototxt',
-            'mobilenet_iter_73000.caffemodel'
-        )
-
-    def _find_object(self, results, image, object_class: int, confidence_threshold: float) -> Optional[Tuple[int, int, int, int]]:
-        for i in range(results.shape[2]):
-            confidence = results[0, 0, i, 2]
-            
-            if confidence > confidence_threshold:
-                object_class_id = int(results[0, 0, i, 1])
-    
-                if object_class_id == object_class:
-                    height, width = image.shape[:2]
-                    box = results[0, 0, i, 3:7] * np.array([width, height, width, height])
-                    (x1, y1, x2, y2) = box.astype('int')
-                    return (int((x2-x1)//2+x1), int((y2-y1)//2+y1), int(x2-x1), int(y2-y1)) #midpoint
-        return None
+    def __init__(self, camera_index: int = 0, confidence: float = 0.7, object_class: int = 15, workers: int = 1, queue_depth: int = 1, tracking: bool = False, detection_interval: Optional[int] = None,
+                 settings: Optional[InferenceSettings] = None):
+        if workers > 1 and tracking:
+            # the worker pool detects on every frame, there is no single detector loop to interleave tracking with
+            raise ValueError('Template tracking needs workers=1, got workers=%d' % workers)
+        super().__init__(camera_index, confidence, object_class, 'TargetDetectorMobileNet', tracking, detection_interval)
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.dropped_frames = 0
+        self.worker_threads: List[Thread] = []
+        self.settings = settings or InferenceSettings()
+        self.mobile_net = None
+
+    def _load_model(self):
+        return load_network(self.settings, MOBILENET_PROTOTXT, MOBILENET_MODEL, MOBILENET_ONNX)
+
+    def _load(self):
+        if self.mobile_net is None:
+            self.mobile_net = self._load_model()
+
+    def _apply_settings(self, settings: InferenceSettings):
+        self.settings = settings
+        self.mobile_net = self._load_model()
+
+    def _candidate_settings(self) -> List[InferenceSettings]:
+        backends = [ ('opencv', 'cpu') ]
+        if cv2.ocl.haveOpenCL():
+            backends.append(('opencv', 'opencl'))
+        if os.path.exists(MOBILENET_ONNX):
+            backends.append(('onnxruntime', 'cpu'))
+        return [ InferenceSettings(backend, target, size, threads) for backend, target in backends for size in (300, 256, 224, 192, 160) for threads in thread_options() ]
+
+    def _model_files(self) -> List[str]:
+        return [ MOBILENET_PROTOTXT, MOBILENET_MODEL, MOBILENET_ONNX ]
+
+    def _prepare_input(self, image):
+        size = self.settings.input_size
+        return cv2.dnn.blobFromImage(image, 0.007843, (size, size), 127.5, swapRB=True)
+
+    def _detect(self):
+        if self.workers <= 1:
+            return super()._detect()
+        if not self._wait_for_model():
+            return
+
+        # one network instance per worker thread, cv2.dnn releases the GIL during forward()
+        jobs = [ queue.Queue(maxsize=self.queue_depth) for _ in range(self.workers) ]
+        networks = [ self.mobile_net ] + [ self._load_model() for _ in range(self.workers - 1) ]
+        self.worker_threads = [ Thread(target=self._inference_worker, args=(network, worker_jobs), daemon=True) for network, worker_jobs in zip(networks, jobs) ]
+        for thread in self.worker_threads:
+            thread.start()
+
+        self.logger.info('Detect dispatcher started with %s workers', self.workers)
+        next_worker = 0
+        while self.running:
+            frame = self.frames.wait(timeout=0.1)
+            if frame is None:
+                continue
+            try:
+                # the blob is the workers' private copy, the frame slot can be reused right away
+                job = (frame.sequence, frame.timestamp, self._prepare_input(frame.image), frame.image.shape)
+            except Exception as e:
+                self.logger.error('Error: %s', e)
+                continue
+            finally:
+                self.frames.release(frame)
+            for offset in range(self.workers):
+                worker = (next_worker + offset) % self.workers
+                try:
+                    jobs[worker].put_nowait(job)
+                    next_worker = (worker + 1) % self.workers
+                    break
+                except queue.Full:
+                    pass
+            else:
+                self.dropped_frames += 1
+                self.frames.dropped_counter.inc()
+
+    def _inference_worker(self, network, jobs: queue.Queue):
+        while self.running:
+            try:
+                sequence, timestamp, blob, shape = jobs.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                network.setInput(blob)
+                results = network.forward()
+                # _find_object only needs the frame shape, a zero-strided view avoids keeping the frame
+                found_object = self._find_object(results, np.broadcast_to(np.uint8(0), shape), self.object_class, self.confidence, timestamp)
+                self._publish_target(found_object, sequence, timestamp)
+            except Exception as e:
+                self.logger.error('Error: %s', e)
+
+    def _find_object(self, results, image, object_class: int, confidence_threshold: float, timestamp: Optional[float] = None) -> Optional[Tuple[int, int, int, int, float]]:
+        detections = results[0, 0]
+        detections = detections[(detections[:, 2] > confidence_threshold) & (detections[:, 1].astype(int) == object_class)]
+        height, width = image.shape[:2]
+        boxes = detections[:, 3:7] * np.array([width, height, width, height])
+        sizes = boxes[:, 2:4] - boxes[:, 0:2]
+        centers = boxes[:, 0:2] + sizes // 2 #midpoint
+        return self._associate(np.column_stack([centers, sizes, detections[:, 2]]), timestamp)
 
     @timer
     def _call_model(self, image):
-        blob = cv2.dnn.blobFromImage(image, 0.007843, (300, 300), 127.5)
+        blob = self._prepare_input(image)
         self.mobile_net.setInput(blob)
         return self.mobile_net.forward()
 
 
 
+YOLO_MODEL = 'yolo12n.pt'
+
 class TargetDetectorYolo(TargetDetector):
-    def __init__(self, camera_index: int = 0, confidence: float = 0.5, object_class: int = 0):
-        super().__init__(camera_index, confidence, object_class, 'TargetDetectorYolo')
-        self.model = YOLO('yolo12n.pt')
-
-    def _find_object(self, results: Results, image, object_class: int, confidence: float) -> Optional[Tuple[int, int, int, int]]:
-        for result in results:
-            boxes = result.boxes
-            self.logger.debug('Boxes: %s', boxes)
-            if (boxes.cls[0] == object_class) and (boxes.conf[0] >= confidence):
-                (x, y, w, h) = boxes.xywh[0]
-                return (int(x), int(y), int(w), int(h))
-        return None
+    # settings: input_size (a multiple of 32) and torch threads, only the 'torch' backend
+    def __init__(self, camera_index: int = 0, confidence: float = 0.5, object_class: int = 0, tracking: bool = False, detection_interval: Optional[int] = None,
+                 settings: Optional[InferenceSettings] = None):
+        super().__init__(camera_index, confidence, object_class, 'TargetDetectorYolo', tracking, detection_interval)
+        self.model = None
+        self.settings = settings or InferenceSettings('torch', 'cpu', WIDTH)
+        if self.settings.backend != 'torch':
+            raise ValueError('Unsupported backend for YOLO: %s' % self.settings.backend)
+
+    def _load(self):
+        if self.model is None:
+            from ultralytics import YOLO # brings in torch, seconds on the Pi
+            self.model = YOLO(YOLO_MODEL)
+        import torch
+        torch.set_num_threads(self.settings.threads or os.cpu_count() or 1)
+
+    def _apply_settings(self, settings: InferenceSettings):
+        if settings.backend != 'torch':
+            raise ValueError('Unsupported backend for YOLO: %s' % settings.backend)
+        self.settings = settings
+        self._load()
+
+    def _candidate_settings(self) -> List[InferenceSettings]:
+        return [ InferenceSettings('torch', 'cpu', size, threads) for size in (640, 480, 416, 320, 256) for threads in thread_options() ]
+
+    def _model_files(self) -> List[str]:
+        return [ YOLO_MODEL ]
+
+    def _find_object(self, results, image, object_class: int, confidence: float, timestamp: Optional[float] = None) -> Optional[Tuple[int, int, int, int, float]]:
+        boxes = results.boxes
+        self.logger.debug('Boxes: %s', boxes)
+        classes = boxes.cls.cpu().numpy()
+        confidences = boxes.conf.cpu().numpy()
+        mask = (classes == object_class) & (confidences >= confidence)
+        return self._associate(np.column_stack([boxes.xywh.cpu().numpy()[mask], confidences[mask]]), timestamp)
 
     @timer
     def _call_model(self, image):
-        return self.model(image, verbose=False)[0]
\ No newline at end of file
+        return self.model(image, imgsz=self.settings.input_size, verbose=False)[0]
\ No newline at end of file